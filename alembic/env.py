@@ -5,6 +5,7 @@ from sqlalchemy.ext.asyncio import async_engine_from_config
 from alembic import context
 import asyncio
 import os
+import re
 
 # this is the alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -25,6 +26,19 @@ target_metadata = Base.metadata
 # my_important_option = config.get_main_option("my_important_option")
 # ... etc.
 
+# Monthly partitions are created by `migrate.py partitions`, not by migrations
+PARTITION_NAME = re.compile(r"_y\d{4}m\d{2}$")
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Leave partitions and the foreign keys Postgres adds for them out of autogenerate"""
+    if type_ == "table" and PARTITION_NAME.search(name):
+        return False
+    if type_ == "index" and PARTITION_NAME.search(object.table.name):
+        return False
+    if type_ == "foreign_key_constraint" and PARTITION_NAME.search(object.referred_table.name):
+        return False
+    return True
+
 def get_url():
     """Get database URL from environment or config"""
     return os.getenv("DATABASE_URL", config.get_main_option("sqlalchemy.url"))
@@ -45,6 +59,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -54,7 +69,7 @@ def run_migrations_offline() -> None:
 
 
 def do_run_migrations(connection: Connection) -> None:
-    context.configure(connection=connection, target_metadata=target_metadata)
+    context.configure(connection=connection, target_metadata=target_metadata, include_object=include_object)
 
     with context.begin_transaction():
         context.run_migrations()
@@ -0,0 +1,126 @@
+"""typed date money and status columns
+
+Revision ID: 017abc613782
+Revises: 456fa370966d
+Create Date: 2026-10-18 18:30:42.405845
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '017abc613782'
+down_revision: Union[str, None] = '456fa370966d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (table, column, new type, conversion from the old value, NOT NULL, old type)
+COLUMNS = [
+    ('quotes', 'quote_expiry_date', 'date', "NULLIF({col}, '')::date", False, 'varchar(20)'),
+    ('quotes', 'policy_status', 'policy_status', '{col}::policy_status', False, 'varchar(20)'),
+    ('gap_premiums', 'wholesale_amount', 'numeric(12, 2)', '{col}::numeric(12, 2)', True, 'double precision'),
+    ('gap_premiums', 'retail_amount', 'numeric(12, 2)', '{col}::numeric(12, 2)', True, 'double precision'),
+    ('bind_requests', 'retail_premium_adjustment', 'numeric(12, 2)', '{col}::numeric(12, 2)', False, 'double precision'),
+    ('finance_details', 'start_date', 'date', '{col}::date', True, 'varchar(20)'),
+    ('applicants', 'date_of_birth', 'date', '{col}::date', True, 'varchar(20)'),
+    ('joint_applicants', 'date_of_birth', 'date', "NULLIF({col}, '')::date", False, 'varchar(20)'),
+]
+
+# Conversion of each new type back to its old one, used by downgrade
+REVERSE_CONVERSIONS = {
+    'date': "to_char({col}, 'YYYY-MM-DD')",
+    'policy_status': '{col}::text',
+    'numeric(12, 2)': '{col}::double precision',
+}
+
+# Rows converted per backfill statement, each committed on its own
+BACKFILL_BATCH_SIZE = 10000
+
+policy_status = sa.Enum('CREATED', 'CONVERTED', name='policy_status')
+
+
+def _tables():
+    tables = {}
+    for table, column, new_type, conversion, not_null, _ in COLUMNS:
+        tables.setdefault(table, []).append((column, new_type, conversion, not_null))
+    return tables
+
+
+def upgrade() -> None:
+    # The typed values are written to new columns next to the old ones. A trigger
+    # keeps them in step with rows written while the backfill runs, the backfill
+    # converts existing rows in short committed batches, and the columns are then
+    # swapped in one short transaction. Existing rows are never rewritten under an
+    # exclusive lock, so quotes can be created and bound throughout.
+    bind = op.get_bind()
+    policy_status.create(bind, checkfirst=True)
+
+    for table, columns in _tables().items():
+        for column, new_type, _, _ in columns:
+            op.execute(f'ALTER TABLE {table} ADD COLUMN {column}_typed {new_type}')
+        assignments = '; '.join(
+            f'NEW.{column}_typed := {conversion.format(col=f"NEW.{column}")}'
+            for column, _, conversion, _ in columns
+        )
+        op.execute(f"""
+            CREATE FUNCTION {table}_typed_sync() RETURNS trigger AS $$
+            BEGIN {assignments}; RETURN NEW; END
+            $$ LANGUAGE plpgsql
+        """)
+        op.execute(f"""
+            CREATE TRIGGER {table}_typed_sync BEFORE INSERT OR UPDATE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION {table}_typed_sync()
+        """)
+
+    with op.get_context().autocommit_block():
+        for table, columns in _tables().items():
+            assignments = ', '.join(
+                f'{column}_typed = {conversion.format(col=column)}'
+                for column, _, conversion, _ in columns
+            )
+            low, high = bind.execute(sa.text(f'SELECT min(id), max(id) FROM {table}')).one()
+            if low is not None:
+                for start in range(low, high + 1, BACKFILL_BATCH_SIZE):
+                    bind.execute(
+                        sa.text(f'UPDATE {table} SET {assignments} WHERE id >= :start AND id < :stop'),
+                        {'start': start, 'stop': start + BACKFILL_BATCH_SIZE},
+                    )
+
+            # NOT NULL is proven by a validated check constraint, which only takes a
+            # SHARE UPDATE EXCLUSIVE lock; SET NOT NULL then skips its own table scan
+            for column, _, _, not_null in columns:
+                if not_null:
+                    op.execute(f'ALTER TABLE {table} ADD CONSTRAINT {column}_typed_not_null '
+                               f'CHECK ({column}_typed IS NOT NULL) NOT VALID')
+                    op.execute(f'ALTER TABLE {table} VALIDATE CONSTRAINT {column}_typed_not_null')
+
+        op.create_index('ix_quotes_policy_status_typed_created_at', 'quotes',
+                        ['policy_status_typed', 'created_at'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+
+    # Swap the columns. Only catalog changes remain, so the exclusive locks are
+    # brief; give up rather than queue behind a long running transaction.
+    op.execute("SET LOCAL lock_timeout = '5s'")
+    for table, columns in _tables().items():
+        op.execute(f'DROP TRIGGER {table}_typed_sync ON {table}')
+        op.execute(f'DROP FUNCTION {table}_typed_sync()')
+        for column, _, _, not_null in columns:
+            op.drop_column(table, column)
+            op.alter_column(table, f'{column}_typed', new_column_name=column)
+            if not_null:
+                op.alter_column(table, column, nullable=False)
+                op.drop_constraint(f'{column}_typed_not_null', table, type_='check')
+    op.execute('ALTER INDEX ix_quotes_policy_status_typed_created_at '
+               'RENAME TO ix_quotes_policy_status_created_at')
+
+
+def downgrade() -> None:
+    # Converting back rewrites each table under an exclusive lock
+    for table, column, new_type, _, _, old_type in COLUMNS:
+        using = REVERSE_CONVERSIONS[new_type].format(col=column)
+        op.execute(f'ALTER TABLE {table} ALTER COLUMN {column} TYPE {old_type} USING {using}')
+    policy_status.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,137 @@
+"""partition quotes by month
+
+Revision ID: 1672193291eb
+Revises: 017abc613782
+Create Date: 2026-10-18 18:36:31.521966
+
+"""
+from datetime import date, datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1672193291eb'
+down_revision: Union[str, None] = '017abc613782'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (table, partition key), parent first
+PARTITIONED_TABLES = [
+    ('quotes', 'created_at'),
+    ('vehicle_details', 'quote_created_at'),
+    ('gap_premiums', 'quote_created_at'),
+]
+CHILD_TABLES = ['vehicle_details', 'gap_premiums']
+
+# Partitions created ahead of the current month; afterwards `migrate.py partitions`
+MONTHS_AHEAD = 3
+
+ARCHIVE_SCHEMA = 'quotes_archive'
+
+QUOTE_INDEXES = [
+    ('ix_quotes_agent_code_created_at', ['agent_code', 'created_at']),
+    ('ix_quotes_policy_status_created_at', ['policy_status', 'created_at']),
+    ('ix_quotes_created_at', ['created_at']),
+]
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _swap(suffix: str) -> None:
+    """Replace each table with its rebuilt copy, keeping the id sequences"""
+    for table, _ in reversed(PARTITIONED_TABLES):
+        op.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY NONE')
+        op.drop_table(table)
+    for table, _ in PARTITIONED_TABLES:
+        op.rename_table(f'{table}{suffix}', table)
+        op.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id')
+
+
+def upgrade() -> None:
+    # The tables are rebuilt and copied inside the migration transaction, which
+    # blocks quote traffic while it runs; schedule it in a maintenance window.
+    bind = op.get_bind()
+    op.execute(f'CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}')
+    op.execute('UPDATE quotes SET created_at = coalesce(updated_at, now()) WHERE created_at IS NULL')
+
+    # Bound quotes can outlive an archived partition, so bind requests keep the
+    # quote's partition key instead of a foreign key
+    op.add_column('bind_requests', sa.Column('quote_created_at', sa.DateTime(), nullable=True))
+    op.execute('UPDATE bind_requests SET quote_created_at = quotes.created_at '
+               'FROM quotes WHERE quotes.id = bind_requests.quote_id')
+    op.alter_column('bind_requests', 'quote_created_at', nullable=False)
+    op.drop_constraint('bind_requests_quote_id_fkey', 'bind_requests', type_='foreignkey')
+
+    oldest = bind.execute(sa.text('SELECT min(created_at) FROM quotes')).scalar() or datetime.utcnow()
+    current = datetime.utcnow().date().replace(day=1)
+    month = oldest.date().replace(day=1)
+    months = []
+    while month <= _add_months(current, MONTHS_AHEAD):
+        months.append(month)
+        month = _add_months(month, 1)
+
+    for table, key in PARTITIONED_TABLES:
+        extra = ', quote_created_at timestamp NOT NULL' if table in CHILD_TABLES else ''
+        op.execute(f'CREATE TABLE {table}_partitioned (LIKE {table} INCLUDING DEFAULTS{extra}) '
+                   f'PARTITION BY RANGE ({key})')
+        for month in months:
+            op.execute(f"CREATE TABLE {table}_y{month.year}m{month.month:02d} "
+                       f"PARTITION OF {table}_partitioned "
+                       f"FOR VALUES FROM ('{month}') TO ('{_add_months(month, 1)}')")
+
+    op.execute('INSERT INTO quotes_partitioned SELECT * FROM quotes')
+    for table in CHILD_TABLES:
+        op.execute(f'INSERT INTO {table}_partitioned SELECT {table}.*, quotes.created_at '
+                   f'FROM {table} JOIN quotes ON quotes.id = {table}.quote_id')
+    _swap('_partitioned')
+
+    # Unique constraints on a partitioned table must include the partition key
+    op.create_primary_key('quotes_pkey', 'quotes', ['id', 'created_at'])
+    op.create_index('ix_quotes_quote_ref', 'quotes', ['quote_ref', 'created_at'], unique=True)
+    for name, columns in QUOTE_INDEXES:
+        op.create_index(name, 'quotes', columns, unique=False)
+    for table in CHILD_TABLES:
+        op.create_primary_key(f'{table}_pkey', table, ['id', 'quote_created_at'])
+        op.create_foreign_key(f'{table}_quote_id_fkey', table, 'quotes',
+                              ['quote_id', 'quote_created_at'], ['id', 'created_at'])
+        op.create_index(f'ix_{table}_quote_id', table, ['quote_id'], unique=False)
+
+    # The copies start without planner statistics
+    for table, _ in PARTITIONED_TABLES:
+        op.execute(f'ANALYZE {table}')
+
+
+def downgrade() -> None:
+    # Quotes in archived partitions are not restored; bound quotes among them
+    # make the bind_requests foreign key fail, so restore those first
+    for table, _ in PARTITIONED_TABLES:
+        op.execute(f'CREATE TABLE {table}_unpartitioned (LIKE {table} INCLUDING DEFAULTS)')
+        op.execute(f'INSERT INTO {table}_unpartitioned SELECT * FROM {table}')
+    for table in CHILD_TABLES:
+        op.drop_column(f'{table}_unpartitioned', 'quote_created_at')
+    _swap('_unpartitioned')
+
+    op.create_primary_key('quotes_pkey', 'quotes', ['id'])
+    op.alter_column('quotes', 'created_at', nullable=True)
+    op.create_index('ix_quotes_quote_ref', 'quotes', ['quote_ref'], unique=True)
+    for name, columns in QUOTE_INDEXES:
+        op.create_index(name, 'quotes', columns, unique=False)
+    for table in CHILD_TABLES:
+        op.create_primary_key(f'{table}_pkey', table, ['id'])
+        op.create_foreign_key(f'{table}_quote_id_fkey', table, 'quotes', ['quote_id'], ['id'])
+        op.create_index(f'ix_{table}_quote_id', table, ['quote_id'], unique=False)
+
+    for table, _ in PARTITIONED_TABLES:
+        op.execute(f'ANALYZE {table}')
+
+    op.create_foreign_key('bind_requests_quote_id_fkey', 'bind_requests', 'quotes', ['quote_id'], ['id'])
+    op.drop_column('bind_requests', 'quote_created_at')
+    # Fails while archived partitions remain in the schema
+    op.execute(f'DROP SCHEMA IF EXISTS {ARCHIVE_SCHEMA}')
@@ -0,0 +1,75 @@
+"""foreign key and reporting indexes
+
+Revision ID: 456fa370966d
+Revises: 8713ec2fe976
+Create Date: 2026-10-18 18:26:03.704799
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '456fa370966d'
+down_revision: Union[str, None] = '8713ec2fe976'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (index name, table, columns) for every foreign key and reporting query
+INDEXES = [
+    ('ix_vehicle_details_quote_id', 'vehicle_details', ['quote_id']),
+    ('ix_gap_premiums_quote_id', 'gap_premiums', ['quote_id']),
+    ('ix_bind_requests_quote_id', 'bind_requests', ['quote_id']),
+    ('ix_finance_details_bind_request_id', 'finance_details', ['bind_request_id']),
+    ('ix_applicants_bind_request_id', 'applicants', ['bind_request_id']),
+    ('ix_applicant_postal_addresses_applicant_id', 'applicant_postal_addresses', ['applicant_id']),
+    ('ix_applicant_contacts_applicant_id', 'applicant_contacts', ['applicant_id']),
+    ('ix_business_applicants_applicant_id', 'business_applicants', ['applicant_id']),
+    ('ix_business_contact_persons_business_applicant_id', 'business_contact_persons', ['business_applicant_id']),
+    ('ix_joint_applicants_applicant_id', 'joint_applicants', ['applicant_id']),
+    ('ix_quotes_agent_code_created_at', 'quotes', ['agent_code', 'created_at']),
+    ('ix_quotes_policy_status_created_at', 'quotes', ['policy_status', 'created_at']),
+    ('ix_quotes_created_at', 'quotes', ['created_at']),
+]
+
+# Indexes on primary key columns that duplicate the primary key index
+REDUNDANT_ID_TABLES = [
+    'quotes',
+    'vehicle_details',
+    'gap_premiums',
+    'bind_requests',
+    'finance_details',
+    'applicants',
+    'applicant_postal_addresses',
+    'applicant_contacts',
+    'business_applicants',
+    'business_contact_persons',
+    'joint_applicants',
+]
+
+
+def upgrade() -> None:
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction. Building
+    # concurrently does not block writes, so this can run against a live database.
+    # IF [NOT] EXISTS lets an interrupted run be repeated; an interrupted
+    # concurrent build leaves an INVALID index that must be dropped first.
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False,
+                            postgresql_concurrently=True, if_not_exists=True)
+        for table in REDUNDANT_ID_TABLES:
+            op.drop_index(op.f(f'ix_{table}_id'), table_name=table,
+                          postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for table in REDUNDANT_ID_TABLES:
+            op.create_index(op.f(f'ix_{table}_id'), table, ['id'], unique=False,
+                            postgresql_concurrently=True, if_not_exists=True)
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table,
+                          postgresql_concurrently=True, if_exists=True)
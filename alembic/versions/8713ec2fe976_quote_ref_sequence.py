@@ -0,0 +1,28 @@
+"""quote ref sequence
+
+Revision ID: 8713ec2fe976
+Revises: f1bf4557f2de
+Create Date: 2026-10-18 18:25:31.090931
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8713ec2fe976'
+down_revision: Union[str, None] = 'f1bf4557f2de'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Quote references are allocated from this sequence; starting at 10000000 keeps
+    # the new 9 digit references (value + check digit) apart from legacy 8 digit ones
+    op.execute(sa.schema.CreateSequence(sa.Sequence('quote_ref_seq', start=10000000)))
+
+
+def downgrade() -> None:
+    op.execute(sa.schema.DropSequence(sa.Sequence('quote_ref_seq')))
\ No newline at end of file
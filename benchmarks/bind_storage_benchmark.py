@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Benchmark of bind writes and reads in the normalized and document storage modes
+
+    python migrate.py upgrade
+    python benchmarks/bind_storage_benchmark.py --binds 2000 --output benchmarks/results/bind-storage.json
+
+Each bind is written the way bind_quote writes it, one session flush and commit,
+and read back whole by quote id. Latencies are measured by the client, so they
+include the driver and the round trips each layout needs. Benchmark rows are
+written with agent code BENCH and deleted afterwards. Uses DATABASE_URL like the
+application.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import event, select, text
+from sqlalchemy.orm import selectinload
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from claude_code_demo.database import (  # noqa: E402
+    Applicant,
+    BindDocument,
+    BindRequest,
+    BusinessApplicant,
+    async_session,
+    engine,
+)
+from claude_code_demo.main import build_db_bind_document, build_db_bind_request  # noqa: E402
+from claude_code_demo.models import GapBindQuoteRequestDTO  # noqa: E402
+
+AGENT_CODE = "BENCH"
+
+# A business bind with a joint applicant, so every normalized table gets a row
+BIND = {
+    "quoteRef": "100000000",
+    "vehicleValue": 25000,
+    "vehicleInsurer": "AA",
+    "vehicleDepositProvided": False,
+    "financeDetails": {
+        "company": "AA Finance",
+        "amount": 20001,
+        "balancePayable": 400,
+        "startDate": "2021-05-19",
+        "contractLength": 60,
+    },
+    "agreeToDeclaration": True,
+    "applicant": {
+        "firstName": "Mary",
+        "surName": "Smith",
+        "dateOfBirth": "1990-12-30",
+        "applicantPostalAddress": {
+            "addressLine1": "105 Leonard Road",
+            "suburb": "Penrose",
+            "city": "Auckland",
+            "postcode": "1061",
+        },
+        "applicantContact": {"phone": "092863319", "mobileNum": "021222999", "emailAddress": "here@there.com"},
+        "businessApplicant": {
+            "businessName": "Smith Motors",
+            "businessContactPersons": [
+                {"firstName": "John", "surname": "Smith", "businessContactType": "PRIMARY"},
+                {"firstName": "Jane", "surname": "Smith", "businessContactType": "JOINT"},
+            ],
+        },
+        "jointApplicants": [{"firstName": "John", "surname": "Smith", "dateOfBirth": "1988-02-14"}],
+    },
+    "paymentMethod": "FINANCED",
+    "loanContractNumber": "LP234243",
+    "applicantsEmail": "abc@gmail.com",
+}
+
+# Deletes the benchmark binds, children first
+CLEANUP = [
+    """
+    DELETE FROM business_contact_persons WHERE business_applicant_id IN (
+        SELECT ba.id FROM business_applicants ba JOIN applicants a ON a.id = ba.applicant_id
+        JOIN bind_requests b ON b.id = a.bind_request_id WHERE b.agent_code = :agent)
+    """,
+    *(
+        f"""
+        DELETE FROM {table} WHERE applicant_id IN (
+            SELECT a.id FROM applicants a JOIN bind_requests b ON b.id = a.bind_request_id WHERE b.agent_code = :agent)
+        """
+        for table in ("business_applicants", "joint_applicants", "applicant_contacts", "applicant_postal_addresses")
+    ),
+    *(
+        f"DELETE FROM {table} WHERE bind_request_id IN (SELECT id FROM bind_requests WHERE agent_code = :agent)"
+        for table in ("applicants", "finance_details")
+    ),
+    "DELETE FROM bind_requests WHERE agent_code = :agent",
+    "DELETE FROM bind_documents WHERE agent_code = :agent",
+]
+
+
+def read_statement(mode: str, quote_id: int):
+    if mode == "document":
+        return select(BindDocument).where(BindDocument.quote_id == quote_id)
+    return (
+        select(BindRequest)
+        .where(BindRequest.quote_id == quote_id)
+        .options(
+            selectinload(BindRequest.finance_details),
+            selectinload(BindRequest.applicant).options(
+                selectinload(Applicant.postal_address),
+                selectinload(Applicant.contact),
+                selectinload(Applicant.joint_applicants),
+                selectinload(Applicant.business_applicant).selectinload(BusinessApplicant.contact_persons),
+            ),
+        )
+    )
+
+
+def summarize(timings: list) -> dict:
+    timings = sorted(timings)
+    return {
+        "median_ms": statistics.median(timings),
+        "p95_ms": timings[int(len(timings) * 0.95) - 1],
+        "max_ms": timings[-1],
+    }
+
+
+async def run_mode(mode: str, binds: int, statements: list) -> dict:
+    bind_request = GapBindQuoteRequestDTO.model_validate(BIND)
+    build = build_db_bind_document if mode == "document" else build_db_bind_request
+    now = datetime.utcnow()
+    first_quote_id = 1_000_000_000
+
+    write_timings, write_statements = [], []
+    for quote_id in range(first_quote_id, first_quote_id + binds):
+        statements.clear()
+        started = time.perf_counter()
+        async with async_session() as db:
+            db.add(build(bind_request, quote_id, now, AGENT_CODE, "BRAND", "USER"))
+            await db.commit()
+        write_timings.append((time.perf_counter() - started) * 1000)
+        write_statements.append(len(statements))
+
+    read_timings, read_statements = [], []
+    for quote_id in range(first_quote_id, first_quote_id + binds):
+        statements.clear()
+        started = time.perf_counter()
+        async with async_session() as db:
+            (await db.execute(read_statement(mode, quote_id))).scalar_one()
+        read_timings.append((time.perf_counter() - started) * 1000)
+        read_statements.append(len(statements))
+
+    return {
+        "write": {**summarize(write_timings), "statements": statistics.median(write_statements)},
+        "read": {**summarize(read_timings), "statements": statistics.median(read_statements)},
+    }
+
+
+async def cleanup():
+    async with engine.begin() as conn:
+        for statement in CLEANUP:
+            await conn.execute(text(statement), {"agent": AGENT_CODE})
+
+
+async def run(binds: int, output: str):
+    statements = []
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    await cleanup()
+    results = {}
+    try:
+        for mode in ("normalized", "document"):
+            results[mode] = await run_mode(mode, binds, statements)
+            write, read = results[mode]["write"], results[mode]["read"]
+            print(f"{mode:12s} write {write['median_ms']:7.3f} ms ({write['statements']:.0f} statements)  "
+                  f"read {read['median_ms']:7.3f} ms ({read['statements']:.0f} statements)")
+    finally:
+        await cleanup()
+    async with engine.connect() as conn:
+        revision = (await conn.execute(text("SELECT version_num FROM alembic_version"))).scalar_one()
+    await engine.dispose()
+
+    report = {
+        "created_at": datetime.utcnow().isoformat(),
+        "revision": revision,
+        "binds": binds,
+        "modes": results,
+    }
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bind storage mode benchmark")
+    parser.add_argument("--binds", type=int, default=2000, help="Binds written and read per mode (default: 2000)")
+    parser.add_argument("--output", required=True, help="JSON file for the results")
+    args = parser.parse_args()
+    asyncio.run(run(args.binds, args.output))
+
+
+if __name__ == "__main__":
+    main()
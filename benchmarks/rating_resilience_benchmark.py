@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Benchmark of rating engine calls through the plain and the resilient client under injected faults
+
+    python benchmarks/rating_resilience_benchmark.py --calls 400 --output benchmarks/results/rating-resilience.json
+
+Starts the stub rating engine from benchmarks/stubs.py and, for each fault
+scenario, sends the same calls through a client created by
+create_rating_client with retries, hedging and the circuit breaker switched
+off ("plain") and on ("resilient"). The premium cache is bypassed, so every
+call reaches the transport. Reports the share of calls that succeeded, their
+client side latency and how many requests reached the stub.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from claude_code_demo.rating import PremiumKey, create_rating_client, fetch_category_premiums  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+KEY = PremiumKey(agent_code="499", rate_card_code="GAP", category_code="GC1")
+
+# Stub faults of each scenario, see benchmarks/stubs.py
+SCENARIOS = {
+    "healthy": {"latency_ms": 10, "error_rate": 0, "slow_rate": 0, "slow_ms": 1000},
+    "slow_tail": {"latency_ms": 10, "error_rate": 0, "slow_rate": 0.05, "slow_ms": 1000},
+    "flaky": {"latency_ms": 10, "error_rate": 0.2, "slow_rate": 0, "slow_ms": 1000},
+    "failing": {"latency_ms": 10, "error_rate": 1, "slow_rate": 0, "slow_ms": 1000},
+    "hung": {"latency_ms": 10, "error_rate": 0, "slow_rate": 1, "slow_ms": 5000},
+}
+
+# Client settings of each mode, as environment variables read by create_rating_client
+MODES = {
+    "plain": {
+        "RATING_BREAKER_FAILURES": "0",
+        "RATING_RETRY_MAX_ATTEMPTS": "1",
+        "RATING_HEDGE_PERCENTILE": "0",
+    },
+    "resilient": {
+        "RATING_BREAKER_FAILURES": "5",
+        "RATING_BREAKER_RESET_SECONDS": "5",
+        "RATING_RETRY_MAX_ATTEMPTS": "3",
+        "RATING_HEDGE_PERCENTILE": "95",
+    },
+}
+
+COMMON = {"RATING_READ_TIMEOUT": "1"}
+
+
+def create_client(port: int, mode: str) -> httpx.AsyncClient:
+    settings = {**COMMON, **MODES[mode], "RATING_API_URL": f"http://127.0.0.1:{port}"}
+    saved = {name: os.environ.get(name) for name in settings}
+    os.environ.update(settings)
+    try:
+        return create_rating_client()
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                del os.environ[name]
+            else:
+                os.environ[name] = value
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest rank percentile of sorted values"""
+    return values[max(math.ceil(pct / 100 * len(values)) - 1, 0)]
+
+
+async def run_scenario(port: int, mode: str, faults: dict, calls: int, concurrency: int) -> dict:
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as admin:
+        # Warm the latency percentiles used for hedging before the faults start
+        await admin.post("/faults", params=SCENARIOS["healthy"])
+        client = create_client(port, mode)
+        for _ in range(30):
+            await fetch_category_premiums(client, KEY)
+        await admin.post("/faults", params=faults)
+        stub_calls = (await admin.get("/calls")).json()["calls"]
+
+        latencies, errors = [], {}
+        remaining = calls
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                started = time.perf_counter()
+                try:
+                    await fetch_category_premiums(client, KEY)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                except (httpx.RequestError, httpx.HTTPStatusError) as e:
+                    errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                    latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        duration = time.perf_counter() - started
+        stub_calls = (await admin.get("/calls")).json()["calls"] - stub_calls
+        await client.aclose()
+
+    latencies.sort()
+    return {
+        "success_rate": round(1 - sum(errors.values()) / calls, 4),
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3),
+        "requests_to_engine": stub_calls,
+    }
+
+
+async def wait_until_up(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+            await asyncio.sleep(0.2)
+
+
+async def run(calls: int, concurrency: int, port: int, output: str):
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.stubs:rating_app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+    )
+    results = {}
+    try:
+        await wait_until_up(f"http://127.0.0.1:{port}/calls")
+        for scenario, faults in SCENARIOS.items():
+            results[scenario] = {}
+            for mode in MODES:
+                result = await run_scenario(port, mode, faults, calls, concurrency)
+                results[scenario][mode] = result
+                print(f"{scenario:10s} {mode:10s} {result['success_rate'] * 100:6.1f}% ok  "
+                      f"p50 {result['p50_ms']:8.2f}  p99 {result['p99_ms']:8.2f} ms  "
+                      f"{result['requests_to_engine']:5d} requests to the engine")
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    report = {
+        "created_at": datetime.utcnow().isoformat(),
+        "calls": calls,
+        "concurrency": concurrency,
+        "client_settings": {"common": COMMON, **MODES},
+        "scenarios": {name: {"faults": SCENARIOS[name], **modes} for name, modes in results.items()},
+    }
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rating engine client resilience benchmark")
+    parser.add_argument("--calls", type=int, default=400, help="Calls per scenario and mode (default: 400)")
+    parser.add_argument("--concurrency", type=int, default=10, help="Calls in flight (default: 10)")
+    parser.add_argument("--port", type=int, default=8189, help="Port of the rating stub (default: 8189)")
+    parser.add_argument("--output", required=True, help="JSON file for the results")
+    args = parser.parse_args()
+    asyncio.run(run(args.calls, args.concurrency, args.port, args.output))
+
+
+if __name__ == "__main__":
+    main()
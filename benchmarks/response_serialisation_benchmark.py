@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the CPU time spent per response with and without FastResponseRoute
+
+    python benchmarks/response_serialisation_benchmark.py --output benchmarks/results/response-serialisation.json
+
+Builds one app per route class whose endpoints return prebuilt quote, options,
+bulk and bind DTOs with the same response models as the service, and calls
+them through ASGI in process, so no network, database or handler work is
+measured. Reports the process CPU time per response, which covers routing,
+re-validation and JSON encoding, and checks both apps return the same JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import fastapi
+import pydantic
+from fastapi import FastAPI
+from fastapi.routing import APIRoute
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from claude_code_demo.models import (  # noqa: E402
+    ErrorCategory,
+    GapBindResponseDTO,
+    GapBulkQuoteResponseDTO,
+    GapPremium,
+    GapQuoteOptionsResponseDTO,
+    GapQuoteResponse,
+    GapQuoteResponseDTO,
+    MaxShortfall,
+    ResponseError,
+    VehicleDetails,
+)
+from claude_code_demo.responses import FastResponseRoute  # noqa: E402
+
+ROUTE_CLASSES = {"default": APIRoute, "fast": FastResponseRoute}
+
+VEHICLE = VehicleDetails(
+    registration="MKD546", vin="MRHGK5860GP020199", make="HONDA", model="JAZZ", year="2015",
+    ccRating="1497", fuelType="Petrol", odometerReading="89655", bodyColour="RED", bodyStyle="Hatchback"
+)
+
+
+def quote(index: int) -> GapQuoteResponse:
+    return GapQuoteResponse(
+        quoteRef=str(100000000 + index),
+        quoteExpiryDate="2026-11-17",
+        gstRate="15",
+        vehicleDetails=VEHICLE,
+        gapPremium=GapPremium(wholesaleAmount=200.0 + index, retailAmount=400.0 + index),
+    )
+
+
+def responses(bulk_size: int) -> dict:
+    """Response model and a prebuilt response of each endpoint"""
+    return {
+        "create": (GapQuoteResponseDTO, GapQuoteResponseDTO(quoteResponse=quote(0), errors=[])),
+        "options": (
+            GapQuoteOptionsResponseDTO,
+            GapQuoteOptionsResponseDTO(quoteResponses=[quote(index) for index in range(len(MaxShortfall))], errors=[]),
+        ),
+        "bulk": (
+            GapBulkQuoteResponseDTO,
+            GapBulkQuoteResponseDTO(
+                results=[GapQuoteResponseDTO(quoteResponse=quote(index), errors=[]) for index in range(bulk_size)],
+                errors=[],
+            ),
+        ),
+        "bind": (GapBindResponseDTO, GapBindResponseDTO(errors=[])),
+        "bind_rejected": (
+            GapBindResponseDTO,
+            GapBindResponseDTO(errors=[
+                ResponseError(category=ErrorCategory.BUSINESS, code="ER404",
+                              message="Quote not found or expired", field="quoteRef")
+            ]),
+        ),
+    }
+
+
+def create_app(route_class: type, endpoints: dict) -> FastAPI:
+    app = FastAPI()
+    app.router.route_class = route_class
+    for name, (response_model, response) in endpoints.items():
+        app.add_api_route(f"/{name}", _returning(response), methods=["GET"], response_model=response_model)
+    return app
+
+
+def _returning(response):
+    """Endpoint returning the prebuilt response, with no parameters for FastAPI to solve"""
+    async def endpoint():
+        return response
+    return endpoint
+
+
+async def call(app: FastAPI, path: str) -> bytes:
+    """Send one GET through the ASGI app and return the response body"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"", "headers": [],
+        "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80),
+    }
+    body = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return b"".join(body)
+
+
+async def measure(app: FastAPI, path: str, iterations: int, warmup: int) -> float:
+    """Process CPU time per response in microseconds"""
+    for _ in range(warmup):
+        await call(app, path)
+    started = time.process_time()
+    for _ in range(iterations):
+        await call(app, path)
+    return (time.process_time() - started) / iterations * 1_000_000
+
+
+async def run(args):
+    endpoints = responses(args.bulk_size)
+    apps = {mode: create_app(route_class, endpoints) for mode, route_class in ROUTE_CLASSES.items()}
+    results = {}
+    for name in endpoints:
+        bodies = {mode: await call(app, f"/{name}") for mode, app in apps.items()}
+        if json.loads(bodies["default"]) != json.loads(bodies["fast"]):
+            raise RuntimeError(f"{name}: the fast response differs from the default one")
+        iterations = max(args.iterations // args.bulk_size, 50) if name == "bulk" else args.iterations
+        cpu = {}
+        for mode, app in apps.items():
+            # Best of several rounds, to leave out scheduling noise on a shared machine
+            cpu[mode] = min([await measure(app, f"/{name}", iterations, args.warmup) for _ in range(args.rounds)])
+        results[name] = {
+            "body_bytes": {mode: len(body) for mode, body in bodies.items()},
+            "default_cpu_us": round(cpu["default"], 2),
+            "fast_cpu_us": round(cpu["fast"], 2),
+            "speedup": round(cpu["default"] / cpu["fast"], 2),
+        }
+        print(f"{name:14s} default {cpu['default']:9.1f} us  fast {cpu['fast']:9.1f} us  "
+              f"x{cpu['default'] / cpu['fast']:.2f}")
+
+    report = {
+        "created_at": datetime.utcnow().isoformat(),
+        "versions": {"python": sys.version.split()[0], "fastapi": fastapi.__version__, "pydantic": pydantic.VERSION},
+        "settings": {"iterations": args.iterations, "warmup": args.warmup, "rounds": args.rounds,
+                     "bulk_size": args.bulk_size},
+        "responses": results,
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Response serialisation microbenchmark")
+    parser.add_argument("--iterations", type=int, default=5000, help="Timed responses per round (default: 5000)")
+    parser.add_argument("--warmup", type=int, default=500, help="Untimed responses before each round (default: 500)")
+    parser.add_argument("--rounds", type=int, default=5, help="Rounds per endpoint and mode, best kept (default: 5)")
+    parser.add_argument("--bulk-size", type=int, default=100, help="Quotes in the bulk response (default: 100)")
+    parser.add_argument("--output", required=True, help="JSON file for the results")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
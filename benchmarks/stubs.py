@@ -0,0 +1,131 @@
+"""
+Local stand-ins for the external services, used by the load benchmark
+
+The rating engine stub implements ``GET /rating/agent/category/premium`` of
+specification/gap_rating.yaml and is served with uvicorn:
+
+    STUB_RATING_LATENCY_MS=10 uvicorn benchmarks.stubs:rating_app --port 8088
+
+Faults are injected from the environment or changed while it runs with
+``POST /faults?error_rate=0.5&slow_rate=0.05&slow_ms=2000``:
+
+    STUB_RATING_LATENCY_MS      latency of every response (default 10)
+    STUB_RATING_ERROR_RATE      fraction of requests answered with a 503 (default 0)
+    STUB_RATING_SLOW_RATE       fraction of requests answered after slow_ms instead (default 0)
+    STUB_RATING_SLOW_MS         latency of the slow requests (default 1000)
+
+The vehicle provider stub is loaded by the application with
+``VEHICLE_PROVIDER=benchmarks.stubs:create_vehicle_provider``. Both sleep for a
+configurable latency so the benchmark waits on them the way it would on the
+real services.
+"""
+import asyncio
+import os
+import random
+import sys
+from typing import Optional
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from claude_code_demo.models import VehicleDetails  # noqa: E402
+from claude_code_demo.vehicles import StubVehicleProvider  # noqa: E402
+
+# Sum insured of each GAP cover, matching rating.SHORTFALL_TO_COVER_CODE
+COVER_LIMITS = (5000, 10000, 15000, 20000, 30000, 40000)
+
+rating_app = FastAPI(title="Stub rating engine")
+rating_app.state.calls = 0
+rating_app.state.faults = {
+    "latency_ms": float(os.getenv("STUB_RATING_LATENCY_MS", "10")),
+    "error_rate": float(os.getenv("STUB_RATING_ERROR_RATE", "0")),
+    "slow_rate": float(os.getenv("STUB_RATING_SLOW_RATE", "0")),
+    "slow_ms": float(os.getenv("STUB_RATING_SLOW_MS", "1000")),
+}
+
+
+def _category_premiums(agent_code: str) -> dict:
+    """A CategoryPremiumsDto with one excess and one 12 month premium per cover"""
+    # Vary premiums by agent so a mixed up cache entry shows in the responses
+    loading = 1 + (sum(agent_code.encode()) % 10) / 100
+    return {
+        "gst": 0.15,
+        "covers": [
+            {
+                "objid": index + 1,
+                "code": f"GAP{limit}",
+                "name": f"GAP Cover ${limit:,}",
+                "mainBenefit": limit,
+                "additionalBenefit": 0,
+                "premiumRounding": 0.05,
+                "rateCardExcess": [
+                    {
+                        "objid": index + 1,
+                        "excess": 0,
+                        "maxmileage": 200000,
+                        "maxage": 15,
+                        "isDefault": True,
+                        "premium": [
+                            {
+                                "objid": index + 1,
+                                "term": 12,
+                                "agentWholesalePremiumEx": round(limit * 0.018 * loading, 2),
+                                "agentRetailPremiumEx": round(limit * 0.036 * loading, 2),
+                            }
+                        ],
+                    }
+                ],
+            }
+            for index, limit in enumerate(COVER_LIMITS)
+        ],
+    }
+
+
+@rating_app.get("/rating/agent/category/premium")
+async def category_premium(
+    agentCode: str, rateCardCode: str, categoryCode: str, loadingCode: Optional[str] = None
+):
+    rating_app.state.calls += 1
+    faults = rating_app.state.faults
+    slow = random.random() < faults["slow_rate"]
+    await asyncio.sleep((faults["slow_ms"] if slow else faults["latency_ms"]) / 1000)
+    if random.random() < faults["error_rate"]:
+        return JSONResponse({"message": "Injected failure"}, status_code=503)
+    return _category_premiums(agentCode)
+
+
+@rating_app.post("/faults")
+async def set_faults(
+    latency_ms: Optional[float] = None,
+    error_rate: Optional[float] = None,
+    slow_rate: Optional[float] = None,
+    slow_ms: Optional[float] = None
+):
+    """Change the injected latency and failures, returning the new settings"""
+    changes = {"latency_ms": latency_ms, "error_rate": error_rate, "slow_rate": slow_rate, "slow_ms": slow_ms}
+    rating_app.state.faults.update({name: value for name, value in changes.items() if value is not None})
+    return rating_app.state.faults
+
+
+@rating_app.get("/calls")
+async def rating_calls():
+    """Premium requests served, to check the benchmark reached the stub"""
+    return {"calls": rating_app.state.calls}
+
+
+class LatencyVehicleProvider(StubVehicleProvider):
+    """StubVehicleProvider that takes latency_ms to answer, like a remote lookup"""
+
+    def __init__(self, latency_ms: float):
+        super().__init__()
+        self.latency_ms = latency_ms
+
+    async def lookup(self, rego_or_vin: str) -> Optional[VehicleDetails]:
+        await asyncio.sleep(self.latency_ms / 1000)
+        return await super().lookup(rego_or_vin)
+
+
+def create_vehicle_provider() -> LatencyVehicleProvider:
+    """VEHICLE_PROVIDER factory, answering after STUB_VEHICLE_LATENCY_MS (default 50)"""
+    return LatencyVehicleProvider(float(os.getenv("STUB_VEHICLE_LATENCY_MS", "50")))
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Benchmark of throughput against the number of serve.py worker processes
+
+    python migrate.py upgrade
+    python benchmarks/worker_scaling_benchmark.py --workers 1 2 4 --output benchmarks/results/worker-scaling.json
+
+Starts the stub rating engine, then for each worker count starts the
+application with serve.py (uvloop, httptools) against the Postgres at
+DATABASE_URL and drives the load benchmark workloads at one concurrency.
+Throughput only scales while there are idle CPUs left, and the client, the
+stubs and Postgres share the machine, so the CPU count is recorded with the
+results. Database round trips are not reported, as /metrics only covers the
+worker that answers it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+import httpx
+from sqlalchemy.ext.asyncio import create_async_engine
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from load_benchmark import DATABASE_URL, ROOT, cleanup, run_workload, start_server, wait_until_up  # noqa: E402
+from serve import available_cpus  # noqa: E402
+
+
+async def run(args):
+    db_engine = create_async_engine(DATABASE_URL)
+    await cleanup(db_engine)
+    env = {
+        **os.environ,
+        "DATABASE_URL": DATABASE_URL,
+        "RATING_API_URL": f"http://127.0.0.1:{args.rating_port}",
+        "STUB_RATING_LATENCY_MS": str(args.rating_latency_ms),
+        "VEHICLE_PROVIDER": "benchmarks.stubs:create_vehicle_provider",
+        "STUB_VEHICLE_LATENCY_MS": str(args.vehicle_latency_ms),
+        "PORT": str(args.app_port),
+        "SERVER_LOG_LEVEL": "warning",
+    }
+    stub = start_server("benchmarks.stubs:rating_app", args.rating_port, env)
+    results = {}
+    try:
+        await wait_until_up(f"http://127.0.0.1:{args.rating_port}/calls")
+        app_url = f"http://127.0.0.1:{args.app_port}"
+        for workers in args.workers:
+            server = subprocess.Popen(
+                [sys.executable, "serve.py"], cwd=ROOT, env={**env, "WEB_CONCURRENCY": str(workers)}
+            )
+            try:
+                await wait_until_up(f"{app_url}/health")
+                limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+                async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=30.0) as client:
+                    for workload in args.workloads:
+                        result = await run_workload(client, workload, args.concurrency, args)
+                        del result["db"]
+                        results[f"{workload}@{workers}"] = {"workers": workers, **result}
+                        print(f"{workload:7s} workers={workers:<3d} {result['throughput_rps']:8.1f} req/s  "
+                              f"p50 {result['p50_ms']:8.2f}  p99 {result['p99_ms']:8.2f} ms  {result['errors']} errors")
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        stub.terminate()
+        stub.wait()
+        await cleanup(db_engine)
+        await db_engine.dispose()
+
+    report = {
+        "created_at": datetime.utcnow().isoformat(),
+        "cpus": available_cpus(),
+        "settings": {
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "rating_latency_ms": args.rating_latency_ms,
+            "vehicle_latency_ms": args.vehicle_latency_ms,
+        },
+        "runs": results,
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker process scaling benchmark")
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4],
+                        help="Worker counts, one application start each (default: 1 2 4)")
+    parser.add_argument("--workloads", nargs="+", choices=("create", "mixed", "view"), default=["create", "view"],
+                        help="Workloads to run (default: create view)")
+    parser.add_argument("--concurrency", type=int, default=64, help="Requests in flight (default: 64)")
+    parser.add_argument("--requests", type=int, default=2000, help="Timed requests per run (default: 2000)")
+    parser.add_argument("--warmup", type=int, default=100, help="Untimed creates before each run (default: 100)")
+    parser.add_argument("--bind-ratio", type=float, default=0.25,
+                        help="Share of mixed requests that are binds (default: 0.25)")
+    parser.add_argument("--quotes-viewed", type=int, default=200,
+                        help="Distinct quotes read by the view workload (default: 200)")
+    parser.add_argument("--agents", type=int, default=20, help="Distinct agent codes (default: 20)")
+    parser.add_argument("--vehicles", type=int, default=1000, help="Distinct registrations (default: 1000)")
+    parser.add_argument("--rating-latency-ms", type=float, default=10.0,
+                        help="Stub rating engine latency (default: 10)")
+    parser.add_argument("--vehicle-latency-ms", type=float, default=50.0,
+                        help="Stub vehicle provider latency (default: 50)")
+    parser.add_argument("--app-port", type=int, default=8100, help="Port of the application (default: 8100)")
+    parser.add_argument("--rating-port", type=int, default=8188, help="Port of the rating stub (default: 8188)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for the request mix (default: 42)")
+    parser.add_argument("--output", required=True, help="JSON file for the results")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
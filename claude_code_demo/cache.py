@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    stale_hits: int = 0
+    misses: int = 0
+    refreshes: int = 0
+    refresh_failures: int = 0
+    stale_if_error_hits: int = 0
+    evictions: int = 0
+
+
+class SingleFlight:
+    """Share one in-flight call per key between concurrent callers
+
+    The first caller for a key starts the call as a task; callers arriving while it
+    is running await the same task and receive its result or exception. The task is
+    shielded, so a cancelled caller does not cancel the call for the others.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls: dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def forget(self, key: Hashable) -> None:
+        """Stop sharing the call in flight for key, so the next caller starts a new one"""
+        self._calls.pop(key, None)
+
+    def is_current(self, key: Hashable) -> bool:
+        """Whether the running task is the call shared for key"""
+        return self._calls.get(key) is asyncio.current_task()
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception as retrieved when every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+
+@dataclass
+class _Entry:
+    value: Any
+    stored_at: float
+
+
+class TTLCache:
+    """Bounded in-process LRU cache with a time-to-live per entry
+
+    Entries older than ``ttl_seconds`` but younger than ``ttl_seconds + stale_seconds``
+    are still served by ``get_or_load`` while a single background refresh replaces them
+    (stale-while-revalidate). Concurrent loads of the same key are coalesced into one
+    loader call. When the loader fails, an entry younger than ``ttl_seconds +
+    stale_seconds + stale_if_error_seconds`` is served instead of the error
+    (stale-if-error). A cache with ``max_entries`` or ``ttl_seconds`` of 0 is
+    disabled and always calls the loader, still coalescing concurrent calls.
+    """
+
+    def __init__(
+        self, max_entries: int, ttl_seconds: float, stale_seconds: float = 0.0, stale_if_error_seconds: float = 0.0
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.stale_if_error_seconds = stale_if_error_seconds
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._refreshing: dict[Hashable, asyncio.Task] = {}
+        self._flight = SingleFlight()
+        # Bumped by invalidate so loads started before it are not stored
+        self._generation = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return a fresh cached value or None, without loading"""
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry.stored_at > self.ttl_seconds:
+            return None
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store a value, evicting the least recently used entries when full"""
+        if not self.enabled:
+            return
+        self._entries[key] = _Entry(value=value, stored_at=time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value for key, loading it on a miss"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry.stored_at
+            if age <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.stats.hits += 1
+                return entry.value
+            if age <= self.ttl_seconds + self.stale_seconds:
+                self._entries.move_to_end(key)
+                self.stats.stale_hits += 1
+                self._schedule_refresh(key, loader)
+                return entry.value
+
+        self.stats.misses += 1
+        generation = self._generation
+        try:
+            return await self._flight.do(key, lambda: self._load(key, loader, generation))
+        except Exception:
+            # Serve the last value loaded while it is recent enough (stale-if-error)
+            entry = self._entries.get(key)
+            max_age = self.ttl_seconds + self.stale_seconds + self.stale_if_error_seconds
+            if entry is None or self.stale_if_error_seconds <= 0 or time.monotonic() - entry.stored_at > max_age:
+                raise
+            self.stats.stale_if_error_hits += 1
+            return entry.value
+
+    def invalidate(self, predicate: Optional[Callable[[Hashable], bool]] = None) -> int:
+        """Drop every entry whose key matches predicate (all entries when None)"""
+        self._generation += 1
+        if predicate is None:
+            removed = len(self._entries)
+            self._entries.clear()
+            return removed
+        keys = [key for key in self._entries if predicate(key)]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def discard(self, key: Hashable) -> bool:
+        """Drop the entry for key, returning whether it was cached
+
+        A load of key already in flight is not stored, and is not shared with
+        callers arriving after the discard. Loads of other keys are unaffected.
+        """
+        self._flight.forget(key)
+        return self._entries.pop(key, None) is not None
+
+    def snapshot(self) -> dict:
+        """Return the counters and size of the cache"""
+        return {
+            **asdict(self.stats),
+            "coalesced": self._flight.coalesced,
+            "in_flight": len(self._flight),
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "stale_seconds": self.stale_seconds,
+            "stale_if_error_seconds": self.stale_if_error_seconds,
+        }
+
+    async def close(self) -> None:
+        """Cancel background refreshes still in flight"""
+        tasks = list(self._refreshing.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _schedule_refresh(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> None:
+        if key in self._refreshing:
+            return
+        task = asyncio.create_task(self._refresh(key, loader))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], generation: int) -> Any:
+        value = await loader()
+        # Not stored when the cache was invalidated or the key discarded while loading
+        if generation == self._generation and self._flight.is_current(key):
+            self.set(key, value)
+        return value
+
+    async def _refresh(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> None:
+        generation = self._generation
+        try:
+            await self._flight.do(key, lambda: self._load(key, loader, generation))
+        except Exception as e:
+            self.stats.refresh_failures += 1
+            logger.warning("Background cache refresh failed for %s: %s", key, e)
+            return
+        self.stats.refreshes += 1
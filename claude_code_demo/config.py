@@ -0,0 +1,21 @@
+import os
+
+
+def env_bool(name: str, default: bool) -> bool:
+    """Read a boolean environment variable (1/true/yes/on)"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_float(name: str, default: float) -> float:
+    """Read a float environment variable"""
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def env_int(name: str, default: int) -> int:
+    """Read an integer environment variable"""
+    value = os.getenv(name)
+    return int(value) if value else default
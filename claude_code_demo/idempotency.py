@@ -0,0 +1,307 @@
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Iterable, NamedTuple, Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from .cache import SingleFlight
+from .config import env_float
+from .database import IdempotencyKey, async_session
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+REPLAYED_HEADER = b"idempotent-replayed"
+
+# Longest Idempotency-Key accepted
+MAX_KEY_LENGTH = 100
+
+# Errors of the idempotency_keys table; asyncpg raises OSError when it cannot connect
+_DB_ERRORS = (SQLAlchemyError, OSError)
+
+
+class StoredResponse(NamedTuple):
+    status: int
+    content_type: bytes
+    body: bytes
+    replayed: bool = False
+
+
+def _error_response(status: int, code: str, message: str) -> StoredResponse:
+    body = {"errors": [{"category": "VALIDATION", "code": code, "message": message, "field": "Idempotency-Key"}]}
+    return StoredResponse(status, b"application/json", json.dumps(body).encode())
+
+
+def _system_error(error: Exception) -> StoredResponse:
+    """The ER999 error DTO the endpoints answer with when the database fails"""
+    body = {"errors": [{"category": "SYSTEM", "code": "ER999", "message": f"System error: {error}", "field": None}]}
+    return StoredResponse(200, b"application/json", json.dumps(body).encode())
+
+
+def _store_key(agent_code: str, path: str, key: str) -> str:
+    """Key of the idempotency_keys row, a hash so a long agent code cannot overflow the column"""
+    return hashlib.sha256("\n".join((agent_code, path, key)).encode()).hexdigest()
+
+
+def _is_storable(response: StoredResponse) -> bool:
+    """Successful responses are replayed, but not those reporting a system error
+
+    A system error such as a failed rating call is transient, so a retry runs again.
+    """
+    if not 200 <= response.status < 300:
+        return False
+    try:
+        errors = json.loads(response.body).get("errors") or []
+    except (ValueError, AttributeError):
+        return True
+    return not any(error.get("category") == "SYSTEM" for error in errors)
+
+
+class IdempotencyMiddleware:
+    """Replay the stored response of a POST retried with the same Idempotency-Key
+
+    Keys are scoped by agent code and path. The first request for a key claims it
+    in the idempotency_keys table, runs, and stores its response for ttl_seconds;
+    later requests with the key get that response back with an
+    ``Idempotent-Replayed: true`` header instead of running again. Duplicates that
+    arrive while the first is still running wait for it, sharing its execution in
+    the same worker or polling the claim from other workers, for up to
+    wait_seconds. A claim left by a crashed worker can be taken over after
+    lock_seconds. Reusing a key with a different request body is rejected.
+
+    When the idempotency_keys table cannot be read the request is answered with
+    the ER999 error DTO. When the response cannot be stored it is still returned,
+    and a retry runs again once lock_seconds have passed.
+    """
+
+    def __init__(
+        self,
+        app,
+        paths: Iterable[str],
+        ttl_seconds: float,
+        wait_seconds: float,
+        lock_seconds: float,
+        poll_seconds: float = 0.05,
+        session_factory=async_session,
+    ):
+        self.app = app
+        self.paths = set(paths)
+        self.ttl_seconds = ttl_seconds
+        self.wait_seconds = wait_seconds
+        self.lock_seconds = lock_seconds
+        self.poll_seconds = poll_seconds
+        self._session_factory = session_factory
+        self._flight = SingleFlight()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        key = headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+
+        if len(key) > MAX_KEY_LENGTH:
+            await self._send(send, _error_response(
+                400, "ER009", f"Idempotency-Key may be at most {MAX_KEY_LENGTH} characters"
+            ))
+            return
+
+        body = await self._read_body(receive)
+        agent_code = headers.get(b"x-agent-code", b"").decode("latin-1")
+        store_key = _store_key(agent_code, scope["path"], key.decode("latin-1"))
+        request_hash = hashlib.sha256(body).hexdigest()
+
+        # Concurrent duplicates in this worker share the first one's execution
+        response = await self._flight.do(
+            (store_key, request_hash),
+            lambda: self._handle(scope, body, store_key, request_hash)
+        )
+        await self._send(send, response)
+
+    async def _handle(self, scope, body: bytes, store_key: str, request_hash: str) -> StoredResponse:
+        deadline = asyncio.get_running_loop().time() + self.wait_seconds
+        while True:
+            try:
+                stored = await self._claim(store_key, request_hash)
+            except _DB_ERRORS as e:
+                logger.warning("Idempotency key claim failed: %s", e)
+                return _system_error(e)
+            if stored is None:
+                return await self._run(scope, body, store_key)
+            if stored.request_hash != request_hash:
+                return _error_response(422, "ER010", "Idempotency-Key was already used with a different request")
+            if stored.response_status is not None:
+                return StoredResponse(
+                    stored.response_status, stored.response_content_type.encode(), stored.response_body,
+                    replayed=True
+                )
+            if asyncio.get_running_loop().time() >= deadline:
+                return _error_response(409, "ER011", "A request with this Idempotency-Key is still in progress")
+            await asyncio.sleep(self.poll_seconds)
+
+    async def _claim(self, store_key: str, request_hash: str) -> Optional[IdempotencyKey]:
+        """Claim the key, returning None when claimed or the row holding it otherwise"""
+        now = datetime.utcnow()
+        claim = {
+            "request_hash": request_hash,
+            "response_status": None,
+            "response_content_type": None,
+            "response_body": None,
+            "created_at": now,
+            "locked_until": now + timedelta(seconds=self.lock_seconds),
+            "expires_at": now + timedelta(seconds=self.ttl_seconds),
+        }
+        async with self._session_factory() as db:
+            claimed = (await db.execute(
+                insert(IdempotencyKey)
+                .values(idempotency_key=store_key, **claim)
+                .on_conflict_do_nothing(index_elements=[IdempotencyKey.idempotency_key])
+                .returning(IdempotencyKey.idempotency_key)
+            )).first()
+            if claimed is None:
+                # Take over an expired key, or a claim abandoned by a crashed worker
+                claimed = (await db.execute(
+                    update(IdempotencyKey)
+                    .where(
+                        IdempotencyKey.idempotency_key == store_key,
+                        (IdempotencyKey.expires_at < now) |
+                        (IdempotencyKey.response_status.is_(None) & (IdempotencyKey.locked_until < now))
+                    )
+                    .values(**claim)
+                    .returning(IdempotencyKey.idempotency_key)
+                )).first()
+            if claimed is not None:
+                await db.commit()
+                return None
+            stored = (await db.execute(
+                select(IdempotencyKey).where(IdempotencyKey.idempotency_key == store_key)
+            )).scalar_one_or_none()
+            # A claim released since the insert is treated as in progress and claimed on the next poll
+            return stored or IdempotencyKey(request_hash=request_hash)
+
+    async def _run(self, scope, body: bytes, store_key: str) -> StoredResponse:
+        """Run the request and store its response, or release the key when it is not kept"""
+        start = {}
+        chunks = []
+        received = False
+
+        async def receive():
+            nonlocal received
+            if received:
+                return {"type": "http.disconnect"}
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        try:
+            await self.app(scope, receive, send)
+        except BaseException:
+            await self._release(store_key)
+            raise
+
+        response = StoredResponse(
+            start["status"],
+            dict(start.get("headers", [])).get(b"content-type", b"application/json"),
+            b"".join(chunks),
+        )
+        if not _is_storable(response):
+            await self._release(store_key)
+            return response
+
+        try:
+            async with self._session_factory() as db:
+                now = datetime.utcnow()
+                await db.execute(
+                    update(IdempotencyKey)
+                    .where(IdempotencyKey.idempotency_key == store_key)
+                    .values(
+                        response_status=response.status,
+                        response_content_type=response.content_type.decode("latin-1"),
+                        response_body=response.body,
+                        expires_at=now + timedelta(seconds=self.ttl_seconds),
+                    )
+                )
+                await db.commit()
+        except _DB_ERRORS as e:
+            # The request has run, so its response is returned even though it cannot be replayed
+            logger.warning("Idempotency key response could not be stored: %s", e)
+        return response
+
+    async def _release(self, store_key: str) -> None:
+        """Delete an unfinished claim; left in place it can be taken over after lock_seconds"""
+        try:
+            async with self._session_factory() as db:
+                await db.execute(delete(IdempotencyKey).where(
+                    IdempotencyKey.idempotency_key == store_key,
+                    IdempotencyKey.response_status.is_(None)
+                ))
+                await db.commit()
+        except _DB_ERRORS as e:
+            logger.warning("Idempotency key could not be released: %s", e)
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        return b"".join(chunks)
+
+    @staticmethod
+    async def _send(send, response: StoredResponse) -> None:
+        headers = [
+            (b"content-type", response.content_type),
+            (b"content-length", str(len(response.body)).encode()),
+        ]
+        if response.replayed:
+            headers.append((REPLAYED_HEADER, b"true"))
+        await send({"type": "http.response.start", "status": response.status, "headers": headers})
+        await send({"type": "http.response.body", "body": response.body})
+
+
+def idempotency_options() -> dict:
+    """IdempotencyMiddleware keyword arguments read from the environment
+
+      IDEMPOTENCY_TTL_SECONDS     seconds a response is replayed for its key (default 86400)
+      IDEMPOTENCY_WAIT_SECONDS    seconds a duplicate waits for the first request (default 10)
+      IDEMPOTENCY_LOCK_SECONDS    seconds before an unfinished claim can be taken over (default 60)
+    """
+    return {
+        "ttl_seconds": env_float("IDEMPOTENCY_TTL_SECONDS", 86400.0),
+        "wait_seconds": env_float("IDEMPOTENCY_WAIT_SECONDS", 10.0),
+        "lock_seconds": env_float("IDEMPOTENCY_LOCK_SECONDS", 60.0),
+    }
+
+
+async def purge_expired_keys(batch_size: int = 10000) -> int:
+    """Delete expired idempotency keys in batches, returning how many were deleted"""
+    deleted = 0
+    while True:
+        async with async_session() as db:
+            expired = select(IdempotencyKey.idempotency_key).where(
+                IdempotencyKey.expires_at < datetime.utcnow()
+            ).limit(batch_size)
+            result = await db.execute(
+                delete(IdempotencyKey).where(IdempotencyKey.idempotency_key.in_(expired))
+            )
+            await db.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
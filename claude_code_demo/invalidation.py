@@ -0,0 +1,163 @@
+import asyncio
+import json
+import logging
+from dataclasses import asdict, dataclass
+from typing import Hashable, Optional
+
+import asyncpg
+from sqlalchemy import make_url, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .cache import TTLCache
+from .config import env_bool, env_float
+from .database import DATABASE_URL, engine
+
+logger = logging.getLogger(__name__)
+
+# Postgres channel the workers listen on
+CHANNEL = "gap_cache_invalidation"
+
+
+@dataclass
+class InvalidationStats:
+    sent: int = 0
+    received: int = 0
+    reconnects: int = 0
+    listen_failures: int = 0
+
+
+class CacheInvalidation:
+    """Drop cache entries in every worker process with Postgres LISTEN/NOTIFY
+
+    Each worker keeps one connection listening on CHANNEL. An invalidation is
+    sent with pg_notify inside a transaction, so it is only delivered once that
+    commits, and is applied by every listening worker, including the one that
+    sent it. A worker that loses its listening connection
+    cannot know what it missed, so it clears its caches once it listens again.
+    Without notify, invalidations only reach the worker they are made in.
+    """
+
+    def __init__(self, caches: dict[str, TTLCache], dsn: Optional[str], ping_seconds: float = 30.0):
+        self.caches = caches
+        self.dsn = dsn
+        self.ping_seconds = ping_seconds
+        self.listening = False
+        self._task: Optional[asyncio.Task] = None
+        self.stats = InvalidationStats()
+
+    @property
+    def broadcast(self) -> bool:
+        return self.dsn is not None
+
+    async def start(self) -> None:
+        """Start listening for invalidations sent by the other workers"""
+        if self.broadcast:
+            self._task = asyncio.create_task(self._listen())
+
+    def apply(self, message: dict) -> int:
+        """Drop the entries named by an invalidation message in this worker, returning how many were cached
+
+        A message names the cache and either one "key" or a "match" of key fields
+        and values; a match without fields drops every entry.
+        """
+        cache = self.caches.get(message.get("cache"))
+        if cache is None:
+            return 0
+        if "key" in message:
+            return int(cache.discard(message["key"]))
+        match = message.get("match") or {}
+        if not match:
+            return cache.invalidate()
+        return cache.invalidate(
+            lambda key: all(getattr(key, field, None) == value for field, value in match.items())
+        )
+
+    async def publish(self, db: AsyncSession, cache: str, key: Optional[Hashable] = None,
+                      match: Optional[dict] = None) -> None:
+        """Send an invalidation to every worker when the transaction of db commits"""
+        if self.broadcast:
+            await self._notify(db, _message(cache, key, match))
+
+    async def invalidate(self, cache: str, key: Optional[Hashable] = None, match: Optional[dict] = None) -> int:
+        """Drop entries in this worker at once and in the others through a notification
+
+        Returns the number of entries dropped in this worker.
+        """
+        message = _message(cache, key, match)
+        removed = self.apply(message)
+        if self.broadcast:
+            async with engine.begin() as conn:
+                await self._notify(conn, message)
+        return removed
+
+    def snapshot(self) -> dict:
+        return {**asdict(self.stats), "broadcast": self.broadcast, "listening": self.listening}
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _notify(self, conn, message: dict) -> None:
+        await conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                           {"channel": CHANNEL, "payload": json.dumps(message)})
+        self.stats.sent += 1
+
+    def _notified(self, connection, pid: int, channel: str, payload: str) -> None:
+        self.stats.received += 1
+        try:
+            self.apply(json.loads(payload))
+        except (ValueError, TypeError) as e:
+            logger.warning("Ignoring unreadable cache invalidation %r: %s", payload, e)
+
+    async def _listen(self) -> None:
+        connected_before = False
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                lost = asyncio.Event()
+                connection.add_termination_listener(lambda _: lost.set())
+                await connection.add_listener(CHANNEL, self._notified)
+                if connected_before:
+                    # Invalidations sent while disconnected were missed
+                    self.stats.reconnects += 1
+                    for cache in self.caches.values():
+                        cache.invalidate()
+                connected_before = True
+                self.listening = True
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(lost.wait(), self.ping_seconds)
+                    except asyncio.TimeoutError:
+                        # A connection dropped without a FIN is only noticed when used
+                        await asyncio.wait_for(connection.execute("SELECT 1"), self.ping_seconds)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats.listen_failures += 1
+                logger.warning("Cache invalidation listener failed, reconnecting: %s", e)
+            finally:
+                self.listening = False
+                if connection is not None:
+                    connection.terminate()
+            await asyncio.sleep(1.0)
+
+
+def _message(cache: str, key: Optional[Hashable], match: Optional[dict]) -> dict:
+    return {"cache": cache, "key": key} if key is not None else {"cache": cache, "match": match or {}}
+
+
+def create_cache_invalidation(caches: dict[str, TTLCache]) -> CacheInvalidation:
+    """Create the cross-worker invalidation of caches, by name
+
+    Configured from the environment:
+      CACHE_INVALIDATION_NOTIFY          send invalidations to every worker with Postgres
+                                         LISTEN/NOTIFY (default true)
+      CACHE_INVALIDATION_PING_SECONDS    seconds between checks of the listening connection (default 30)
+    """
+    url = make_url(DATABASE_URL)
+    dsn = None
+    if env_bool("CACHE_INVALIDATION_NOTIFY", True) and url.get_driver_name() == "asyncpg":
+        dsn = url.set(drivername="postgresql").render_as_string(hide_password=False)
+    return CacheInvalidation(caches, dsn, ping_seconds=env_float("CACHE_INVALIDATION_PING_SECONDS", 30.0))
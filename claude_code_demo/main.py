@@ -1,32 +1,42 @@
-from datetime import datetime, timedelta
-from fastapi import FastAPI, Header, HTTPException, status, Depends
-from fastapi.responses import JSONResponse
+from datetime import date, datetime, timedelta
+from fastapi import FastAPI, Header, Depends, Request
+from fastapi.responses import PlainTextResponse
 from typing import Annotated
-import random
-import string
+import asyncio
 import httpx
 import os
+import time
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
+from sqlalchemy import select, update, insert
 
 from .models import (
     GapQuoteRequestDTO,
     GapQuoteResponseDTO,
     GapQuoteResponse,
+    GapStoredQuoteResponseDTO,
+    GapQuoteOptionsRequestDTO,
+    GapQuoteOptionsResponseDTO,
+    GapBulkQuoteRequestDTO,
+    GapBulkQuoteResponseDTO,
     GapBindQuoteRequestDTO,
     GapBindResponseDTO,
     VehicleDetails,
     GapPremium,
     ResponseError,
-    ErrorCategory
+    ErrorCategory,
+    MaxShortfall
 )
 from .database import (
-    run_migrations,
     get_db,
+    get_read_db,
+    pool_stats,
+    engine,
+    replica_engine,
     Quote,
     VehicleDetail,
     GapPremium as DBGapPremium,
     BindRequest,
+    BindDocument,
     FinanceDetail,
     Applicant,
     ApplicantPostalAddress,
@@ -36,6 +46,31 @@ from .database import (
     JointApplicant,
     PolicyStatus
 )
+from .cache import TTLCache
+from .config import env_bool
+from .idempotency import IdempotencyMiddleware, idempotency_options
+from .invalidation import CacheInvalidation, create_cache_invalidation
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, RATING_ERRORS, MetricsMiddleware, register_db_counters, register_pool_gauges, stage_timer
+from .profiling import ProfilingMiddleware, instrument_engine, instrument_http_client, profiling_options, slowest_profiles
+from .quote_ref import create_quote_ref_generator
+from .quotes import QuoteCache, QuoteNotFound, create_quote_cache, load_current_quote, load_quote
+from .rating import PremiumKey, PremiumTable, create_rating_client, create_rating_transport, create_premium_cache, load_premium_table
+from .resilience import ResilientTransport
+from .responses import FastResponseRoute
+from .vehicles import VehicleLookupService, VehicleNotFound, create_vehicle_lookup
+from .write_behind import PendingQuote, QuoteWriteBehind, create_write_behind
+
+# Largest number of quotes accepted by one bulk create request
+BULK_QUOTE_MAX_ITEMS = int(os.getenv("BULK_QUOTE_MAX_ITEMS", "1000"))
+
+# Days a quote can be bound after it is created
+QUOTE_VALIDITY_DAYS = 30
+
+# "normalized" writes a bind across bind_requests and its applicant tables,
+# "document" writes it as a single bind_documents row
+BIND_STORAGE_MODE = os.getenv("BIND_STORAGE_MODE", "normalized")
+if BIND_STORAGE_MODE not in ("normalized", "document"):
+    raise ValueError(f"Unknown BIND_STORAGE_MODE: {BIND_STORAGE_MODE}")
 
 app = FastAPI(
     title="Generator Insurance - GAP Quote Service API",
@@ -43,113 +78,175 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Opt-in: response models returned by the endpoints are rendered by pydantic-core
+# without being validated again, see FastResponseRoute
+if env_bool("FAST_RESPONSES", False):
+    app.router.route_class = FastResponseRoute
+
+# Retried creates and binds sent with the same Idempotency-Key get the first response back
+app.add_middleware(
+    IdempotencyMiddleware,
+    paths=["/quickquote/generator/gap/v2/quote/create", "/quickquote/generator/gap/v2/quote/bind"],
+    **idempotency_options()
+)
+
+# Opt-in request profiling; nothing is installed unless it is enabled
+PROFILING = profiling_options()
+if PROFILING:
+    app.add_middleware(ProfilingMiddleware, **PROFILING)
+    for db_engine in {engine, replica_engine}:
+        instrument_engine(db_engine)
+
+# Outermost, so replayed idempotent responses are counted too
+app.add_middleware(MetricsMiddleware)
+DB_ENGINES = {"primary": engine} if replica_engine is engine else {"primary": engine, "replica": replica_engine}
+register_pool_gauges(DB_ENGINES, lambda: getattr(app.state, "rating_transport", None))
+register_db_counters(DB_ENGINES)
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize database on startup"""
     # Migrations should be run manually with: python migrate.py upgrade
     # This ensures the database connection is working
-    pass
-
-
-def generate_quote_ref() -> str:
-    """Generate a random quote reference number"""
-    return ''.join(random.choices(string.digits, k=8))
-
-
-def get_vehicle_details_mock(rego_or_vin: str) -> VehicleDetails:
-    """Mock function to simulate vehicle lookup"""
-    return VehicleDetails(
-        registration="MKD546" if len(rego_or_vin) < 10 else None,
-        vin="MRHGK5860GP020199" if len(rego_or_vin) < 10 else rego_or_vin,
-        make="HONDA",
-        model="JAZZ",
-        year="2015",
-        ccRating="1497",
-        fuelType="Petrol",
-        odometerReading="89655",
-        bodyColour="RED",
-        bodyStyle="Hatchback"
+    app.state.rating_transport = create_rating_transport()
+    app.state.rating_client = create_rating_client(app.state.rating_transport)
+    app.state.premium_cache = create_premium_cache()
+    app.state.quote_ref_generator = create_quote_ref_generator()
+    app.state.vehicle_lookup = create_vehicle_lookup()
+    app.state.quote_cache = create_quote_cache()
+    app.state.cache_invalidation = create_cache_invalidation(
+        {"premium": app.state.premium_cache, "quote": app.state.quote_cache}
     )
+    await app.state.cache_invalidation.start()
+    app.state.write_behind = create_write_behind()
+    if app.state.write_behind is not None:
+        await app.state.write_behind.start()
+    if PROFILING:
+        instrument_http_client(app.state.rating_client)
 
 
-async def calculate_gap_premium(max_shortfall: str, agent_code: str) -> GapPremium:
-    """Calculate GAP premium by calling external rating API"""
-    rating_api_url = os.getenv("RATING_API_URL", "http://localhost:8088")
-    
-    # Map GAP shortfall to category codes
-    shortfall_to_category = {
-        "GAP_5000": "GAP5000",
-        "GAP_10000": "GAP10000",
-        "GAP_15000": "GAP15000",
-        "GAP_20000": "GAP20000",
-        "GAP_30000": "GAP30000",
-        "GAP_40000": "GAP40000"
-    }
-    
-    category_code = shortfall_to_category.get(max_shortfall, "GAP5")
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release pooled connections on shutdown"""
+    await app.state.cache_invalidation.close()
+    await app.state.premium_cache.close()
+    await app.state.vehicle_lookup.close()
+    await app.state.quote_cache.close()
+    await app.state.rating_client.aclose()
+    if app.state.write_behind is not None:
+        await app.state.write_behind.close()
+    for db_engine in DB_ENGINES.values():
+        await db_engine.dispose()
+
+
+def get_rating_client(request: Request) -> httpx.AsyncClient:
+    """Dependency to get the shared rating engine client"""
+    return request.app.state.rating_client
+
+
+def get_rating_transport(request: Request) -> ResilientTransport:
+    """Dependency to get the retrying, circuit breaking transport of the rating engine client"""
+    return request.app.state.rating_transport
+
+
+def get_premium_cache(request: Request) -> TTLCache:
+    """Dependency to get the rating engine premium cache"""
+    return request.app.state.premium_cache
+
+
+def get_quote_ref_generator(request: Request):
+    """Dependency to get the quote reference generator"""
+    return request.app.state.quote_ref_generator
+
+
+def get_vehicle_lookup(request: Request) -> VehicleLookupService:
+    """Dependency to get the cached vehicle lookup service"""
+    return request.app.state.vehicle_lookup
+
+
+def get_quote_cache(request: Request) -> QuoteCache:
+    """Dependency to get the cache of quotes by reference"""
+    return request.app.state.quote_cache
+
+
+def get_cache_invalidation(request: Request) -> CacheInvalidation:
+    """Dependency to get the invalidation of the caches of every worker"""
+    return request.app.state.cache_invalidation
+
+
+def get_write_behind(request: Request) -> QuoteWriteBehind | None:
+    """Dependency to get the write-behind queue of created quotes, None when quotes are written directly"""
+    return request.app.state.write_behind
+
+
+async def get_premium_table(client: httpx.AsyncClient, cache: TTLCache) -> PremiumTable:
+    """Get the indexed GAP premiums from the cache or the external rating API"""
+    # Every agent is rated on the rate card of agent 499, so one table serves all requests
+    key = PremiumKey(
+        agent_code="499",
+        rate_card_code="GAP",  # Default rate card
+        category_code="GC1"
+    )
     
-    params = {
-        "agentCode": "499",
-        "rateCardCode": "GAP",  # Default rate card
-        "categoryCode": "GC1"
-    }
+    async def load() -> PremiumTable:
+        try:
+            return await load_premium_table(client, key)
+        except (httpx.RequestError, httpx.HTTPStatusError) as e:
+            RATING_ERRORS.inc(error=type(e).__name__)
+            raise
     
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{rating_api_url}/rating/agent/category/premium",
-                params=params,
-                timeout=10.0
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            # Find the matching cover based on shortfall amount
-            target_cover_code = shortfall_to_category.get(max_shortfall)
-            if not target_cover_code:
-                raise ValueError(f"Unknown shortfall amount: {max_shortfall}")
-            
-            if not data.get("covers") or len(data["covers"]) == 0:
-                raise ValueError("No covers found in rating API response")
-            print(target_cover_code)
-
-            # Search through covers to find the matching one
-            matching_cover = None
-            for cover in data["covers"]:
-                if cover.get("code", "").lower() == target_cover_code.lower():
-                    matching_cover = cover
-                    break
-            
-            if not matching_cover:
-                raise ValueError(f"Cover with code '{target_cover_code}' not found in rating API response")
-            
-            # Extract premium from the matching cover
-            if (matching_cover.get("rateCardExcess") and
-                len(matching_cover["rateCardExcess"]) > 0 and
-                matching_cover["rateCardExcess"][0].get("premium") and
-                len(matching_cover["rateCardExcess"][0]["premium"]) > 0):
-                
-                premium_data = matching_cover["rateCardExcess"][0]["premium"][0]
-                retail_premium = premium_data.get("agentRetailPremiumEx")
-                wholesale_premium = premium_data.get("agentWholesalePremiumEx")
-                
-                if retail_premium is None or wholesale_premium is None:
-                    raise ValueError("Premium data not found in rating API response")
-                
-                return GapPremium(
-                    wholesaleAmount=wholesale_premium,
-                    retailAmount=retail_premium
-                )
-            else:
-                # Return error if structure is unexpected
-                raise ValueError(f"Invalid premium structure for cover '{target_cover_code}'")
-                
-    except (httpx.RequestError, httpx.HTTPStatusError, ValueError) as e:
-        # Fallback to mock calculation if API call fails
-        print(f"Rating API call failed: {e}, using fallback calculation")
+    return await cache.get_or_load(key, load)
+
+
+async def calculate_gap_premium(
+    max_shortfall: str,
+    client: httpx.AsyncClient,
+    cache: TTLCache
+) -> GapPremium:
+    """Calculate GAP premium by calling external rating API"""
+    premium_table = await get_premium_table(client, cache)
+    return premium_table.premium_for(max_shortfall)
+
 
-        raise e
+def build_db_quote(
+    quote_ref: str,
+    rego_or_vin: str,
+    max_shortfall: str,
+    quote_expiry: date,
+    vehicle_details: VehicleDetails,
+    gap_premium: GapPremium,
+    agent_code: str,
+    brand_code: str,
+    user_code: str
+) -> Quote:
+    """Build a quote row with its vehicle details and premium attached"""
+    return Quote(
+        quote_ref=quote_ref,
+        rego_or_vin=rego_or_vin,
+        max_shortfall=max_shortfall,
+        quote_expiry_date=quote_expiry,
+        gst_rate="15",
+        policy_status=PolicyStatus.CREATED.value,
+        agent_code=agent_code,
+        brand_code=brand_code,
+        user_code=user_code,
+        vehicle_details=VehicleDetail(
+            registration=vehicle_details.registration,
+            vin=vehicle_details.vin,
+            make=vehicle_details.make,
+            model=vehicle_details.model,
+            year=vehicle_details.year,
+            cc_rating=vehicle_details.ccRating,
+            fuel_type=vehicle_details.fuelType,
+            odometer_reading=vehicle_details.odometerReading,
+            body_colour=vehicle_details.bodyColour,
+            body_style=vehicle_details.bodyStyle
+        ),
+        gap_premium=DBGapPremium(
+            wholesale_amount=gap_premium.wholesaleAmount,
+            retail_amount=gap_premium.retailAmount
+        )
+    )
 
 
 @app.post("/quickquote/generator/gap/v2/quote/create", response_model=GapQuoteResponseDTO)
@@ -158,81 +255,93 @@ async def create_quote(
     x_agent_code: Annotated[str, Header(alias="X-Agent-Code")],
     x_brand_code: Annotated[str, Header(alias="X-Brand-Code")],
     x_user_code: Annotated[str, Header(alias="X-User-Code")],
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    rating_client: httpx.AsyncClient = Depends(get_rating_client),
+    premium_cache: TTLCache = Depends(get_premium_cache),
+    quote_refs=Depends(get_quote_ref_generator),
+    vehicle_lookup: VehicleLookupService = Depends(get_vehicle_lookup),
+    write_behind: QuoteWriteBehind | None = Depends(get_write_behind)
 ):
     """Create a new GAP quote"""
     try:
         # Validate input
-        if not quote_request.regoOrVin:
-            return GapQuoteResponseDTO(
-                errors=[ResponseError(
-                    category=ErrorCategory.VALIDATION,
-                    code="ER001",
-                    message="Registration or VIN is mandatory",
-                    field="regoOrVin"
-                )]
-            )
+        with stage_timer("create_quote", "validation"):
+            if not quote_request.regoOrVin:
+                return GapQuoteResponseDTO(
+                    errors=[ResponseError(
+                        category=ErrorCategory.VALIDATION,
+                        code="ER001",
+                        message="Registration or VIN is mandatory",
+                        field="regoOrVin"
+                    )]
+                )
         
-        # Mock vehicle lookup
-        vehicle_details = get_vehicle_details_mock(quote_request.regoOrVin)
+        with stage_timer("create_quote", "vehicle_lookup"):
+            try:
+                vehicle_details = await vehicle_lookup.lookup(quote_request.regoOrVin)
+            except VehicleNotFound:
+                return GapQuoteResponseDTO(
+                    errors=[ResponseError(
+                        category=ErrorCategory.BUSINESS,
+                        code="ER008",
+                        message="Vehicle not found",
+                        field="regoOrVin"
+                    )]
+                )
         
         # Calculate premium
-        gap_premium = await calculate_gap_premium(quote_request.maxShortfall.value, x_agent_code)
+        with stage_timer("create_quote", "rating"):
+            gap_premium = await calculate_gap_premium(
+                quote_request.maxShortfall.value, rating_client, premium_cache
+            )
         
         # Generate quote reference
-        quote_ref = generate_quote_ref()
-        quote_expiry = (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d")
-        
-        # Save quote to database
-        db_quote = Quote(
-            quote_ref=quote_ref,
-            rego_or_vin=quote_request.regoOrVin,
-            max_shortfall=quote_request.maxShortfall.value,
-            quote_expiry_date=quote_expiry,
-            gst_rate="15",
-            policy_status=PolicyStatus.CREATED.value,
-            agent_code=x_agent_code,
-            brand_code=x_brand_code,
-            user_code=x_user_code
-        )
-        db.add(db_quote)
-        await db.flush()
-        
-        # Save vehicle details
-        db_vehicle = VehicleDetail(
-            quote_id=db_quote.id,
-            registration=vehicle_details.registration,
-            vin=vehicle_details.vin,
-            make=vehicle_details.make,
-            model=vehicle_details.model,
-            year=vehicle_details.year,
-            cc_rating=vehicle_details.ccRating,
-            fuel_type=vehicle_details.fuelType,
-            odometer_reading=vehicle_details.odometerReading,
-            body_colour=vehicle_details.bodyColour,
-            body_style=vehicle_details.bodyStyle
-        )
-        db.add(db_vehicle)
-        
-        # Save gap premium
-        db_premium = DBGapPremium(
-            quote_id=db_quote.id,
-            wholesale_amount=gap_premium.wholesaleAmount,
-            retail_amount=gap_premium.retailAmount
-        )
-        db.add(db_premium)
-        
-        await db.commit()
+        with stage_timer("create_quote", "quote_ref"):
+            quote_ref = await quote_refs.next_ref(db)
+        quote_expiry = (datetime.now() + timedelta(days=QUOTE_VALIDITY_DAYS)).date()
         
         # Generate quote response
         quote_response = GapQuoteResponse(
             quoteRef=quote_ref,
-            quoteExpiryDate=quote_expiry,
+            quoteExpiryDate=quote_expiry.isoformat(),
             gstRate="15",
             vehicleDetails=vehicle_details,
             gapPremium=gap_premium
         )
         
+        # Durably queued and inserted by the background writer, so the reply does
+        # not wait for the database; written here when there is no queue or it is full
+        queued = False
+        if write_behind is not None:
+            with stage_timer("create_quote", "write_behind_queue"):
+                queued = await write_behind.put(PendingQuote(
+                    created_at=datetime.utcnow(),
+                    rego_or_vin=quote_request.regoOrVin,
+                    max_shortfall=quote_request.maxShortfall.value,
+                    agent_code=x_agent_code,
+                    brand_code=x_brand_code,
+                    user_code=x_user_code,
+                    response=quote_response
+                ))
+        if not queued:
+            # Save quote, vehicle details and premium in one flush
+            db.add(build_db_quote(
+                quote_ref=quote_ref,
+                rego_or_vin=quote_request.regoOrVin,
+                max_shortfall=quote_request.maxShortfall.value,
+                quote_expiry=quote_expiry,
+                vehicle_details=vehicle_details,
+                gap_premium=gap_premium,
+                agent_code=x_agent_code,
+                brand_code=x_brand_code,
+                user_code=x_user_code
+            ))
+            
+            with stage_timer("create_quote", "db_flush"):
+                await db.flush()
+            with stage_timer("create_quote", "commit"):
+                await db.commit()
+        
         return GapQuoteResponseDTO(
             quoteResponse=quote_response,
             errors=[]
@@ -249,171 +358,483 @@ async def create_quote(
         )
 
 
-@app.post("/quickquote/generator/gap/v2/quote/bind", response_model=GapBindResponseDTO)
-async def bind_quote(
-    bind_request: GapBindQuoteRequestDTO,
+@app.post("/quickquote/generator/gap/v2/quote/options", response_model=GapQuoteOptionsResponseDTO)
+async def create_quote_options(
+    options_request: GapQuoteOptionsRequestDTO,
     x_agent_code: Annotated[str, Header(alias="X-Agent-Code")],
     x_brand_code: Annotated[str, Header(alias="X-Brand-Code")],
     x_user_code: Annotated[str, Header(alias="X-User-Code")],
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    rating_client: httpx.AsyncClient = Depends(get_rating_client),
+    premium_cache: TTLCache = Depends(get_premium_cache),
+    quote_refs=Depends(get_quote_ref_generator),
+    vehicle_lookup: VehicleLookupService = Depends(get_vehicle_lookup)
 ):
-    """Bind a GAP quote"""
+    """Create one GAP quote per shortfall tier from a single vehicle lookup and rating fetch"""
     try:
-        # Validate quote reference exists
-        if not bind_request.quoteRef:
-            return GapBindResponseDTO(
+        # Validate input
+        if not options_request.regoOrVin:
+            return GapQuoteOptionsResponseDTO(
                 errors=[ResponseError(
                     category=ErrorCategory.VALIDATION,
-                    code="ER002",
-                    message="Quote reference is mandatory",
-                    field="quoteRef"
+                    code="ER001",
+                    message="Registration or VIN is mandatory",
+                    field="regoOrVin"
                 )]
             )
         
-        # Check if quote exists in database
-        result = await db.execute(
-            select(Quote).where(Quote.quote_ref == bind_request.quoteRef)
-        )
-        quote = result.scalar_one_or_none()
+        max_shortfalls = list(dict.fromkeys(options_request.maxShortfalls or MaxShortfall))
         
-        if not quote:
-            return GapBindResponseDTO(
+        try:
+            vehicle_details = await vehicle_lookup.lookup(options_request.regoOrVin)
+        except VehicleNotFound:
+            return GapQuoteOptionsResponseDTO(
                 errors=[ResponseError(
                     category=ErrorCategory.BUSINESS,
-                    code="ER404",
-                    message="Quote not found or expired",
-                    field="quoteRef"
+                    code="ER008",
+                    message="Vehicle not found",
+                    field="regoOrVin"
                 )]
             )
         
-        # Validate mandatory fields
+        # One rating fetch prices every tier
+        premium_table = await get_premium_table(rating_client, premium_cache)
+        
+        quote_expiry = (datetime.now() + timedelta(days=QUOTE_VALIDITY_DAYS)).date()
+        quote_responses = []
         errors = []
         
-        if bind_request.vehicleValue <= 0:
-            errors.append(ResponseError(
-                category=ErrorCategory.VALIDATION,
-                code="ER003",
-                message="Vehicle value must be greater than 0",
-                field="vehicleValue"
+        for max_shortfall in max_shortfalls:
+            try:
+                gap_premium = premium_table.premium_for(max_shortfall.value)
+            except ValueError as e:
+                errors.append(ResponseError(
+                    category=ErrorCategory.FUNCTIONAL,
+                    code="ER006",
+                    message=str(e),
+                    field="maxShortfalls"
+                ))
+                continue
+            
+            quote_ref = await quote_refs.next_ref(db)
+            db.add(build_db_quote(
+                quote_ref=quote_ref,
+                rego_or_vin=options_request.regoOrVin,
+                max_shortfall=max_shortfall.value,
+                quote_expiry=quote_expiry,
+                vehicle_details=vehicle_details,
+                gap_premium=gap_premium,
+                agent_code=x_agent_code,
+                brand_code=x_brand_code,
+                user_code=x_user_code
             ))
-        
-        if not bind_request.agreeToDeclaration:
-            errors.append(ResponseError(
-                category=ErrorCategory.VALIDATION,
-                code="ER004",
-                message="Must agree to declaration",
-                field="agreeToDeclaration"
+            quote_responses.append(GapQuoteResponse(
+                quoteRef=quote_ref,
+                quoteExpiryDate=quote_expiry.isoformat(),
+                gstRate="15",
+                vehicleDetails=vehicle_details,
+                gapPremium=gap_premium
             ))
         
-        if bind_request.paymentMethod == "FINANCED" and not bind_request.loanContractNumber:
-            errors.append(ResponseError(
-                category=ErrorCategory.VALIDATION,
-                code="ER005",
-                message="Loan contract number is mandatory when payment method is FINANCED",
-                field="loanContractNumber"
-            ))
+        # All quotes are persisted in one transaction
+        await db.commit()
         
-        if errors:
-            return GapBindResponseDTO(errors=errors)
+        return GapQuoteOptionsResponseDTO(
+            quoteResponses=quote_responses,
+            errors=errors
+        )
         
-        # Create bind request record
-        db_bind = BindRequest(
-            quote_id=quote.id,
-            vehicle_value=bind_request.vehicleValue,
-            vehicle_insurer=bind_request.vehicleInsurer,
-            retail_premium_adjustment=bind_request.retailPremiumAdjustment,
-            agree_to_declaration=bind_request.agreeToDeclaration,
-            payment_method=bind_request.paymentMethod.value,
-            loan_contract_number=bind_request.loanContractNumber,
-            applicants_email=bind_request.applicantsEmail,
-            vehicle_deposit_provided=bind_request.vehicleDepositProvided,
-            continue_purchase=bind_request.continuePurchase,
-            agent_code=x_agent_code,
-            brand_code=x_brand_code,
-            user_code=x_user_code
+    except Exception as e:
+        await db.rollback()
+        return GapQuoteOptionsResponseDTO(
+            errors=[ResponseError(
+                category=ErrorCategory.SYSTEM,
+                code="ER999",
+                message=f"System error: {str(e)}"
+            )]
         )
-        db.add(db_bind)
-        await db.flush()
+
+
+@app.post("/quickquote/generator/gap/v2/quote/create/bulk", response_model=GapBulkQuoteResponseDTO)
+async def create_quotes_bulk(
+    bulk_request: GapBulkQuoteRequestDTO,
+    x_agent_code: Annotated[str, Header(alias="X-Agent-Code")],
+    x_brand_code: Annotated[str, Header(alias="X-Brand-Code")],
+    x_user_code: Annotated[str, Header(alias="X-User-Code")],
+    db: AsyncSession = Depends(get_db),
+    rating_client: httpx.AsyncClient = Depends(get_rating_client),
+    premium_cache: TTLCache = Depends(get_premium_cache),
+    quote_refs=Depends(get_quote_ref_generator),
+    vehicle_lookup: VehicleLookupService = Depends(get_vehicle_lookup)
+):
+    """Create many GAP quotes, writing each table with batched multi-row inserts"""
+    try:
+        if len(bulk_request.quotes) > BULK_QUOTE_MAX_ITEMS:
+            return GapBulkQuoteResponseDTO(
+                errors=[ResponseError(
+                    category=ErrorCategory.VALIDATION,
+                    code="ER007",
+                    message=f"A bulk request may contain at most {BULK_QUOTE_MAX_ITEMS} quotes",
+                    field="quotes"
+                )]
+            )
+        
+        # Every item is priced from the same premium table
+        premium_table = await get_premium_table(rating_client, premium_cache)
+        quote_expiry = (datetime.now() + timedelta(days=QUOTE_VALIDITY_DAYS)).date()
+        
+        results = []
+        priced = []
+        for quote_request in bulk_request.quotes:
+            if not quote_request.regoOrVin:
+                results.append(GapQuoteResponseDTO(
+                    errors=[ResponseError(
+                        category=ErrorCategory.VALIDATION,
+                        code="ER001",
+                        message="Registration or VIN is mandatory",
+                        field="regoOrVin"
+                    )]
+                ))
+                continue
+            
+            try:
+                gap_premium = premium_table.premium_for(quote_request.maxShortfall.value)
+            except ValueError as e:
+                results.append(GapQuoteResponseDTO(
+                    errors=[ResponseError(
+                        category=ErrorCategory.FUNCTIONAL,
+                        code="ER006",
+                        message=str(e),
+                        field="maxShortfall"
+                    )]
+                ))
+                continue
+            
+            priced.append((len(results), quote_request, gap_premium))
+            results.append(None)
+        
+        # Vehicles are looked up once per distinct registration or VIN
+        vehicles = await vehicle_lookup.lookup_many(
+            quote_request.regoOrVin for _, quote_request, _ in priced
+        )
+        found = []
+        for position, quote_request, gap_premium in priced:
+            vehicle_details = vehicles[quote_request.regoOrVin]
+            if vehicle_details is None:
+                results[position] = GapQuoteResponseDTO(
+                    errors=[ResponseError(
+                        category=ErrorCategory.BUSINESS,
+                        code="ER008",
+                        message="Vehicle not found",
+                        field="regoOrVin"
+                    )]
+                )
+            else:
+                found.append((position, quote_request, vehicle_details, gap_premium))
+        priced = found
+        
+        # Quote references for the whole batch come from one allocation
+        quote_ref_batch = await quote_refs.next_refs(db, len(priced)) if priced else []
+        quotes = []
+        for (position, quote_request, vehicle_details, gap_premium), quote_ref in zip(priced, quote_ref_batch):
+            quote_response = GapQuoteResponse(
+                quoteRef=quote_ref,
+                quoteExpiryDate=quote_expiry.isoformat(),
+                gstRate="15",
+                vehicleDetails=vehicle_details,
+                gapPremium=gap_premium
+            )
+            quotes.append((quote_request, quote_response))
+            results[position] = GapQuoteResponseDTO(quoteResponse=quote_response, errors=[])
+        
+        if quotes:
+            # Every row shares one creation time, so the children are routed to
+            # the same monthly partition as their quote
+            created_at = datetime.utcnow()
+            
+            # One multi-row INSERT ... RETURNING per table, ids come back in row order
+            quote_ids = (await db.execute(
+                insert(Quote).returning(Quote.id, sort_by_parameter_order=True),
+                [
+                    {
+                        "quote_ref": quote_response.quoteRef,
+                        "rego_or_vin": quote_request.regoOrVin,
+                        "max_shortfall": quote_request.maxShortfall.value,
+                        "quote_expiry_date": quote_expiry,
+                        "gst_rate": "15",
+                        "policy_status": PolicyStatus.CREATED.value,
+                        "agent_code": x_agent_code,
+                        "brand_code": x_brand_code,
+                        "user_code": x_user_code,
+                        "created_at": created_at
+                    }
+                    for quote_request, quote_response in quotes
+                ]
+            )).scalars().all()
+            
+            await db.execute(
+                insert(VehicleDetail).returning(VehicleDetail.id),
+                [
+                    {
+                        "quote_id": quote_id,
+                        "quote_created_at": created_at,
+                        "registration": quote_response.vehicleDetails.registration,
+                        "vin": quote_response.vehicleDetails.vin,
+                        "make": quote_response.vehicleDetails.make,
+                        "model": quote_response.vehicleDetails.model,
+                        "year": quote_response.vehicleDetails.year,
+                        "cc_rating": quote_response.vehicleDetails.ccRating,
+                        "fuel_type": quote_response.vehicleDetails.fuelType,
+                        "odometer_reading": quote_response.vehicleDetails.odometerReading,
+                        "body_colour": quote_response.vehicleDetails.bodyColour,
+                        "body_style": quote_response.vehicleDetails.bodyStyle
+                    }
+                    for quote_id, (_, quote_response) in zip(quote_ids, quotes)
+                ]
+            )
+            
+            await db.execute(
+                insert(DBGapPremium).returning(DBGapPremium.id),
+                [
+                    {
+                        "quote_id": quote_id,
+                        "quote_created_at": created_at,
+                        "wholesale_amount": quote_response.gapPremium.wholesaleAmount,
+                        "retail_amount": quote_response.gapPremium.retailAmount
+                    }
+                    for quote_id, (_, quote_response) in zip(quote_ids, quotes)
+                ]
+            )
+            
+            await db.commit()
         
-        # Save finance details
-        db_finance = FinanceDetail(
-            bind_request_id=db_bind.id,
+        return GapBulkQuoteResponseDTO(results=results, errors=[])
+        
+    except Exception as e:
+        await db.rollback()
+        return GapBulkQuoteResponseDTO(
+            errors=[ResponseError(
+                category=ErrorCategory.SYSTEM,
+                code="ER999",
+                message=f"System error: {str(e)}"
+            )]
+        )
+
+
+def build_db_bind_request(
+    bind_request: GapBindQuoteRequestDTO,
+    quote_id: int,
+    quote_created_at: datetime,
+    agent_code: str,
+    brand_code: str,
+    user_code: str
+) -> BindRequest:
+    """Build a bind request row with its finance details and applicant graph attached"""
+    applicant = bind_request.applicant
+    business_applicant = None
+    if applicant.businessApplicant:
+        business_applicant = BusinessApplicant(
+            business_name=applicant.businessApplicant.businessName,
+            contact_persons=[
+                BusinessContactPerson(
+                    first_name=contact_person.firstName,
+                    surname=contact_person.surname,
+                    business_contact_type=contact_person.businessContactType.value
+                )
+                for contact_person in applicant.businessApplicant.businessContactPersons or []
+            ]
+        )
+    
+    return BindRequest(
+        quote_id=quote_id,
+        quote_created_at=quote_created_at,
+        vehicle_value=bind_request.vehicleValue,
+        vehicle_insurer=bind_request.vehicleInsurer,
+        retail_premium_adjustment=bind_request.retailPremiumAdjustment,
+        agree_to_declaration=bind_request.agreeToDeclaration,
+        payment_method=bind_request.paymentMethod.value,
+        loan_contract_number=bind_request.loanContractNumber,
+        applicants_email=bind_request.applicantsEmail,
+        vehicle_deposit_provided=bind_request.vehicleDepositProvided,
+        continue_purchase=bind_request.continuePurchase,
+        agent_code=agent_code,
+        brand_code=brand_code,
+        user_code=user_code,
+        finance_details=FinanceDetail(
             company=bind_request.financeDetails.company,
             amount=bind_request.financeDetails.amount,
             balance_payable=bind_request.financeDetails.balancePayable,
-            start_date=bind_request.financeDetails.startDate.isoformat(),
+            start_date=bind_request.financeDetails.startDate,
             contract_length=bind_request.financeDetails.contractLength
+        ),
+        applicant=Applicant(
+            first_name=applicant.firstName,
+            sur_name=applicant.surName,
+            date_of_birth=applicant.dateOfBirth,
+            postal_address=ApplicantPostalAddress(
+                address_line1=applicant.applicantPostalAddress.addressLine1,
+                address_line2=applicant.applicantPostalAddress.addressLine2,
+                suburb=applicant.applicantPostalAddress.suburb,
+                city=applicant.applicantPostalAddress.city,
+                postcode=applicant.applicantPostalAddress.postcode
+            ),
+            contact=ApplicantContact(
+                phone=applicant.applicantContact.phone,
+                mobile_num=applicant.applicantContact.mobileNum,
+                email_address=str(applicant.applicantContact.emailAddress) if applicant.applicantContact.emailAddress else None
+            ),
+            business_applicant=business_applicant,
+            joint_applicants=[
+                JointApplicant(
+                    first_name=joint.firstName,
+                    surname=joint.surname,
+                    date_of_birth=joint.dateOfBirth
+                )
+                for joint in applicant.jointApplicants
+            ]
         )
-        db.add(db_finance)
-        
-        # Save applicant
-        db_applicant = Applicant(
-            bind_request_id=db_bind.id,
-            first_name=bind_request.applicant.firstName,
-            sur_name=bind_request.applicant.surName,
-            date_of_birth=bind_request.applicant.dateOfBirth.isoformat()
-        )
-        db.add(db_applicant)
-        await db.flush()
-        
-        # Save postal address
-        db_address = ApplicantPostalAddress(
-            applicant_id=db_applicant.id,
-            address_line1=bind_request.applicant.applicantPostalAddress.addressLine1,
-            address_line2=bind_request.applicant.applicantPostalAddress.addressLine2,
-            suburb=bind_request.applicant.applicantPostalAddress.suburb,
-            city=bind_request.applicant.applicantPostalAddress.city,
-            postcode=bind_request.applicant.applicantPostalAddress.postcode
-        )
-        db.add(db_address)
-        
-        # Save contact
-        db_contact = ApplicantContact(
-            applicant_id=db_applicant.id,
-            phone=bind_request.applicant.applicantContact.phone,
-            mobile_num=bind_request.applicant.applicantContact.mobileNum,
-            email_address=str(bind_request.applicant.applicantContact.emailAddress) if bind_request.applicant.applicantContact.emailAddress else None
+    )
+
+
+def build_db_bind_document(
+    bind_request: GapBindQuoteRequestDTO,
+    quote_id: int,
+    quote_created_at: datetime,
+    agent_code: str,
+    brand_code: str,
+    user_code: str
+) -> BindDocument:
+    """Build a bind document row holding the whole validated bind request"""
+    return BindDocument(
+        quote_id=quote_id,
+        quote_created_at=quote_created_at,
+        quote_ref=bind_request.quoteRef,
+        payment_method=bind_request.paymentMethod.value,
+        document=bind_request.model_dump(mode="json"),
+        agent_code=agent_code,
+        brand_code=brand_code,
+        user_code=user_code
+    )
+
+
+@app.post("/quickquote/generator/gap/v2/quote/bind", response_model=GapBindResponseDTO)
+async def bind_quote(
+    bind_request: GapBindQuoteRequestDTO,
+    x_agent_code: Annotated[str, Header(alias="X-Agent-Code")],
+    x_brand_code: Annotated[str, Header(alias="X-Brand-Code")],
+    x_user_code: Annotated[str, Header(alias="X-User-Code")],
+    db: AsyncSession = Depends(get_db),
+    quote_cache: QuoteCache = Depends(get_quote_cache),
+    cache_invalidation: CacheInvalidation = Depends(get_cache_invalidation),
+    write_behind: QuoteWriteBehind | None = Depends(get_write_behind)
+):
+    """Bind a GAP quote"""
+    try:
+        # Validate quote reference exists
+        if not bind_request.quoteRef:
+            return GapBindResponseDTO(
+                errors=[ResponseError(
+                    category=ErrorCategory.VALIDATION,
+                    code="ER002",
+                    message="Quote reference is mandatory",
+                    field="quoteRef"
+                )]
+            )
+        
+        quote_not_found = GapBindResponseDTO(
+            errors=[ResponseError(
+                category=ErrorCategory.BUSINESS,
+                code="ER404",
+                message="Quote not found or expired",
+                field="quoteRef"
+            )]
         )
-        db.add(db_contact)
         
-        # Save business applicant (if present)
-        if bind_request.applicant.businessApplicant:
-            db_business = BusinessApplicant(
-                applicant_id=db_applicant.id,
-                business_name=bind_request.applicant.businessApplicant.businessName
-            )
-            db.add(db_business)
-            await db.flush()
-            
-            # Save business contact persons
-            if bind_request.applicant.businessApplicant.businessContactPersons:
-                for contact_person in bind_request.applicant.businessApplicant.businessContactPersons:
-                    db_contact_person = BusinessContactPerson(
-                        business_applicant_id=db_business.id,
-                        first_name=contact_person.firstName,
-                        surname=contact_person.surname,
-                        business_contact_type=contact_person.businessContactType.value
-                    )
-                    db.add(db_contact_person)
-        
-        # Save joint applicants
-        for joint in bind_request.applicant.jointApplicants:
-            db_joint = JointApplicant(
-                applicant_id=db_applicant.id,
-                first_name=joint.firstName,
-                surname=joint.surname,
-                date_of_birth=joint.dateOfBirth.isoformat() if joint.dateOfBirth else None
+        # Validate mandatory fields
+        with stage_timer("bind_quote", "validation"):
+            errors = []
+                    
+            if bind_request.vehicleValue <= 0:
+                errors.append(ResponseError(
+                    category=ErrorCategory.VALIDATION,
+                    code="ER003",
+                    message="Vehicle value must be greater than 0",
+                    field="vehicleValue"
+                ))
+                    
+            if not bind_request.agreeToDeclaration:
+                errors.append(ResponseError(
+                    category=ErrorCategory.VALIDATION,
+                    code="ER004",
+                    message="Must agree to declaration",
+                    field="agreeToDeclaration"
+                ))
+                    
+            if bind_request.paymentMethod == "FINANCED" and not bind_request.loanContractNumber:
+                errors.append(ResponseError(
+                    category=ErrorCategory.VALIDATION,
+                    code="ER005",
+                    message="Loan contract number is mandatory when payment method is FINANCED",
+                    field="loanContractNumber"
+                ))
+        
+        # Only quotes still valid can be bound; the creation time bound lets
+        # Postgres skip every monthly partition older than the validity window
+        created_after = datetime.utcnow() - timedelta(days=QUOTE_VALIDITY_DAYS)
+        
+        # A quote still queued in this worker is written before it is looked up
+        if write_behind is not None:
+            with stage_timer("bind_quote", "write_behind_flush"):
+                await write_behind.flush(bind_request.quoteRef)
+        
+        if errors:
+            # An unknown quote is reported ahead of field errors
+            result = await db.execute(
+                select(Quote.id).where(
+                    Quote.quote_ref == bind_request.quoteRef,
+                    Quote.created_at >= created_after
+                )
             )
-            db.add(db_joint)
+            if result.scalar_one_or_none() is None:
+                return quote_not_found
+            return GapBindResponseDTO(errors=errors)
         
-        # Update quote status to CONVERTED
-        await db.execute(
+        # Look up the quote and mark it CONVERTED in one statement; the row stays
+        # locked until the bind is committed
+        convert = (
             update(Quote)
-            .where(Quote.id == quote.id)
+            .where(Quote.quote_ref == bind_request.quoteRef, Quote.created_at >= created_after)
             .values(policy_status=PolicyStatus.CONVERTED.value, updated_at=datetime.utcnow())
+            .returning(Quote.id, Quote.created_at)
         )
+        with stage_timer("bind_quote", "quote_lookup"):
+            quote = (await db.execute(convert)).one_or_none()
+            if quote is None and write_behind is not None:
+                # The quote may still be queued by another worker, which writes it
+                # within its flush interval
+                deadline = time.monotonic() + write_behind.bind_wait_seconds
+                while quote is None and time.monotonic() < deadline:
+                    await db.rollback()
+                    await asyncio.sleep(min(write_behind.flush_interval_seconds / 2, deadline - time.monotonic()))
+                    quote = (await db.execute(convert)).one_or_none()
         
-        await db.commit()
+        if quote is None:
+            await db.rollback()
+            return quote_not_found
+        
+        # The whole bind aggregate is inserted by a single flush, one batched
+        # INSERT per table, or one INSERT in document mode
+        build = build_db_bind_document if BIND_STORAGE_MODE == "document" else build_db_bind_request
+        db.add(build(bind_request, quote.id, quote.created_at, x_agent_code, x_brand_code, x_user_code))
+        with stage_timer("bind_quote", "db_flush"):
+            await db.flush()
+        # The cached quote still shows it as CREATED; the other workers drop
+        # theirs when the bind commits
+        await cache_invalidation.publish(db, "quote", key=bind_request.quoteRef)
+        with stage_timer("bind_quote", "commit"):
+            await db.commit()
+        
+        quote_cache.discard(bind_request.quoteRef)
         
         return GapBindResponseDTO(errors=[])
         
@@ -428,6 +849,140 @@ async def bind_quote(
         )
 
 
+@app.get("/quickquote/generator/gap/v2/quote/{quoteRef}", response_model=GapStoredQuoteResponseDTO)
+async def get_quote(
+    quoteRef: str,
+    x_agent_code: Annotated[str, Header(alias="X-Agent-Code")],
+    x_read_consistency: Annotated[str | None, Header(alias="X-Read-Consistency")] = None,
+    db: AsyncSession = Depends(get_read_db),
+    quote_cache: QuoteCache = Depends(get_quote_cache),
+    write_behind: QuoteWriteBehind | None = Depends(get_write_behind)
+):
+    """Get a quote still in its validity window with its vehicle details and premium"""
+    quote_not_found = GapStoredQuoteResponseDTO(
+        errors=[ResponseError(
+            category=ErrorCategory.BUSINESS,
+            code="ER404",
+            message="Quote not found or expired",
+            field="quoteRef"
+        )]
+    )
+    try:
+        created_after = datetime.utcnow() - timedelta(days=QUOTE_VALIDITY_DAYS)
+        
+        # Unknown references are not cached, so a quote not yet on the replica
+        # is found once it arrives
+        with stage_timer("get_quote", "quote_lookup"):
+            try:
+                # A quote still queued in this worker is not in the database yet
+                stored = write_behind.lookup(quoteRef) if write_behind is not None else None
+                if stored is None and x_read_consistency == "primary":
+                    # Reading its own writes skips the cache and refreshes it from the primary
+                    stored = await load_quote(db, quoteRef, created_after)
+                    quote_cache.set(quoteRef, stored)
+                elif stored is None:
+                    stored = await quote_cache.get_or_load(
+                        quoteRef, lambda: load_current_quote(db, quoteRef, created_after, quote_cache)
+                    )
+            except QuoteNotFound:
+                return quote_not_found
+        
+        # Quotes of other agents are reported as not found
+        if stored.agent_code != x_agent_code:
+            return quote_not_found
+        
+        return GapStoredQuoteResponseDTO(quoteResponse=stored.response, errors=[])
+        
+    except Exception as e:
+        await db.rollback()
+        return GapStoredQuoteResponseDTO(
+            errors=[ResponseError(
+                category=ErrorCategory.SYSTEM,
+                code="ER999",
+                message=f"System error: {str(e)}"
+            )]
+        )
+
+
+@app.get("/admin/quotes/cache")
+async def quote_cache_stats(quote_cache: QuoteCache = Depends(get_quote_cache)):
+    """Quote cache hit/miss counters"""
+    return quote_cache.snapshot()
+
+
+@app.get("/admin/quotes/write-behind")
+async def write_behind_stats(write_behind: QuoteWriteBehind | None = Depends(get_write_behind)):
+    """Write-behind queue counters and backlog"""
+    if write_behind is None:
+        return {"enabled": False}
+    return {"enabled": True, **write_behind.snapshot()}
+
+
+@app.get("/admin/rating/cache")
+async def rating_cache_stats(premium_cache: TTLCache = Depends(get_premium_cache)):
+    """Premium cache hit/miss counters"""
+    return premium_cache.snapshot()
+
+
+@app.post("/admin/rating/cache/invalidate")
+async def invalidate_rating_cache(
+    agentCode: str | None = None,
+    rateCardCode: str | None = None,
+    categoryCode: str | None = None,
+    cache_invalidation: CacheInvalidation = Depends(get_cache_invalidation)
+):
+    """Drop cached premiums in every worker, optionally only those matching the given codes
+
+    Reports the entries dropped in the worker that answers, and whether the
+    other workers were sent the invalidation too.
+    """
+    codes = {"agent_code": agentCode, "rate_card_code": rateCardCode, "category_code": categoryCode}
+    match = {field: value for field, value in codes.items() if value is not None}
+    invalidated = await cache_invalidation.invalidate("premium", match=match)
+    return {"invalidated": invalidated, "scope": "all_workers" if cache_invalidation.broadcast else "this_worker"}
+
+
+@app.get("/admin/cache/invalidation")
+async def cache_invalidation_stats(cache_invalidation: CacheInvalidation = Depends(get_cache_invalidation)):
+    """Cross-worker cache invalidation counters and listener state"""
+    return cache_invalidation.snapshot()
+
+
+@app.get("/admin/rating/resilience")
+async def rating_resilience_stats(rating_transport: ResilientTransport = Depends(get_rating_transport)):
+    """Rating engine circuit breaker, retry budget and hedging state"""
+    return rating_transport.snapshot()
+
+
+@app.get("/admin/vehicles/cache")
+async def vehicle_cache_stats(vehicle_lookup: VehicleLookupService = Depends(get_vehicle_lookup)):
+    """Vehicle lookup cache counters"""
+    return vehicle_lookup.snapshot()
+
+
+@app.get("/admin/db/pool")
+async def db_pool_stats():
+    """Database connection pool usage"""
+    stats = {"primary": pool_stats(engine)}
+    if replica_engine is not engine:
+        stats["replica"] = pool_stats(replica_engine)
+    return stats
+
+
+@app.get("/admin/profiles")
+async def recent_profiles(limit: int = 20):
+    """The slowest recently profiled requests"""
+    if not PROFILING:
+        return {"enabled": False, "profiles": []}
+    return {"enabled": True, "profiles": slowest_profiles(PROFILING["profile_dir"], limit)}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Request, stage latency and connection pool metrics of this worker in the Prometheus text format"""
+    return PlainTextResponse(REGISTRY.expose(), media_type=METRICS_CONTENT_TYPE)
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
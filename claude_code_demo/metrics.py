@@ -0,0 +1,264 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy import event
+from starlette.routing import Match
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter per label set"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # A counter without labels is exposed as 0 before its first increment
+        self._values: dict[tuple, float] = {} if self.labelnames else {(): 0}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observations per label set"""
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: tuple = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: observations per bucket (the last one is +Inf), sum
+        self._values: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+        counts, total = self._values.get(key) or self._values.setdefault(
+            key, ([0] * (len(self.buckets) + 1), [0.0])
+        )
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Values read when the metrics are scraped, from a callback returning {label values: value}"""
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Iterable[str], collect: Callable[[], dict[tuple, float]]
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    """The metrics of one process, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.expose())
+            except Exception as e:
+                # A failing gauge callback must not hide the other metrics
+                lines.append(f"# {metric.name} unavailable: {_escape(str(e))}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "gap_http_requests_total", "HTTP requests by route and status", ["method", "route", "status"]
+))
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    "gap_http_request_duration_seconds", "HTTP request latency by route", ["method", "route"]
+))
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    "gap_stage_duration_seconds", "Latency of each stage of an endpoint", ["endpoint", "stage"]
+))
+RATING_ERRORS = REGISTRY.register(Counter(
+    "gap_rating_errors_total", "Failed rating engine calls by error type", ["error"]
+))
+RATING_RETRIES = REGISTRY.register(Counter(
+    "gap_rating_retries_total", "Rating engine calls sent again after a failed attempt"
+))
+RATING_HEDGES = REGISTRY.register(Counter(
+    "gap_rating_hedges_total", "Rating engine calls hedged with a second request"
+))
+DB_STATEMENTS = REGISTRY.register(Counter(
+    "gap_db_statements_total", "SQL statements sent by engine", ["engine"]
+))
+DB_TRANSACTIONS = REGISTRY.register(Counter(
+    "gap_db_transactions_total", "Database transactions ended by engine and outcome", ["engine", "outcome"]
+))
+
+
+@contextmanager
+def stage_timer(endpoint: str, stage: str):
+    """Record the time spent in the block as one stage of an endpoint"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint, stage=stage)
+
+
+def route_path(scope) -> Optional[str]:
+    """The path template of the route matching the request, like /items/{id}"""
+    app = scope.get("app")
+    for route in getattr(app, "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return None
+
+
+class MetricsMiddleware:
+    """Count requests and time them per route template
+
+    Requests that match no route share the "unmatched" label, so unknown paths
+    cannot grow the number of series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = route_path(scope) or "unmatched"
+            method = scope["method"]
+            REQUEST_LATENCY.observe(time.perf_counter() - started, method=method, route=route)
+            REQUESTS.inc(method=method, route=route, status=str(status))
+
+
+def register_pool_gauges(db_engines: dict, rating_transport_getter: Callable[[], Optional[object]]) -> None:
+    """Register gauges for the database pools and the rating engine requests and circuit
+
+    db_engines maps a name such as "primary" to an async engine, and
+    rating_transport_getter returns the ResilientTransport of the rating client.
+    """
+    def db_pool():
+        values = {}
+        for name, db_engine in db_engines.items():
+            pool = db_engine.pool
+            for state in ("size", "checkedin", "checkedout", "overflow"):
+                if hasattr(pool, state):
+                    values[(name, state)] = getattr(pool, state)()
+        return values
+
+    def rating_in_flight():
+        transport = rating_transport_getter()
+        return {(): transport.in_flight} if transport is not None else {}
+
+    REGISTRY.register(Gauge(
+        "gap_db_pool_connections", "Database pool connections by state", ["engine", "state"], db_pool
+    ))
+    def rating_circuit():
+        transport = rating_transport_getter()
+        if transport is None:
+            return {}
+        return {(state,): int(transport.breaker.state == state) for state in ("closed", "open", "half_open")}
+
+    REGISTRY.register(Gauge(
+        "gap_rating_requests_in_flight", "Rating engine requests sent and not answered yet", [], rating_in_flight
+    ))
+    REGISTRY.register(Gauge(
+        "gap_rating_circuit_state", "1 for the current state of the rating engine circuit", ["state"], rating_circuit
+    ))
+
+
+def register_db_counters(db_engines: dict) -> None:
+    """Count the statements and transactions of each engine
+
+    Each transaction also costs a BEGIN and a COMMIT or ROLLBACK round trip, so
+    the round trips to the database are the statements plus twice the transactions.
+    """
+    for name, db_engine in db_engines.items():
+        sync_engine = db_engine.sync_engine
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany, name=name):
+            DB_STATEMENTS.inc(engine=name)
+
+        def count_commit(conn, name=name):
+            DB_TRANSACTIONS.inc(engine=name, outcome="commit")
+
+        def count_rollback(conn, name=name):
+            DB_TRANSACTIONS.inc(engine=name, outcome="rollback")
+
+        event.listen(sync_engine, "before_cursor_execute", count_statement)
+        event.listen(sync_engine, "commit", count_commit)
+        event.listen(sync_engine, "rollback", count_rollback)
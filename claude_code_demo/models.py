@@ -1,6 +1,6 @@
 from datetime import date
 from enum import Enum
-from typing import List, Optional, Union
+from typing import List, Optional
 from pydantic import BaseModel, EmailStr
 
 
@@ -85,6 +85,37 @@ class GapQuoteResponseDTO(BaseModel):
     errors: List[ResponseError] = []
 
 
+class GapStoredQuoteResponse(GapQuoteResponse):
+    # Only returned when a stored quote is read back, the quote endpoints keep the specified shape
+    policyStatus: Optional[str] = None
+
+
+class GapStoredQuoteResponseDTO(BaseModel):
+    quoteResponse: Optional[GapStoredQuoteResponse] = None
+    errors: List[ResponseError] = []
+
+
+class GapQuoteOptionsRequestDTO(BaseModel):
+    regoOrVin: str
+    # Tiers to quote, all tiers when omitted
+    maxShortfalls: Optional[List[MaxShortfall]] = None
+
+
+class GapQuoteOptionsResponseDTO(BaseModel):
+    quoteResponses: List[GapQuoteResponse] = []
+    errors: List[ResponseError] = []
+
+
+class GapBulkQuoteRequestDTO(BaseModel):
+    quotes: List[GapQuoteRequestDTO]
+
+
+class GapBulkQuoteResponseDTO(BaseModel):
+    # One result per requested quote, in request order
+    results: List[GapQuoteResponseDTO] = []
+    errors: List[ResponseError] = []
+
+
 class ApplicantPostalAddress(BaseModel):
     addressLine1: str
     addressLine2: Optional[str] = None
@@ -0,0 +1,122 @@
+import re
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from .database import engine
+
+# Partitioned tables with their partition key, parent first. Children share the
+# quote's monthly bounds, so a month is created parent first and detached children first.
+PARTITIONED_TABLES = [
+    ("quotes", "created_at"),
+    ("vehicle_details", "quote_created_at"),
+    ("gap_premiums", "quote_created_at"),
+]
+
+# Detached partitions are moved here, out of the search path of the application
+ARCHIVE_SCHEMA = "quotes_archive"
+
+_PARTITION_NAME = re.compile(r"_y(\d{4})m(\d{2})$")
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_y{month.year}m{month.month:02d}"
+
+
+async def list_partitions(conn: AsyncConnection, table: str) -> list[tuple[str, date]]:
+    """Attached monthly partitions of a table, oldest first"""
+    result = await conn.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        JOIN pg_namespace ns ON ns.oid = parent.relnamespace
+        WHERE parent.relname = :table AND ns.nspname = current_schema()
+    """), {"table": table})
+    partitions = []
+    for name in result.scalars():
+        match = _PARTITION_NAME.search(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+async def create_partitions(
+    conn: AsyncConnection, months_ahead: int, today: Optional[date] = None, dry_run: bool = False
+) -> list[str]:
+    """Create any missing partition from the current month to months_ahead months ahead"""
+    first = month_start(today or datetime.utcnow().date())
+    existing = {name for table, _ in PARTITIONED_TABLES for name, _ in await list_partitions(conn, table)}
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(first, offset)
+        for table, _ in PARTITIONED_TABLES:
+            name = partition_name(table, month)
+            if name in existing:
+                continue
+            if not dry_run:
+                await conn.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                    f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+                ))
+            created.append(name)
+    return created
+
+
+async def archive_partitions(
+    conn: AsyncConnection, retention_months: int, drop: bool = False,
+    today: Optional[date] = None, dry_run: bool = False
+) -> list[str]:
+    """Detach the partitions of months older than retention_months
+
+    Detached tables are moved to the archive schema, or dropped when drop is set.
+    Requires an AUTOCOMMIT connection because partitions are detached concurrently.
+    """
+    cutoff = add_months(month_start(today or datetime.utcnow().date()), -retention_months)
+    archived = []
+    for _, month in await list_partitions(conn, "quotes"):
+        if month >= cutoff:
+            continue
+        for table, _ in reversed(PARTITIONED_TABLES):
+            name = partition_name(table, month)
+            archived.append(name)
+            if dry_run:
+                continue
+            await conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name} CONCURRENTLY"))
+            # A detached child keeps a copy of the foreign key to quotes, which
+            # would stop the quote partition from being detached next
+            foreign_keys = await conn.execute(text(
+                "SELECT conname FROM pg_constraint WHERE conrelid = CAST(:name AS regclass) AND contype = 'f'"
+            ), {"name": name})
+            for constraint in foreign_keys.scalars().all():
+                await conn.execute(text(f"ALTER TABLE {name} DROP CONSTRAINT {constraint}"))
+            if drop:
+                await conn.execute(text(f"DROP TABLE {name}"))
+            else:
+                await conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+    return archived
+
+
+async def maintain_partitions(
+    months_ahead: int, retention_months: int, drop: bool = False, dry_run: bool = False
+) -> tuple[list[str], list[str]]:
+    """Pre-create future partitions and archive expired ones, returning both lists of names"""
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        # Creating and detaching partitions briefly locks the parent table; fail
+        # rather than block quote traffic behind a long running transaction
+        await conn.execute(text("SET lock_timeout = '5s'"))
+        created = await create_partitions(conn, months_ahead, dry_run=dry_run)
+        archived = await archive_partitions(conn, retention_months, drop=drop, dry_run=dry_run)
+    return created, archived
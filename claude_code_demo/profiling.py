@@ -0,0 +1,201 @@
+import asyncio
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Optional
+
+import httpx
+from sqlalchemy import event
+
+from .config import env_float, env_int
+from .metrics import route_path
+
+PROFILE_HEADER = b"x-profile"
+
+# Profiles are named by time, so their names sort oldest first
+SUMMARY_SUFFIX = ".json"
+
+
+class _Trace:
+    """SQL and HTTP spans of a profiled request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def add(self, kind: str, description: str, started: float) -> None:
+        self.spans.append({
+            "kind": kind,
+            "description": description[:500],
+            "offset_ms": round((started - self.started) * 1000, 3),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+        })
+
+
+# Trace of the request being profiled; None when it is not profiled
+_trace: ContextVar[Optional[_Trace]] = ContextVar("profile_trace", default=None)
+
+
+def instrument_engine(db_engine) -> None:
+    """Record the statements of profiled requests as SQL spans"""
+    sync_engine = db_engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _trace.get() is not None:
+            context._profile_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        trace = _trace.get()
+        started = getattr(context, "_profile_started", None)
+        if trace is not None and started is not None:
+            trace.add("sql", statement, started)
+
+
+def instrument_http_client(client: httpx.AsyncClient) -> None:
+    """Record the calls made by profiled requests as HTTP spans, until the response headers arrive"""
+    async def on_request(request: httpx.Request):
+        if _trace.get() is not None:
+            request.extensions["profile_started"] = time.perf_counter()
+
+    async def on_response(response: httpx.Response):
+        trace = _trace.get()
+        started = response.request.extensions.get("profile_started")
+        if trace is not None and started is not None:
+            trace.add("http", f"{response.request.method} {response.request.url} {response.status_code}", started)
+
+    client.event_hooks["request"].append(on_request)
+    client.event_hooks["response"].append(on_response)
+
+
+class ProfilingMiddleware:
+    """Profile sampled requests, or those sending the profiling token, to profile_dir
+
+    A profiled request runs under cProfile and records the wall time of its SQL
+    statements and rating engine calls, which cProfile does not attribute while
+    the handler awaits them. Each profile is written as a pstats file (open it with
+    ``python -m pstats`` or snakeviz) with a JSON summary next to it. cProfile sees
+    the whole event loop, so only one request is profiled at a time and work of
+    concurrent requests can appear in it. Only the newest max_files profiles are kept.
+    """
+
+    def __init__(
+        self, app, profile_dir: str, sample_rate: float = 0.0, token: Optional[str] = None, max_files: int = 200
+    ):
+        self.app = app
+        self.profile_dir = profile_dir
+        self.sample_rate = sample_rate
+        self.token = token.encode() if token else None
+        self.max_files = max_files
+        self._active = False
+        os.makedirs(profile_dir, exist_ok=True)
+
+    def _should_profile(self, scope) -> bool:
+        if self.token is not None:
+            requested = dict(scope["headers"]).get(PROFILE_HEADER)
+            if requested is not None and hmac.compare_digest(requested, self.token):
+                return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._active or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self._active = True
+        trace = _Trace()
+        token = _trace.set(trace)
+        profiler = cProfile.Profile()
+        cpu_started = time.process_time()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            profiler.disable()
+            duration_ms = (time.perf_counter() - trace.started) * 1000
+            cpu_ms = (time.process_time() - cpu_started) * 1000
+            _trace.reset(token)
+            self._active = False
+            summary = {
+                "created_at": datetime.utcnow().isoformat(),
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": route_path(scope),
+                "status": status,
+                "duration_ms": round(duration_ms, 3),
+                "cpu_ms": round(cpu_ms, 3),
+                "spans": trace.spans,
+            }
+            await asyncio.to_thread(self._write, profiler, summary)
+
+    def _write(self, profiler: cProfile.Profile, summary: dict) -> None:
+        name = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{summary['method']}-{summary['duration_ms']:.0f}ms"
+        profiler.dump_stats(os.path.join(self.profile_dir, f"{name}.prof"))
+
+        stats_text = io.StringIO()
+        pstats.Stats(profiler, stream=stats_text).sort_stats("cumulative").print_stats(30)
+        summary = {**summary, "name": name, "top_functions": stats_text.getvalue()}
+        with open(os.path.join(self.profile_dir, name + SUMMARY_SUFFIX), "w") as f:
+            json.dump(summary, f, indent=2)
+
+        names = sorted(entry[:-len(SUMMARY_SUFFIX)] for entry in os.listdir(self.profile_dir)
+                       if entry.endswith(SUMMARY_SUFFIX))
+        for evicted in names[:max(len(names) - self.max_files, 0)]:
+            for suffix in (".prof", SUMMARY_SUFFIX):
+                try:
+                    os.remove(os.path.join(self.profile_dir, evicted + suffix))
+                except FileNotFoundError:
+                    pass
+
+
+def slowest_profiles(profile_dir: str, limit: int = 20) -> list[dict]:
+    """Summaries of the slowest profiles kept in profile_dir, slowest first"""
+    profiles = []
+    if os.path.isdir(profile_dir):
+        for entry in os.listdir(profile_dir):
+            if not entry.endswith(SUMMARY_SUFFIX):
+                continue
+            try:
+                with open(os.path.join(profile_dir, entry)) as f:
+                    summary = json.load(f)
+            except (OSError, ValueError):
+                # Deleted or still being written by another worker
+                continue
+            profiles.append({key: value for key, value in summary.items() if key not in ("spans", "top_functions")})
+    return sorted(profiles, key=lambda profile: profile["duration_ms"], reverse=True)[:limit]
+
+
+def profiling_options() -> Optional[dict]:
+    """ProfilingMiddleware keyword arguments, or None when profiling is disabled
+
+      PROFILE_SAMPLE_RATE         fraction of requests profiled (default 0)
+      PROFILE_TOKEN               requests sending this value in X-Profile are profiled (default unset)
+      PROFILE_DIR                 directory for the profiles (default profiles)
+      PROFILE_MAX_FILES           profiles kept, oldest are deleted (default 200)
+    """
+    sample_rate = env_float("PROFILE_SAMPLE_RATE", 0.0)
+    token = os.getenv("PROFILE_TOKEN") or None
+    if sample_rate <= 0 and token is None:
+        return None
+    return {
+        "profile_dir": os.getenv("PROFILE_DIR", "profiles"),
+        "sample_rate": sample_rate,
+        "token": token,
+        "max_files": env_int("PROFILE_MAX_FILES", 200),
+    }
@@ -0,0 +1,204 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from enum import Enum
+from typing import Optional
+
+from sqlalchemy import Integer, any_, bindparam, delete, select, text
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from .database import Quote, VehicleDetail, GapPremium, PolicyStatus, engine
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SUFFIX = ".jsonl.gz"
+PENDING_SUFFIX = ".pending"
+
+
+@dataclass
+class PurgeResult:
+    quotes: int = 0
+    rows: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Cannot archive value of type {type(value).__name__}")
+
+
+def _row(row, exclude=()) -> dict:
+    return {key: value for key, value in row._mapping.items() if key not in exclude}
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    """Write a file so it is either complete or absent after a crash"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _write_pending_archive(archive_dir: str, quotes: list[dict]) -> str:
+    lines = "".join(json.dumps(quote, default=_json_default, separators=(",", ":")) + "\n" for quote in quotes)
+    name = f"quotes-{quotes[0]['id']:012d}-{quotes[-1]['id']:012d}{ARCHIVE_SUFFIX}"
+    path = os.path.join(archive_dir, name + PENDING_SUFFIX)
+    _write_atomic(path, gzip.compress(lines.encode(), compresslevel=6))
+    return path
+
+
+def _archived_ids(path: str) -> list[int]:
+    with gzip.open(path, "rt") as f:
+        return [json.loads(line)["id"] for line in f]
+
+
+async def recover_pending_archives(conn, archive_dir: str) -> None:
+    """Finish or discard the archive files of batches interrupted around their commit
+
+    A pending file whose quotes are gone was committed and is kept; one whose
+    quotes still exist was rolled back, and those quotes are archived again.
+    """
+    for name in sorted(os.listdir(archive_dir)):
+        if not name.endswith(PENDING_SUFFIX):
+            continue
+        path = os.path.join(archive_dir, name)
+        ids = await asyncio.to_thread(_archived_ids, path)
+        remaining = (await conn.execute(
+            select(Quote.id).where(Quote.id == any_(bindparam("ids", ids, type_=ARRAY(Integer)))).limit(1)
+        )).first()
+        await conn.rollback()
+        if remaining is None:
+            os.replace(path, path[:-len(PENDING_SUFFIX)])
+            logger.warning("Recovered committed archive %s", name[:-len(PENDING_SUFFIX)])
+        else:
+            os.remove(path)
+            logger.warning("Discarded archive of rolled back batch %s", name)
+
+
+async def _purge_batch(conn, after_id: int, batch_size: int, archive_dir: str, today: date) -> tuple[int, int, int]:
+    """Archive and delete one batch in its own transaction, returning (last id, quotes, rows)"""
+    # Expiry is 30 days after creation; the created_at bound lets Postgres skip
+    # the recent partitions and stays a superset whatever the server timezone
+    created_before = datetime.combine(today, datetime.min.time()) - timedelta(days=29)
+    async with conn.begin():
+        # Rows locked by a bind in progress are skipped, and the batch fails rather
+        # than queue behind a table lock
+        await conn.execute(text("SET LOCAL lock_timeout = '2s'"))
+        batch = (await conn.execute(
+            select(Quote.id, Quote.created_at)
+            .where(
+                Quote.policy_status == PolicyStatus.CREATED,
+                Quote.quote_expiry_date < today,
+                Quote.created_at < created_before,
+                Quote.id > after_id,
+            )
+            .order_by(Quote.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )).all()
+        if not batch:
+            return after_id, 0, 0
+
+        # One array parameter keeps the statements identical between batches, so
+        # asyncpg reuses their prepared plans
+        params = {
+            "ids": [row.id for row in batch],
+            "oldest": min(row.created_at for row in batch),
+            "newest": max(row.created_at for row in batch),
+        }
+        ids = bindparam("ids", type_=ARRAY(Integer))
+        children = {}
+        for model in (VehicleDetail, GapPremium):
+            deleted = await conn.execute(
+                delete(model)
+                .where(
+                    model.quote_id == any_(ids),
+                    model.quote_created_at.between(bindparam("oldest"), bindparam("newest")),
+                )
+                .returning(*model.__table__.columns),
+                params
+            )
+            children[model] = {row.quote_id: _row(row, exclude=("quote_id", "quote_created_at")) for row in deleted}
+        quote_rows = (await conn.execute(
+            delete(Quote)
+            .where(Quote.id == any_(ids), Quote.created_at.between(bindparam("oldest"), bindparam("newest")))
+            .returning(*Quote.__table__.columns),
+            params
+        )).all()
+        quote_rows.sort(key=lambda row: row.id)
+
+        archived = [
+            {
+                **_row(row),
+                "vehicle_details": children[VehicleDetail].get(row.id),
+                "gap_premium": children[GapPremium].get(row.id),
+            }
+            for row in quote_rows
+        ]
+        # The archive is durable before the deletes commit and only loses its
+        # pending suffix afterwards, see recover_pending_archives
+        pending_path = await asyncio.to_thread(_write_pending_archive, archive_dir, archived)
+    os.replace(pending_path, pending_path[:-len(PENDING_SUFFIX)])
+    rows = len(quote_rows) + sum(len(rows) for rows in children.values())
+    return quote_rows[-1].id, len(quote_rows), rows
+
+
+async def purge_expired_quotes(
+    archive_dir: str,
+    batch_size: int = 1000,
+    max_rows_per_second: float = 0,
+    max_batches: Optional[int] = None,
+    today: Optional[date] = None,
+) -> PurgeResult:
+    """Move expired, unconverted quotes with their vehicle details and premiums to the archive
+
+    Quotes are processed in id order, batch_size at a time, each batch archived to
+    a gzip JSON lines file and deleted in a short transaction. Archived quotes are
+    gone from the database, so an interrupted run is resumed by running it again.
+    max_rows_per_second throttles the deletes (0 is unlimited).
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    today = today or datetime.utcnow().date()
+    last_id = 0
+    result = PurgeResult()
+    started = time.monotonic()
+
+    async with engine.connect() as conn:
+        await recover_pending_archives(conn, archive_dir)
+        while max_batches is None or result.batches < max_batches:
+            batch_started = time.monotonic()
+            last_id, quotes, rows = await _purge_batch(conn, last_id, batch_size, archive_dir, today)
+            if not quotes:
+                break
+            result.quotes += quotes
+            result.rows += rows
+            result.batches += 1
+            result.seconds = time.monotonic() - started
+            logger.info("Archived %d quotes (%d rows) up to id %d, %.0f rows/sec",
+                        quotes, rows, last_id, result.rows_per_second)
+
+            if max_rows_per_second:
+                remaining = rows / max_rows_per_second - (time.monotonic() - batch_started)
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
+
+    result.seconds = time.monotonic() - started
+    return result
@@ -0,0 +1,72 @@
+import asyncio
+import os
+from collections import deque
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import env_int
+from .database import quote_ref_seq
+
+
+def luhn_check_digit(number: str) -> str:
+    """Luhn check digit for a string of digits"""
+    total = 0
+    for position, digit in enumerate(reversed(number)):
+        value = int(digit)
+        if position % 2 == 0:
+            value *= 2
+            if value > 9:
+                value -= 9
+        total += value
+    return str((10 - total % 10) % 10)
+
+
+class SequenceQuoteRefGenerator:
+    """Quote references drawn from the quote_ref_seq database sequence
+
+    Sequence values are fetched in blocks with one round trip and handed out from
+    memory, so every worker gets distinct values without retries and new references
+    keep increasing. A reference is the sequence value followed by a Luhn check
+    digit, nine digits long, which never collides with the 8 digit legacy ones.
+    """
+
+    def __init__(self, block_size: int = 100):
+        self.block_size = block_size
+        self._values: deque[int] = deque()
+        self._lock = asyncio.Lock()
+
+    async def next_refs(self, db: AsyncSession, count: int) -> list[str]:
+        async with self._lock:
+            if len(self._values) < count:
+                needed = max(self.block_size, count - len(self._values))
+                result = await db.execute(
+                    select(quote_ref_seq.next_value()).select_from(func.generate_series(1, needed))
+                )
+                self._values.extend(result.scalars().all())
+            values = [self._values.popleft() for _ in range(count)]
+        return [f"{value}{luhn_check_digit(str(value))}" for value in values]
+
+    async def next_ref(self, db: AsyncSession) -> str:
+        return (await self.next_refs(db, 1))[0]
+
+
+def create_quote_ref_generator() -> SequenceQuoteRefGenerator:
+    """Create the quote reference generator
+
+      QUOTE_REF_BLOCK_SIZE        sequence values fetched per round trip (default 100)
+
+    The legacy random generator ("QUOTE_REF_GENERATOR=random") is refused: the
+    quote_ref index of the partitioned quotes table is unique on (quote_ref,
+    created_at), so the database does not reject a duplicate reference, and the
+    bind of a duplicated reference fails with ER999 as its lookup finds two rows.
+    """
+    kind = os.getenv("QUOTE_REF_GENERATOR", "sequence")
+    if kind == "random":
+        raise ValueError(
+            "QUOTE_REF_GENERATOR=random is no longer supported: the database does not enforce "
+            "unique quote references, so random references can be stored twice"
+        )
+    if kind != "sequence":
+        raise ValueError(f"Unknown QUOTE_REF_GENERATOR: {kind}")
+    return SequenceQuoteRefGenerator(block_size=env_int("QUOTE_REF_BLOCK_SIZE", 100))
@@ -0,0 +1,135 @@
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Hashable, NamedTuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from .cache import TTLCache
+from .config import env_float, env_int
+from .database import GapPremium as DBGapPremium, PolicyStatus, Quote, VehicleDetail, async_session
+from .models import GapPremium, GapStoredQuoteResponse, VehicleDetails
+
+
+class QuoteNotFound(Exception):
+    """No quote in its validity window has the reference"""
+
+
+class QuoteCache(TTLCache):
+    """TTLCache of quotes that remembers the references it dropped at bind
+
+    A discarded reference is kept for tombstone_seconds, so a read from a replica
+    that has not replayed the bind yet can be recognised and done again on the
+    primary (see load_current_quote) instead of caching the CREATED row.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, tombstone_seconds: float):
+        super().__init__(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.tombstone_seconds = tombstone_seconds
+        self._discarded: "OrderedDict[Hashable, float]" = OrderedDict()
+
+    def discard(self, key: Hashable) -> bool:
+        now = time.monotonic()
+        self._discarded[key] = now
+        self._discarded.move_to_end(key)
+        while next(iter(self._discarded.values())) < now - self.tombstone_seconds:
+            self._discarded.popitem(last=False)
+        return super().discard(key)
+
+    def recently_discarded(self, key: Hashable) -> bool:
+        """Whether key was discarded within tombstone_seconds"""
+        discarded_at = self._discarded.get(key)
+        return discarded_at is not None and time.monotonic() - discarded_at <= self.tombstone_seconds
+
+    def snapshot(self) -> dict:
+        return {**super().snapshot(), "tombstones": len(self._discarded), "tombstone_seconds": self.tombstone_seconds}
+
+
+class StoredQuote(NamedTuple):
+    agent_code: str
+    response: GapStoredQuoteResponse
+
+
+def quote_response(quote: Quote) -> GapStoredQuoteResponse:
+    """Rebuild the quote response from a quote row and its loaded children"""
+    vehicle = quote.vehicle_details
+    premium = quote.gap_premium
+    return GapStoredQuoteResponse(
+        quoteRef=quote.quote_ref,
+        quoteExpiryDate=quote.quote_expiry_date.isoformat() if quote.quote_expiry_date else None,
+        gstRate=quote.gst_rate,
+        vehicleDetails=VehicleDetails(
+            registration=vehicle.registration,
+            vin=vehicle.vin,
+            make=vehicle.make,
+            model=vehicle.model,
+            year=vehicle.year,
+            ccRating=vehicle.cc_rating,
+            fuelType=vehicle.fuel_type,
+            odometerReading=vehicle.odometer_reading,
+            bodyColour=vehicle.body_colour,
+            bodyStyle=vehicle.body_style
+        ),
+        gapPremium=GapPremium(
+            wholesaleAmount=premium.wholesale_amount,
+            retailAmount=premium.retail_amount
+        ) if premium is not None else None,
+        policyStatus=quote.policy_status.value if quote.policy_status is not None else None
+    )
+
+
+async def load_quote(db: AsyncSession, quote_ref: str, created_after: datetime) -> StoredQuote:
+    """Load a quote created after created_after with its vehicle and premium, raising QuoteNotFound
+
+    The children are joined into the same SELECT, so the quote is read in one
+    round trip. Every table is bounded by the creation time so Postgres only
+    scans the monthly partitions inside the window.
+    """
+    result = await db.execute(
+        select(Quote)
+        .options(
+            joinedload(Quote.vehicle_details.and_(VehicleDetail.quote_created_at >= created_after)),
+            joinedload(Quote.gap_premium.and_(DBGapPremium.quote_created_at >= created_after))
+        )
+        .where(Quote.quote_ref == quote_ref, Quote.created_at >= created_after)
+    )
+    quote = result.unique().scalar_one_or_none()
+    if quote is None or quote.vehicle_details is None:
+        raise QuoteNotFound(quote_ref)
+    return StoredQuote(quote.agent_code, quote_response(quote))
+
+
+async def load_current_quote(
+    db: AsyncSession, quote_ref: str, created_after: datetime, quote_cache: QuoteCache
+) -> StoredQuote:
+    """load_quote, read again from the primary when db shows a quote bound in this worker as CREATED
+
+    db may be a lagging replica; the primary read keeps the old status out of the cache.
+    """
+    stored = await load_quote(db, quote_ref, created_after)
+    if stored.response.policyStatus == PolicyStatus.CREATED.value and quote_cache.recently_discarded(quote_ref):
+        async with async_session() as primary:
+            stored = await load_quote(primary, quote_ref, created_after)
+    return stored
+
+
+def create_quote_cache() -> QuoteCache:
+    """Create the read-through cache of quotes by reference
+
+    Binding a quote drops it from the cache of every worker through
+    CacheInvalidation once the bind commits, and leaves a tombstone so a
+    lagging replica cannot cache it again as CREATED.
+
+    Configured from the environment:
+      QUOTE_CACHE_MAX_ENTRIES         quotes kept in memory per worker (default 10000, 0 disables)
+      QUOTE_CACHE_TTL_SECONDS         seconds a quote is served from memory (default 30)
+      QUOTE_CACHE_TOMBSTONE_SECONDS   seconds a bound quote read as CREATED is read again from
+                                      the primary, longer than the replica lag (default 300)
+    """
+    return QuoteCache(
+        max_entries=env_int("QUOTE_CACHE_MAX_ENTRIES", 10000),
+        ttl_seconds=env_float("QUOTE_CACHE_TTL_SECONDS", 30.0),
+        tombstone_seconds=env_float("QUOTE_CACHE_TOMBSTONE_SECONDS", 300.0),
+    )
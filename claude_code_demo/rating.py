@@ -0,0 +1,192 @@
+import importlib.util
+import logging
+import os
+from typing import NamedTuple, Optional
+
+import httpx
+
+from .cache import TTLCache
+from .config import env_bool, env_float, env_int
+from .models import GapPremium, MaxShortfall
+from .resilience import CircuitBreaker, ResilientTransport, RetryBudget
+
+logger = logging.getLogger(__name__)
+
+# Rating engine cover code for each GAP shortfall tier
+SHORTFALL_TO_COVER_CODE = {
+    MaxShortfall.GAP_5000: "GAP5000",
+    MaxShortfall.GAP_10000: "GAP10000",
+    MaxShortfall.GAP_15000: "GAP15000",
+    MaxShortfall.GAP_20000: "GAP20000",
+    MaxShortfall.GAP_30000: "GAP30000",
+    MaxShortfall.GAP_40000: "GAP40000"
+}
+
+
+class PremiumKey(NamedTuple):
+    agent_code: str
+    rate_card_code: str
+    category_code: str
+    loading_code: Optional[str] = None
+
+
+def create_rating_transport() -> ResilientTransport:
+    """Create the pooled transport with retries, hedging and the circuit breaker for the rating engine
+
+    Configured from the environment:
+      RATING_POOL_MAX_CONNECTIONS     total connections in the pool (default 100)
+      RATING_POOL_MAX_KEEPALIVE       idle keep-alive connections kept open (default 20)
+      RATING_KEEPALIVE_EXPIRY         seconds an idle connection is kept (default 30)
+      RATING_HTTP2                    negotiate HTTP/2 when the h2 package is installed (default false)
+      RATING_BREAKER_FAILURES         consecutive failures that open the circuit (default 5, 0 never opens)
+      RATING_BREAKER_RESET_SECONDS    seconds the open circuit fails fast before a trial call (default 30)
+      RATING_RETRY_MAX_ATTEMPTS       attempts per call, including the first (default 2)
+      RATING_RETRY_BACKOFF_SECONDS    backoff before the first retry, doubled after each (default 0.05)
+      RATING_RETRY_BUDGET_RATIO       retries and hedges allowed per call over 10 seconds (default 0.2)
+      RATING_RETRY_BUDGET_MIN_PER_SECOND  retries always allowed per second (default 1)
+      RATING_HEDGE_PERCENTILE         latency percentile after which a call is hedged (default unset, off)
+      RATING_HEDGE_MIN_SECONDS        shortest wait before hedging (default 0.05)
+    """
+    limits = httpx.Limits(
+        max_connections=env_int("RATING_POOL_MAX_CONNECTIONS", 100),
+        max_keepalive_connections=env_int("RATING_POOL_MAX_KEEPALIVE", 20),
+        keepalive_expiry=env_float("RATING_KEEPALIVE_EXPIRY", 30.0),
+    )
+
+    http2 = env_bool("RATING_HTTP2", False)
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning("RATING_HTTP2 is enabled but the 'h2' package is not installed, falling back to HTTP/1.1")
+        http2 = False
+
+    return ResilientTransport(
+        httpx.AsyncHTTPTransport(limits=limits, http2=http2),
+        breaker=CircuitBreaker(
+            failure_threshold=env_int("RATING_BREAKER_FAILURES", 5),
+            reset_seconds=env_float("RATING_BREAKER_RESET_SECONDS", 30.0),
+        ),
+        budget=RetryBudget(
+            ratio=env_float("RATING_RETRY_BUDGET_RATIO", 0.2),
+            min_per_second=env_float("RATING_RETRY_BUDGET_MIN_PER_SECOND", 1.0),
+        ),
+        max_attempts=env_int("RATING_RETRY_MAX_ATTEMPTS", 2),
+        backoff_seconds=env_float("RATING_RETRY_BACKOFF_SECONDS", 0.05),
+        hedge_percentile=env_float("RATING_HEDGE_PERCENTILE", 0.0) or None,
+        hedge_min_seconds=env_float("RATING_HEDGE_MIN_SECONDS", 0.05),
+    )
+
+
+def create_rating_client(transport: Optional[ResilientTransport] = None) -> httpx.AsyncClient:
+    """Create the shared HTTP client used to call the rating engine
+
+    The transport comes from create_rating_transport when not given. Configured
+    from the environment:
+      RATING_API_URL                  base URL of the rating engine
+      RATING_CONNECT_TIMEOUT          connect timeout in seconds (default 2)
+      RATING_READ_TIMEOUT             read timeout in seconds (default 5)
+      RATING_WRITE_TIMEOUT            write timeout in seconds (default 5)
+      RATING_POOL_TIMEOUT             seconds to wait for a free pooled connection (default 1)
+    """
+    timeout = httpx.Timeout(
+        connect=env_float("RATING_CONNECT_TIMEOUT", 2.0),
+        read=env_float("RATING_READ_TIMEOUT", 5.0),
+        write=env_float("RATING_WRITE_TIMEOUT", 5.0),
+        pool=env_float("RATING_POOL_TIMEOUT", 1.0),
+    )
+    return httpx.AsyncClient(
+        base_url=os.getenv("RATING_API_URL", "http://localhost:8088"),
+        timeout=timeout,
+        transport=transport or create_rating_transport(),
+    )
+
+
+def create_premium_cache() -> TTLCache:
+    """Create the cache of rating engine category premiums
+
+    Configured from the environment:
+      RATING_CACHE_MAX_ENTRIES        premium sets kept in memory (default 1024, 0 disables)
+      RATING_CACHE_TTL_SECONDS        seconds a premium set is served as fresh (default 300)
+      RATING_CACHE_STALE_SECONDS      extra seconds a stale set is served while it is
+                                      refreshed in the background (default 60)
+      RATING_CACHE_STALE_IF_ERROR_SECONDS  extra seconds the last known good set is served
+                                      when the rating engine fails (default 0, off)
+    """
+    return TTLCache(
+        max_entries=env_int("RATING_CACHE_MAX_ENTRIES", 1024),
+        ttl_seconds=env_float("RATING_CACHE_TTL_SECONDS", 300.0),
+        stale_seconds=env_float("RATING_CACHE_STALE_SECONDS", 60.0),
+        stale_if_error_seconds=env_float("RATING_CACHE_STALE_IF_ERROR_SECONDS", 0.0),
+    )
+
+
+async def fetch_category_premiums(client: httpx.AsyncClient, key: PremiumKey) -> dict:
+    """Fetch the CategoryPremiumsDto for an agent rate card category"""
+    params = {
+        "agentCode": key.agent_code,
+        "rateCardCode": key.rate_card_code,
+        "categoryCode": key.category_code
+    }
+    if key.loading_code:
+        params["loadingCode"] = key.loading_code
+
+    response = await client.get("/rating/agent/category/premium", params=params)
+    response.raise_for_status()
+    return response.json()
+
+
+class PremiumTable:
+    """A CategoryPremiumsDto parsed once into premiums indexed by shortfall tier
+
+    Covers are matched case-insensitively on their code and the first excess and
+    premium row of each cover is used. Tiers whose cover is missing or malformed
+    keep the error message so the lookup fails the same way on every request.
+    """
+
+    __slots__ = ("gst", "_tiers")
+
+    def __init__(self, gst: Optional[float], tiers: dict[str, GapPremium | str]):
+        self.gst = gst
+        self._tiers = tiers
+
+    @classmethod
+    def from_response(cls, data: dict) -> "PremiumTable":
+        covers = {}
+        for cover in data.get("covers") or []:
+            covers.setdefault(cover.get("code", "").lower(), cover)
+
+        tiers: dict[str, GapPremium | str] = {}
+        for max_shortfall, cover_code in SHORTFALL_TO_COVER_CODE.items():
+            if not covers:
+                tiers[max_shortfall.value] = "No covers found in rating API response"
+            elif cover_code.lower() not in covers:
+                tiers[max_shortfall.value] = f"Cover with code '{cover_code}' not found in rating API response"
+            else:
+                tiers[max_shortfall.value] = cls._cover_premium(covers[cover_code.lower()], cover_code)
+        return cls(gst=data.get("gst"), tiers=tiers)
+
+    @staticmethod
+    def _cover_premium(cover: dict, cover_code: str) -> GapPremium | str:
+        excesses = cover.get("rateCardExcess")
+        if not excesses or not excesses[0].get("premium"):
+            return f"Invalid premium structure for cover '{cover_code}'"
+
+        premium_data = excesses[0]["premium"][0]
+        retail_premium = premium_data.get("agentRetailPremiumEx")
+        wholesale_premium = premium_data.get("agentWholesalePremiumEx")
+        if retail_premium is None or wholesale_premium is None:
+            return "Premium data not found in rating API response"
+
+        return GapPremium(wholesaleAmount=wholesale_premium, retailAmount=retail_premium)
+
+    def premium_for(self, max_shortfall: str) -> GapPremium:
+        """Return the premium for one shortfall tier, raising ValueError when unavailable"""
+        premium = self._tiers.get(max_shortfall)
+        if premium is None:
+            raise ValueError(f"Unknown shortfall amount: {max_shortfall}")
+        if isinstance(premium, str):
+            raise ValueError(premium)
+        return premium
+
+
+async def load_premium_table(client: httpx.AsyncClient, key: PremiumKey) -> PremiumTable:
+    """Fetch and index the category premiums for an agent rate card category"""
+    return PremiumTable.from_response(await fetch_category_premiums(client, key))
@@ -0,0 +1,280 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Optional
+
+import httpx
+
+from .metrics import RATING_HEDGES, RATING_RETRIES
+
+# Retried and hedged, as sending them twice has no side effects
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+
+def _is_failure(response: httpx.Response) -> bool:
+    """A response worth retrying, and counted against the circuit"""
+    return response.status_code >= 500 or response.status_code == 429
+
+
+class CircuitOpenError(httpx.TransportError):
+    """The circuit is open, so the call was rejected without being sent"""
+
+
+class CircuitBreaker:
+    """Fail fast after failure_threshold consecutive failures
+
+    The open circuit rejects calls for reset_seconds, then lets one trial call
+    through (half open), which closes the circuit when it succeeds and opens it
+    again when it fails. A failure_threshold of 0 never opens the circuit.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._trial_started: Optional[float] = None
+
+    def allow(self) -> bool:
+        """Return whether a call may be sent now, counting it as the trial call when half open"""
+        now = time.monotonic()
+        if self.state == self.OPEN and now - self._opened_at >= self.reset_seconds:
+            self.state = self.HALF_OPEN
+            self._trial_started = None
+        if self.state == self.CLOSED:
+            return True
+        # A trial that never reported back, such as a cancelled one, is replaced
+        if self.state == self.HALF_OPEN and (
+            self._trial_started is None or now - self._trial_started >= self.reset_seconds
+        ):
+            self._trial_started = now
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.state = self.CLOSED
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failure_threshold <= 0:
+            return
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            self.state = self.OPEN
+            self.opened += 1
+            self._opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "failure_threshold": self.failure_threshold,
+            "reset_seconds": self.reset_seconds,
+        }
+
+
+class RetryBudget:
+    """Allow retries up to ratio of the requests of the last window_seconds, plus min_per_second
+
+    When every call fails, retries stop at the budget instead of multiplying the
+    load on a rating engine that is already struggling.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, window_seconds: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window_seconds = window_seconds
+        self.exhausted = 0
+        self._requests: deque[float] = deque()
+        self._retries: deque[float] = deque()
+
+    def record_request(self) -> None:
+        self._requests.append(time.monotonic())
+
+    def try_spend(self) -> bool:
+        """Take one retry from the budget, returning False when it is spent"""
+        now = time.monotonic()
+        for times in (self._requests, self._retries):
+            while times and now - times[0] > self.window_seconds:
+                times.popleft()
+        allowed = self.min_per_second * self.window_seconds + self.ratio * len(self._requests)
+        if len(self._retries) + 1 > allowed:
+            self.exhausted += 1
+            return False
+        self._retries.append(now)
+        return True
+
+    def snapshot(self) -> dict:
+        return {
+            "requests_in_window": len(self._requests),
+            "retries_in_window": len(self._retries),
+            "exhausted": self.exhausted,
+            "ratio": self.ratio,
+            "min_per_second": self.min_per_second,
+            "window_seconds": self.window_seconds,
+        }
+
+
+class LatencyTracker:
+    """Latencies of the most recent successful calls"""
+
+    def __init__(self, samples: int = 1000, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._latencies: deque[float] = deque(maxlen=samples)
+
+    def observe(self, seconds: float) -> None:
+        self._latencies.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """The pct percentile in seconds, or None until min_samples calls have been seen"""
+        if len(self._latencies) < self.min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(int(len(latencies) * pct / 100), len(latencies) - 1)]
+
+
+class ResilientTransport(httpx.AsyncBaseTransport):
+    """Transport adding a circuit breaker, budgeted retries and hedging to another transport
+
+    Idempotent requests that fail with a transport error, a 5xx or a 429 are
+    sent again up to max_attempts times, after an exponential backoff with full
+    jitter, while the retry budget allows. With hedge_percentile set, a request
+    still unanswered after that percentile of recent latencies (and at least
+    hedge_min_seconds) is sent a second time and the first good response wins;
+    hedges are paid from the retry budget too. Every attempt reports to the
+    circuit breaker, and calls made while it is open raise CircuitOpenError.
+    """
+
+    def __init__(
+        self,
+        inner: httpx.AsyncBaseTransport,
+        breaker: CircuitBreaker,
+        budget: RetryBudget,
+        max_attempts: int = 2,
+        backoff_seconds: float = 0.05,
+        backoff_max_seconds: float = 1.0,
+        hedge_percentile: Optional[float] = None,
+        hedge_min_seconds: float = 0.0,
+    ):
+        self.inner = inner
+        self.breaker = breaker
+        self.budget = budget
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_seconds = hedge_min_seconds
+        self.latency = LatencyTracker()
+        # Attempts sent to the inner transport and not answered yet
+        self.in_flight = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method not in IDEMPOTENT_METHODS:
+            self._check_circuit(request)
+            return await self._send(request)
+
+        self.budget.record_request()
+        attempt = 1
+        while True:
+            self._check_circuit(request)
+            error = None
+            try:
+                response = await self._send_hedged(request)
+            except httpx.TransportError as e:
+                response, error = None, e
+            if response is not None and not _is_failure(response):
+                return response
+            if attempt >= self.max_attempts or not self.budget.try_spend():
+                if error is not None:
+                    raise error
+                return response
+            if response is not None:
+                await response.aclose()
+            RATING_RETRIES.inc()
+            await asyncio.sleep(random.uniform(0, min(self.backoff_max_seconds, self.backoff_seconds * 2 ** (attempt - 1))))
+            attempt += 1
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging a request, or None when it is not hedged"""
+        if not self.hedge_percentile:
+            return None
+        delay = self.latency.percentile(self.hedge_percentile)
+        return max(delay, self.hedge_min_seconds) if delay is not None else None
+
+    def snapshot(self) -> dict:
+        return {
+            "circuit": self.breaker.snapshot(),
+            "retry_budget": self.budget.snapshot(),
+            "max_attempts": self.max_attempts,
+            "hedge_percentile": self.hedge_percentile,
+            "hedge_delay_seconds": self.hedge_delay(),
+            "in_flight": self.in_flight,
+        }
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+    def _check_circuit(self, request: httpx.Request) -> None:
+        if not self.breaker.allow():
+            raise CircuitOpenError("Rating engine circuit is open", request=request)
+
+    async def _send(self, request: httpx.Request) -> httpx.Response:
+        """Send once, reporting the outcome to the circuit breaker"""
+        started = time.perf_counter()
+        self.in_flight += 1
+        try:
+            response = await self.inner.handle_async_request(request)
+        except httpx.TransportError:
+            self.breaker.record_failure()
+            raise
+        finally:
+            self.in_flight -= 1
+        if _is_failure(response):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+            self.latency.observe(time.perf_counter() - started)
+        return response
+
+    async def _send_hedged(self, request: httpx.Request) -> httpx.Response:
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._send(request)
+
+        tasks = {asyncio.ensure_future(self._send(request))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self.breaker.allow() and self.budget.try_spend():
+                RATING_HEDGES.inc()
+                tasks.add(asyncio.ensure_future(self._send(request)))
+            # The first good response wins; a failed attempt waits for the other
+            while True:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is None and not _is_failure(task.result()):
+                        return task.result()
+                    if not tasks:
+                        return task.result()
+                    if task.exception() is None:
+                        await task.result().aclose()
+        finally:
+            for task in tasks:
+                task.cancel()
+            for task in tasks:
+                try:
+                    response = await task
+                except (asyncio.CancelledError, Exception):
+                    continue
+                await response.aclose()
@@ -0,0 +1,64 @@
+import functools
+import inspect
+from typing import Any, Callable
+
+from fastapi import Response
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+
+# Route options that change what is serialised, so the fast path leaves those routes alone
+_SERIALISATION_OPTIONS = (
+    "response_model_include",
+    "response_model_exclude",
+    "response_model_exclude_unset",
+    "response_model_exclude_defaults",
+    "response_model_exclude_none",
+)
+
+
+class ModelJSONResponse(Response):
+    """JSON response rendered from a pydantic model by pydantic-core, without json.dumps"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            return content.model_dump_json(by_alias=True).encode()
+        return super().render(content)
+
+
+class FastResponseRoute(APIRoute):
+    """APIRoute that serialises handler-built response models straight to JSON bytes
+
+    By default FastAPI validates the value returned by an endpoint against its
+    ``response_model`` again, converts it to plain Python objects and encodes those
+    with json.dumps. The DTOs returned by the quote and bind endpoints are built
+    from validated data in the handler, so when an endpoint returns an instance of
+    exactly its response model it is rendered with ``model_dump_json`` instead.
+    Any other return value takes the usual path. The route keeps its
+    ``response_model``, so the OpenAPI schema does not change.
+    """
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any):
+        response_model = kwargs.get("response_model")
+        if (
+            inspect.isclass(response_model)
+            and issubclass(response_model, BaseModel)
+            and inspect.iscoroutinefunction(endpoint)
+            and not any(kwargs.get(option) for option in _SERIALISATION_OPTIONS)
+            and kwargs.get("response_model_by_alias", True)
+        ):
+            endpoint = _render_model(endpoint, response_model, kwargs.get("status_code") or 200)
+        super().__init__(path, endpoint, **kwargs)
+
+
+def _render_model(endpoint: Callable[..., Any], response_model: type, status_code: int) -> Callable[..., Any]:
+    # functools.wraps keeps the signature FastAPI reads the endpoint parameters from
+    @functools.wraps(endpoint)
+    async def render(*args: Any, **kwargs: Any) -> Any:
+        result = await endpoint(*args, **kwargs)
+        if type(result) is response_model:
+            return ModelJSONResponse(result, status_code=status_code)
+        return result
+
+    return render
@@ -0,0 +1,258 @@
+import asyncio
+import importlib
+import os
+import re
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+from typing import Iterable, Optional, Protocol
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from .cache import TTLCache
+from .config import env_float, env_int
+from .database import VehicleLookup, async_session
+from .models import VehicleDetails
+
+
+class VehicleNotFound(Exception):
+    """The provider does not know the registration or VIN"""
+
+    def __init__(self, rego_or_vin: str):
+        super().__init__(f"Vehicle not found: {rego_or_vin}")
+        self.rego_or_vin = rego_or_vin
+
+
+class VehicleLookupProvider(Protocol):
+    """Source of vehicle details for a normalised registration or VIN"""
+
+    async def lookup(self, rego_or_vin: str) -> Optional[VehicleDetails]:
+        """Return the vehicle, or None when the provider does not know it"""
+        ...
+
+
+class StubVehicleProvider:
+    """Local provider returning the same Honda Jazz for every registration or VIN
+
+    Registrations in ``unknown`` are reported as not found.
+    """
+
+    def __init__(self, unknown: Iterable[str] = ()):
+        self.unknown = {normalize_rego_or_vin(value) for value in unknown}
+        self.calls = 0
+
+    async def lookup(self, rego_or_vin: str) -> Optional[VehicleDetails]:
+        self.calls += 1
+        if rego_or_vin in self.unknown:
+            return None
+        return VehicleDetails(
+            registration="MKD546" if len(rego_or_vin) < 10 else None,
+            vin="MRHGK5860GP020199" if len(rego_or_vin) < 10 else rego_or_vin,
+            make="HONDA",
+            model="JAZZ",
+            year="2015",
+            ccRating="1497",
+            fuelType="Petrol",
+            odometerReading="89655",
+            bodyColour="RED",
+            bodyStyle="Hatchback"
+        )
+
+
+_SEPARATORS = re.compile(r"[\s\-]+")
+
+
+def normalize_rego_or_vin(value: str) -> str:
+    """Upper case a registration or VIN and drop spaces and dashes"""
+    return _SEPARATORS.sub("", value).upper()
+
+
+@dataclass
+class VehicleLookupStats:
+    memory_hits: int = 0
+    negative_hits: int = 0
+    table_hits: int = 0
+    provider_calls: int = 0
+    not_found: int = 0
+
+
+class VehicleLookupService:
+    """Vehicle lookups cached in memory and in the vehicle_lookups table
+
+    A lookup is served from the in-process LRU, then from an unexpired
+    vehicle_lookups row, and only then from the provider, whose answer is stored
+    in both. Unknown vehicles are cached too, for the shorter negative TTL, so
+    a mistyped plate quoted again does not reach the provider either. The table
+    is shared by every worker, so a vehicle is fetched once per TTL across the
+    deployment. Cache rows are written in their own transaction, not the quote's.
+    """
+
+    def __init__(
+        self,
+        provider: VehicleLookupProvider,
+        ttl_seconds: float,
+        negative_ttl_seconds: float,
+        memory_max_entries: int,
+        memory_ttl_seconds: float,
+        provider_concurrency: int = 10,
+        session_factory=async_session,
+    ):
+        self.provider = provider
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.stats = VehicleLookupStats()
+        self._found = TTLCache(memory_max_entries, min(memory_ttl_seconds, ttl_seconds))
+        self._unknown = TTLCache(memory_max_entries, min(memory_ttl_seconds, negative_ttl_seconds))
+        self._provider_slots = asyncio.Semaphore(provider_concurrency)
+        self._session_factory = session_factory
+
+    async def lookup(self, rego_or_vin: str) -> VehicleDetails:
+        """Return the vehicle for a registration or VIN, raising VehicleNotFound"""
+        key = normalize_rego_or_vin(rego_or_vin)
+        if self._unknown.get(key):
+            self.stats.negative_hits += 1
+            raise VehicleNotFound(rego_or_vin)
+        details = self._found.get(key)
+        if details is not None:
+            self.stats.memory_hits += 1
+            return details
+        # Concurrent quotes for the same vehicle share one load
+        return await self._found.get_or_load(key, lambda: self._load_one(key, rego_or_vin))
+
+    async def lookup_many(self, regos_or_vins: Iterable[str]) -> dict[str, Optional[VehicleDetails]]:
+        """Look up many vehicles with one table query, keyed by the values passed
+
+        Unknown vehicles map to None.
+        """
+        keys = {value: normalize_rego_or_vin(value) for value in regos_or_vins}
+        found: dict[str, Optional[VehicleDetails]] = {}
+        missing = []
+        for key in dict.fromkeys(keys.values()):
+            if self._unknown.get(key):
+                self.stats.negative_hits += 1
+                found[key] = None
+            elif (details := self._found.get(key)) is not None:
+                self.stats.memory_hits += 1
+                found[key] = details
+            else:
+                missing.append(key)
+        if missing:
+            found.update(await self._load_many(missing))
+        return {value: found[key] for value, key in keys.items()}
+
+    def snapshot(self) -> dict:
+        """Return the lookup counters and memory cache sizes"""
+        return {
+            **asdict(self.stats),
+            "memory_size": len(self._found),
+            "negative_memory_size": len(self._unknown),
+            "ttl_seconds": self.ttl_seconds,
+            "negative_ttl_seconds": self.negative_ttl_seconds,
+        }
+
+    async def close(self) -> None:
+        await self._found.close()
+        await self._unknown.close()
+
+    async def _load_one(self, key: str, rego_or_vin: str) -> VehicleDetails:
+        details = (await self._load_many([key]))[key]
+        if details is None:
+            raise VehicleNotFound(rego_or_vin)
+        return details
+
+    async def _load_many(self, keys: list[str]) -> dict[str, Optional[VehicleDetails]]:
+        """Read keys from the table, fetch the rest from the provider and store them
+
+        The read and the upsert each use their own short session, so no pooled
+        connection is held while the provider answers.
+        """
+        found: dict[str, Optional[VehicleDetails]] = {}
+        async with self._session_factory() as db:
+            rows = await db.execute(
+                select(VehicleLookup.lookup_key, VehicleLookup.details)
+                .where(VehicleLookup.lookup_key.in_(keys), VehicleLookup.expires_at > datetime.utcnow())
+            )
+            for key, details in rows:
+                self.stats.table_hits += 1
+                found[key] = VehicleDetails.model_validate(details) if details is not None else None
+
+        fetch = [key for key in keys if key not in found]
+        if fetch:
+            fetched = await asyncio.gather(*(self._fetch(key) for key in fetch))
+            found.update(zip(fetch, fetched))
+            await self._store(list(zip(fetch, fetched)))
+
+        for key, details in found.items():
+            if details is None:
+                self.stats.not_found += 1
+                self._unknown.set(key, True)
+            else:
+                self._found.set(key, details)
+        return found
+
+    async def _store(self, fetched: list[tuple[str, Optional[VehicleDetails]]]) -> None:
+        """Upsert provider answers into the table in one transaction"""
+        now = datetime.utcnow()
+        rows = [
+            {
+                "lookup_key": key,
+                "details": details.model_dump(mode="json") if details is not None else None,
+                "fetched_at": now,
+                "expires_at": now + timedelta(
+                    seconds=self.ttl_seconds if details is not None else self.negative_ttl_seconds
+                ),
+            }
+            for key, details in fetched
+        ]
+        statement = insert(VehicleLookup).values(rows)
+        async with self._session_factory() as db:
+            await db.execute(statement.on_conflict_do_update(
+                index_elements=[VehicleLookup.lookup_key],
+                set_={
+                    "details": statement.excluded.details,
+                    "fetched_at": statement.excluded.fetched_at,
+                    "expires_at": statement.excluded.expires_at,
+                }
+            ))
+            await db.commit()
+
+    async def _fetch(self, key: str) -> Optional[VehicleDetails]:
+        async with self._provider_slots:
+            self.stats.provider_calls += 1
+            return await self.provider.lookup(key)
+
+
+def create_vehicle_provider() -> VehicleLookupProvider:
+    """Create the provider named by VEHICLE_PROVIDER
+
+    "stub" (the default) is the local StubVehicleProvider; any other value is a
+    "module:factory" path whose factory is called without arguments.
+    """
+    name = os.getenv("VEHICLE_PROVIDER", "stub")
+    if name == "stub":
+        return StubVehicleProvider()
+    module_name, _, factory_name = name.partition(":")
+    if not factory_name:
+        raise ValueError(f"Unknown VEHICLE_PROVIDER: {name}")
+    return getattr(importlib.import_module(module_name), factory_name)()
+
+
+def create_vehicle_lookup() -> VehicleLookupService:
+    """Create the cached vehicle lookup service
+
+    Configured from the environment:
+      VEHICLE_PROVIDER                    "stub" (default) or a "module:factory" path
+      VEHICLE_CACHE_TTL_SECONDS           seconds a vehicle is cached (default 2592000, 30 days)
+      VEHICLE_CACHE_NEGATIVE_TTL_SECONDS  seconds an unknown vehicle is cached (default 3600)
+      VEHICLE_MEMORY_MAX_ENTRIES          vehicles kept in memory per worker (default 10000, 0 disables)
+      VEHICLE_MEMORY_TTL_SECONDS          seconds a vehicle is served from memory (default 300)
+      VEHICLE_PROVIDER_CONCURRENCY        provider calls in flight per worker (default 10)
+    """
+    return VehicleLookupService(
+        provider=create_vehicle_provider(),
+        ttl_seconds=env_float("VEHICLE_CACHE_TTL_SECONDS", 30 * 24 * 3600.0),
+        negative_ttl_seconds=env_float("VEHICLE_CACHE_NEGATIVE_TTL_SECONDS", 3600.0),
+        memory_max_entries=env_int("VEHICLE_MEMORY_MAX_ENTRIES", 10000),
+        memory_ttl_seconds=env_float("VEHICLE_MEMORY_TTL_SECONDS", 300.0),
+        provider_concurrency=env_int("VEHICLE_PROVIDER_CONCURRENCY", 10),
+    )
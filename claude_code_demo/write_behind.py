@@ -0,0 +1,478 @@
+import asyncio
+import fcntl
+import glob
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import date, datetime
+from typing import Optional
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import DBAPIError, DataError, IntegrityError, StatementError
+
+from .config import env_bool, env_float, env_int
+from .database import GapPremium as DBGapPremium, PolicyStatus, Quote, VehicleDetail, async_session
+from .models import GapQuoteResponse, GapStoredQuoteResponse
+from .quotes import StoredQuote
+
+logger = logging.getLogger(__name__)
+
+
+class PendingQuote(BaseModel):
+    """A created quote waiting in the queue, stored as one JSON line"""
+    created_at: datetime
+    rego_or_vin: str
+    max_shortfall: str
+    agent_code: str
+    brand_code: str
+    user_code: str
+    response: GapQuoteResponse
+
+
+@dataclass
+class WriteBehindStats:
+    queued: int = 0
+    written: int = 0
+    skipped: int = 0
+    batches: int = 0
+    write_failures: int = 0
+    recovered: int = 0
+    dead_lettered: int = 0
+    full: int = 0
+
+
+class _Segment:
+    """One append-only queue file, locked by the worker writing its quotes"""
+
+    def __init__(self, path: str, fd: int, size: int = 0):
+        self.path = path
+        self.fd = fd
+        self.size = size
+        self.outstanding = 0
+
+
+def _is_data_error(error: Exception) -> bool:
+    """An error caused by the quotes written rather than by the database being unavailable"""
+    if isinstance(error, (IntegrityError, DataError, ValueError, TypeError)):
+        return True
+    if isinstance(error, DBAPIError):
+        # asyncpg errors are not always mapped to DataError, so go by the SQLSTATE
+        # class: 22 data exception, 23 integrity constraint violation
+        sqlstate = getattr(error.orig, "sqlstate", None) or getattr(error.orig, "pgcode", None)
+        return sqlstate is not None and sqlstate[:2] in ("22", "23")
+    # Parameters that fail to convert are reported before reaching the database
+    return isinstance(error, StatementError)
+
+
+def _lock(path: str) -> Optional[int]:
+    """Open path and take its exclusive lock, or return None when another process holds it"""
+    fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+class QuoteWriteBehind:
+    """Durable local queue of created quotes, written to the database in batches
+
+    ``put`` appends the quote as a JSON line to this worker's segment file in
+    directory and, with fsync on, returns once the line is on disk, so a quote
+    given to the dealer survives a crash of the worker. Concurrent puts share
+    one fsync. A background task inserts the queued quotes every
+    flush_interval_seconds, or as soon as batch_size are waiting, with one
+    multi-row INSERT per table in one transaction. Quotes already in the
+    database are skipped, so replaying a segment is safe.
+
+    Segments are rotated after segment_bytes and deleted once all their
+    quotes are committed. Each worker holds a lock on its segments; segments
+    left unlocked by a worker that died are replayed by the next worker to
+    start. Quotes still queued can be read with ``lookup`` and are written
+    ahead of a bind by ``flush``.
+
+    At most max_pending quotes are queued; ``put`` returns False when the queue
+    is full so the caller writes the quote itself. When a batch fails because
+    of its data, its quotes are written one at a time, and a quote failing
+    max_attempts times is moved to the dead-letter file in directory instead
+    of holding up the quotes behind it.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        batch_size: int,
+        flush_interval_seconds: float,
+        segment_bytes: int,
+        fsync: bool,
+        bind_wait_seconds: float,
+        max_pending: int = 10000,
+        max_attempts: int = 3
+    ):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.bind_wait_seconds = bind_wait_seconds
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._queued: "OrderedDict[str, tuple[PendingQuote, _Segment]]" = OrderedDict()
+        self._segment: Optional[_Segment] = None
+        self._write_lock = asyncio.Lock()
+        self._batch_ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # Lines appended and lines known to be on disk, for group fsync
+        self._appended = 0
+        self._synced = 0
+        self._syncing: Optional[asyncio.Task] = None
+        # Failed writes of quotes whose data was rejected, by quote reference
+        self._attempts: dict[str, int] = {}
+        self.stats = WriteBehindStats()
+
+    def __len__(self) -> int:
+        return len(self._queued)
+
+    async def start(self) -> None:
+        """Open a segment, queue the quotes of segments left by dead workers and start writing"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._recover()
+        self._segment = self._open_segment()
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, pending: PendingQuote) -> bool:
+        """Queue a quote, returning once it is durable, or False without queueing it when the queue is full"""
+        if len(self._queued) >= self.max_pending:
+            self.stats.full += 1
+            return False
+        line = pending.model_dump_json().encode() + b"\n"
+        if self._segment.size + len(line) > self.segment_bytes and self._segment.size:
+            self._rotate()
+        segment = self._segment
+        os.write(segment.fd, line)
+        segment.size += len(line)
+        segment.outstanding += 1
+        self._appended += 1
+        self._queued[pending.response.quoteRef] = (pending, segment)
+        self.stats.queued += 1
+        if len(self._queued) >= self.batch_size:
+            self._batch_ready.set()
+        if self.fsync:
+            await self._sync(self._appended)
+        return True
+
+    def lookup(self, quote_ref: str) -> Optional[StoredQuote]:
+        """The quote with quote_ref if it is still queued in this worker"""
+        queued = self._queued.get(quote_ref)
+        if queued is None:
+            return None
+        pending, _ = queued
+        response = GapStoredQuoteResponse(**pending.response.model_dump(), policyStatus=PolicyStatus.CREATED.value)
+        return StoredQuote(pending.agent_code, response)
+
+    async def flush(self, quote_ref: Optional[str] = None) -> None:
+        """Write the queued quotes now, or when quote_ref is queued, those up to and including it"""
+        if quote_ref is not None and quote_ref not in self._queued:
+            return
+        await self._drain(raise_errors=True, until=quote_ref)
+        if quote_ref is not None and quote_ref in self._queued:
+            raise RuntimeError(f"Queued quote {quote_ref} could not be written")
+
+    def snapshot(self) -> dict:
+        """Return the counters and backlog of the queue"""
+        oldest = next(iter(self._queued.values()), None)
+        return {
+            **asdict(self.stats),
+            "pending": len(self._queued),
+            "oldest_pending_seconds": (
+                round((datetime.utcnow() - oldest[0].created_at).total_seconds(), 3) if oldest else None
+            ),
+            "segment": self._segment.path if self._segment else None,
+            "max_pending": self.max_pending,
+            "batch_size": self.batch_size,
+            "flush_interval_seconds": self.flush_interval_seconds,
+            "fsync": self.fsync,
+        }
+
+    async def close(self) -> None:
+        """Stop the background writer after a last attempt to write the queued quotes
+
+        Quotes that cannot be written stay in their segment and are replayed by
+        the next worker to start.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self._drain(raise_errors=False)
+        segments = {segment.fd: segment for _, segment in self._queued.values()}
+        if self._segment is not None:
+            segments[self._segment.fd] = self._segment
+        for segment in segments.values():
+            if segment.outstanding == 0:
+                os.unlink(segment.path)
+            os.close(segment.fd)
+        self._segment = None
+
+    async def _run(self) -> None:
+        failures = 0
+        while True:
+            # Back off while the database is unavailable, up to 5 seconds between attempts
+            interval = min(self.flush_interval_seconds * 2 ** min(failures, 10), 5.0)
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            failures = 0 if await self._drain(raise_errors=False) else failures + 1
+
+    async def _drain(self, raise_errors: bool, until: Optional[str] = None) -> bool:
+        """Write the quotes queued when called, up to and including until, returning whether all were written
+
+        Quotes queued while it runs are left to the next call, so a flush does
+        not wait for a backlog that keeps growing.
+        """
+        async with self._write_lock:
+            refs = list(self._queued)
+            if until is not None:
+                # Written by the call holding the lock before this one
+                if until not in self._queued:
+                    return True
+                refs = refs[:refs.index(until) + 1]
+            for start in range(0, len(refs), self.batch_size):
+                batch = [self._queued[ref][0] for ref in refs[start:start + self.batch_size]]
+                try:
+                    if self.fsync:
+                        # Nothing reaches the database before it is durable in the queue
+                        await self._sync(self._appended)
+                    await self._write(batch)
+                except Exception as e:
+                    if not _is_data_error(e):
+                        self.stats.write_failures += 1
+                        if raise_errors:
+                            raise
+                        logger.warning("Write-behind batch of %d quotes failed, will retry: %s", len(batch), e)
+                        return False
+                    # Some quote of the batch was rejected; write them one at a
+                    # time so the others are not held up by it
+                    if not await self._write_each(batch, raise_errors):
+                        return False
+                    continue
+                for pending in batch:
+                    self._done(pending)
+        return True
+
+    async def _write_each(self, batch: list[PendingQuote], raise_errors: bool) -> bool:
+        for pending in batch:
+            try:
+                await self._write([pending])
+            except Exception as e:
+                self.stats.write_failures += 1
+                if not _is_data_error(e):
+                    if raise_errors:
+                        raise
+                    logger.warning("Write-behind write failed, will retry: %s", e)
+                    return False
+                ref = pending.response.quoteRef
+                self._attempts[ref] = self._attempts.get(ref, 0) + 1
+                if self._attempts[ref] < self.max_attempts:
+                    logger.warning("Write-behind quote %s was rejected, will retry: %s", ref, e)
+                    continue
+                self._dead_letter(pending, e)
+            self._done(pending)
+        return True
+
+    def _done(self, pending: PendingQuote) -> None:
+        """Drop a quote that is written or dead-lettered, deleting its segment once it has no others"""
+        self._attempts.pop(pending.response.quoteRef, None)
+        _, segment = self._queued.pop(pending.response.quoteRef)
+        segment.outstanding -= 1
+        if segment.outstanding == 0 and segment is not self._segment:
+            os.unlink(segment.path)
+            os.close(segment.fd)
+
+    def _dead_letter(self, pending: PendingQuote, error: Exception) -> None:
+        """Append a quote that cannot be written to the dead-letter file, which is not replayed"""
+        record = {
+            "failed_at": datetime.utcnow().isoformat(),
+            "error": str(error),
+            "quote": pending.model_dump(mode="json"),
+        }
+        fd = os.open(os.path.join(self.directory, "dead-letter.jsonl"), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, json.dumps(record).encode() + b"\n")
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self.stats.dead_lettered += 1
+        logger.warning("Write-behind quote %s moved to the dead-letter file: %s", pending.response.quoteRef, error)
+
+    async def _write(self, batch: list[PendingQuote]) -> None:
+        """Insert the quotes of batch not in the database yet, in one transaction"""
+        async with async_session() as db:
+            # Bounded by creation time so only the partitions of the batch are scanned
+            result = await db.execute(
+                select(Quote.quote_ref, Quote.created_at).where(
+                    Quote.quote_ref.in_([pending.response.quoteRef for pending in batch]),
+                    Quote.created_at >= min(pending.created_at for pending in batch),
+                    Quote.created_at <= max(pending.created_at for pending in batch)
+                )
+            )
+            stored = set(result.all())
+            new = [pending for pending in batch if (pending.response.quoteRef, pending.created_at) not in stored]
+            self.stats.skipped += len(batch) - len(new)
+            if new:
+                # One multi-row INSERT ... RETURNING per table, ids come back in row order
+                quote_ids = (await db.execute(
+                    insert(Quote).returning(Quote.id, sort_by_parameter_order=True),
+                    [
+                        {
+                            "quote_ref": pending.response.quoteRef,
+                            "rego_or_vin": pending.rego_or_vin,
+                            "max_shortfall": pending.max_shortfall,
+                            "quote_expiry_date": date.fromisoformat(pending.response.quoteExpiryDate),
+                            "gst_rate": pending.response.gstRate,
+                            "policy_status": PolicyStatus.CREATED.value,
+                            "agent_code": pending.agent_code,
+                            "brand_code": pending.brand_code,
+                            "user_code": pending.user_code,
+                            "created_at": pending.created_at
+                        }
+                        for pending in new
+                    ]
+                )).scalars().all()
+
+                await db.execute(
+                    insert(VehicleDetail).returning(VehicleDetail.id),
+                    [
+                        {
+                            "quote_id": quote_id,
+                            "quote_created_at": pending.created_at,
+                            "registration": pending.response.vehicleDetails.registration,
+                            "vin": pending.response.vehicleDetails.vin,
+                            "make": pending.response.vehicleDetails.make,
+                            "model": pending.response.vehicleDetails.model,
+                            "year": pending.response.vehicleDetails.year,
+                            "cc_rating": pending.response.vehicleDetails.ccRating,
+                            "fuel_type": pending.response.vehicleDetails.fuelType,
+                            "odometer_reading": pending.response.vehicleDetails.odometerReading,
+                            "body_colour": pending.response.vehicleDetails.bodyColour,
+                            "body_style": pending.response.vehicleDetails.bodyStyle
+                        }
+                        for quote_id, pending in zip(quote_ids, new)
+                    ]
+                )
+
+                await db.execute(
+                    insert(DBGapPremium).returning(DBGapPremium.id),
+                    [
+                        {
+                            "quote_id": quote_id,
+                            "quote_created_at": pending.created_at,
+                            "wholesale_amount": pending.response.gapPremium.wholesaleAmount,
+                            "retail_amount": pending.response.gapPremium.retailAmount
+                        }
+                        for quote_id, pending in zip(quote_ids, new)
+                    ]
+                )
+            await db.commit()
+        self.stats.written += len(new)
+        self.stats.batches += 1
+
+    async def _sync(self, appended: int) -> None:
+        """Wait until the first appended lines are on disk, sharing fsync calls"""
+        while self._synced < appended:
+            if self._syncing is None:
+                self._syncing = asyncio.ensure_future(self._fsync())
+            await asyncio.shield(self._syncing)
+
+    async def _fsync(self) -> None:
+        try:
+            appended = self._appended
+            await asyncio.to_thread(os.fdatasync, self._segment.fd)
+            # A rotation while this ran may already have synced further
+            self._synced = max(self._synced, appended)
+        finally:
+            self._syncing = None
+
+    def _open_segment(self) -> _Segment:
+        path = os.path.join(self.directory, f"quotes-{os.getpid()}-{time.time_ns()}.jsonl")
+        return _Segment(path, _lock(path))
+
+    def _rotate(self) -> None:
+        """Start a new segment, deleting the current one if all its quotes are written"""
+        segment = self._segment
+        # Lines of the old segment are synced before any of the new one
+        os.fdatasync(segment.fd)
+        self._synced = self._appended
+        self._segment = self._open_segment()
+        if segment.outstanding == 0:
+            os.unlink(segment.path)
+            os.close(segment.fd)
+
+    def _recover(self) -> None:
+        """Queue the quotes of segments no live worker holds"""
+        for path in sorted(glob.glob(os.path.join(self.directory, "quotes-*.jsonl"))):
+            fd = _lock(path)
+            if fd is None:
+                continue
+            with open(path, "rb") as f:
+                lines = f.read().splitlines()
+            segment = _Segment(path, fd, size=os.fstat(fd).st_size)
+            for line in lines:
+                try:
+                    pending = PendingQuote.model_validate_json(line)
+                except ValidationError:
+                    # The last line may have been cut short by the crash
+                    logger.warning("Skipping unreadable write-behind line in %s", path)
+                    continue
+                if pending.response.quoteRef not in self._queued:
+                    segment.outstanding += 1
+                    self._queued[pending.response.quoteRef] = (pending, segment)
+            if segment.outstanding == 0:
+                os.unlink(path)
+                os.close(fd)
+            else:
+                self.stats.recovered += segment.outstanding
+                logger.warning("Recovered %d queued quotes from %s", segment.outstanding, path)
+
+
+def create_write_behind() -> Optional[QuoteWriteBehind]:
+    """Create the write-behind queue when QUOTE_WRITE_MODE is "write_behind"
+
+    Configured from the environment:
+      QUOTE_WRITE_MODE                     "sync" (default) commits each quote before replying,
+                                           "write_behind" queues it
+      WRITE_BEHIND_DIR                     directory of the queue files, on local durable disk
+                                           (default write_behind)
+      WRITE_BEHIND_BATCH_SIZE              quotes inserted per transaction (default 500)
+      WRITE_BEHIND_FLUSH_INTERVAL_SECONDS  longest a quote waits to be written (default 0.1)
+      WRITE_BEHIND_SEGMENT_BYTES           size of a queue file before a new one is started
+                                           (default 4194304)
+      WRITE_BEHIND_FSYNC                   fsync each queued quote before replying (default true)
+      WRITE_BEHIND_BIND_WAIT_SECONDS       how long a bind waits for a quote queued by another
+                                           worker to be written (default 1)
+      WRITE_BEHIND_MAX_PENDING             quotes queued per worker before new ones are written
+                                           directly (default 10000)
+      WRITE_BEHIND_MAX_ATTEMPTS            rejected writes of a quote before it is moved to the
+                                           dead-letter file (default 3)
+    """
+    mode = os.getenv("QUOTE_WRITE_MODE", "sync")
+    if mode == "sync":
+        return None
+    if mode != "write_behind":
+        raise ValueError(f"Unknown QUOTE_WRITE_MODE: {mode}")
+    return QuoteWriteBehind(
+        directory=os.getenv("WRITE_BEHIND_DIR", "write_behind"),
+        batch_size=env_int("WRITE_BEHIND_BATCH_SIZE", 500),
+        flush_interval_seconds=env_float("WRITE_BEHIND_FLUSH_INTERVAL_SECONDS", 0.1),
+        segment_bytes=env_int("WRITE_BEHIND_SEGMENT_BYTES", 4 * 1024 * 1024),
+        fsync=env_bool("WRITE_BEHIND_FSYNC", True),
+        bind_wait_seconds=env_float("WRITE_BEHIND_BIND_WAIT_SECONDS", 1.0),
+        max_pending=env_int("WRITE_BEHIND_MAX_PENDING", 10000),
+        max_attempts=env_int("WRITE_BEHIND_MAX_ATTEMPTS", 3),
+    )
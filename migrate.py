@@ -2,7 +2,8 @@
 """
 Database migration management script
 """
-import os
+import asyncio
+import logging
 import sys
 from alembic.config import Config
 from alembic import command
@@ -44,6 +45,38 @@ def show_current():
     alembic_cfg = get_alembic_config()
     command.current(alembic_cfg)
 
+def maintain_partitions(months_ahead, retention_months, drop=False, dry_run=False):
+    """Pre-create future quote partitions and detach expired ones"""
+    from claude_code_demo.partitions import ARCHIVE_SCHEMA, maintain_partitions as maintain
+    created, archived = asyncio.run(maintain(months_ahead, retention_months, drop=drop, dry_run=dry_run))
+    create_action = "Would create" if dry_run else "Created"
+    if drop:
+        archive_action = "Would drop" if dry_run else "Dropped"
+    else:
+        archive_action = f"{'Would archive' if dry_run else 'Archived'} to {ARCHIVE_SCHEMA}"
+    for name in created:
+        print(f"{create_action} partition: {name}")
+    for name in archived:
+        print(f"{archive_action} partition: {name}")
+    if not created and not archived:
+        print("Partitions are up to date")
+
+def purge_expired_quotes(archive_dir, batch_size, max_rows_per_second, max_batches=None):
+    """Archive and delete expired quotes that were never bound"""
+    from claude_code_demo.purge import purge_expired_quotes as purge
+    # Per-batch progress and archive recovery are logged by the purge module
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    result = asyncio.run(purge(archive_dir, batch_size=batch_size,
+                               max_rows_per_second=max_rows_per_second, max_batches=max_batches))
+    print(f"Archived {result.quotes} expired quotes ({result.rows} rows) in {result.batches} batches "
+          f"to {archive_dir}, {result.seconds:.1f}s at {result.rows_per_second:.0f} rows/sec")
+
+def purge_idempotency_keys():
+    """Delete idempotency keys whose replay window has passed"""
+    from claude_code_demo.idempotency import purge_expired_keys
+    deleted = asyncio.run(purge_expired_keys())
+    print(f"Deleted {deleted} expired idempotency keys")
+
 def main():
     parser = argparse.ArgumentParser(description="Database migration management")
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
@@ -67,6 +100,23 @@ def main():
     # Current command
     subparsers.add_parser("current", help="Show current revision")
     
+    # Partition maintenance command
+    partitions_parser = subparsers.add_parser("partitions", help="Create future and archive old quote partitions")
+    partitions_parser.add_argument("--months-ahead", type=int, default=3, help="Months of partitions to create ahead (default: 3)")
+    partitions_parser.add_argument("--retention-months", type=int, default=12, help="Months of partitions kept attached (default: 12)")
+    partitions_parser.add_argument("--drop", action="store_true", help="Drop old partitions instead of archiving them")
+    partitions_parser.add_argument("--dry-run", action="store_true", help="Only list the partitions that would change")
+    
+    # Expired quote purge command
+    purge_parser = subparsers.add_parser("purge", help="Archive and delete expired unbound quotes")
+    purge_parser.add_argument("--archive-dir", default="archive/quotes", help="Directory for the archive files (default: archive/quotes)")
+    purge_parser.add_argument("--batch-size", type=int, default=1000, help="Quotes archived per transaction (default: 1000)")
+    purge_parser.add_argument("--max-rows-per-second", type=float, default=5000, help="Delete rate limit, 0 for none (default: 5000)")
+    purge_parser.add_argument("--max-batches", type=int, help="Stop after this many batches")
+    
+    # Idempotency key cleanup command
+    subparsers.add_parser("purge-idempotency-keys", help="Delete expired idempotency keys")
+    
     args = parser.parse_args()
     
     if not args.command:
@@ -84,6 +134,12 @@ def main():
             show_history()
         elif args.command == "current":
             show_current()
+        elif args.command == "partitions":
+            maintain_partitions(args.months_ahead, args.retention_months, drop=args.drop, dry_run=args.dry_run)
+        elif args.command == "purge":
+            purge_expired_quotes(args.archive_dir, args.batch_size, args.max_rows_per_second, args.max_batches)
+        elif args.command == "purge-idempotency-keys":
+            purge_idempotency_keys()
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
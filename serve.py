@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Production entry point to run the GAP Quote Service API
+
+    WEB_CONCURRENCY=4 python serve.py
+
+Runs several uvicorn worker processes sharing one listening socket, on uvloop
+and httptools. Use run.py for development with reload.
+
+On SIGTERM every worker stops accepting connections, lets its in-flight
+requests finish for up to SERVER_GRACEFUL_SHUTDOWN_SECONDS, then runs the
+application shutdown, which closes its pools. Workers that exit, including those
+recycled after SERVER_MAX_REQUESTS, are replaced by the parent process.
+
+Configured from the environment:
+  HOST                              interface to listen on (default 0.0.0.0)
+  PORT                              port to listen on (default 8000)
+  WEB_CONCURRENCY                   worker processes (default: the CPUs available to the container)
+  SERVER_LOOP                       "uvloop" (default) or "asyncio"
+  SERVER_HTTP                       "httptools" (default) or "h11"
+  SERVER_BACKLOG                    connections queued by the kernel before accept (default 2048)
+  SERVER_KEEPALIVE_SECONDS          seconds an idle client connection is kept open (default 5)
+  SERVER_LIMIT_CONCURRENCY          connections per worker before new ones get a 503 (default unset)
+  SERVER_MAX_REQUESTS               requests a worker serves before it is replaced (default unset)
+  SERVER_MAX_REQUESTS_JITTER        random extra requests per worker, so they are not all
+                                    replaced at once (default 0)
+  SERVER_GRACEFUL_SHUTDOWN_SECONDS  seconds in-flight requests get to finish on shutdown (default 30)
+  SERVER_LOG_LEVEL                  uvicorn log level (default info)
+"""
+import importlib.util
+import inspect
+import math
+import os
+
+import uvicorn
+
+from claude_code_demo.config import env_int
+
+
+def available_cpus() -> int:
+    """CPUs this process may use, honouring CPU affinity and a cgroup v2 CPU quota"""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(cpus, 1)
+
+
+def _implementation(variable: str, preferred: str, fallback: str) -> str:
+    """The module named by variable, or fallback when it is not installed"""
+    name = os.getenv(variable, preferred)
+    if name == preferred and importlib.util.find_spec(preferred) is None:
+        print(f"{variable} is {preferred} but the '{preferred}' package is not installed, falling back to {fallback}")
+        return fallback
+    return name
+
+
+def server_options() -> dict:
+    """uvicorn.run keyword arguments read from the environment"""
+    options = {
+        "host": os.getenv("HOST", "0.0.0.0"),
+        "port": env_int("PORT", 8000),
+        "workers": env_int("WEB_CONCURRENCY", available_cpus()),
+        "loop": _implementation("SERVER_LOOP", "uvloop", "asyncio"),
+        "http": _implementation("SERVER_HTTP", "httptools", "h11"),
+        "backlog": env_int("SERVER_BACKLOG", 2048),
+        "timeout_keep_alive": env_int("SERVER_KEEPALIVE_SECONDS", 5),
+        "limit_concurrency": env_int("SERVER_LIMIT_CONCURRENCY", 0) or None,
+        "limit_max_requests": env_int("SERVER_MAX_REQUESTS", 0) or None,
+        "timeout_graceful_shutdown": env_int("SERVER_GRACEFUL_SHUTDOWN_SECONDS", 30),
+        "log_level": os.getenv("SERVER_LOG_LEVEL", "info"),
+    }
+    jitter = env_int("SERVER_MAX_REQUESTS_JITTER", 0)
+    if jitter:
+        # Older uvicorn releases have no jitter setting
+        if "limit_max_requests_jitter" not in inspect.signature(uvicorn.Config).parameters:
+            print("SERVER_MAX_REQUESTS_JITTER needs a newer uvicorn, recycling workers without jitter")
+        else:
+            options["limit_max_requests_jitter"] = jitter
+    return options
+
+
+if __name__ == "__main__":
+    options = server_options()
+    print(f"Starting {options['workers']} workers on {options['host']}:{options['port']} "
+          f"({options['loop']}, {options['http']})")
+    uvicorn.run("claude_code_demo.main:app", **options)
@@ -0,0 +1,73 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from claude_code_demo.cache import TTLCache  # noqa: E402
+
+
+def gated_loader(gate: asyncio.Event, value, calls: list):
+    async def load():
+        calls.append(value)
+        await gate.wait()
+        return value
+    return load
+
+
+def test_discard_keeps_loads_of_other_keys():
+    cache = TTLCache(max_entries=10, ttl_seconds=60)
+
+    async def run():
+        gate = asyncio.Event()
+        calls = []
+        loads = [
+            asyncio.create_task(cache.get_or_load("a", gated_loader(gate, "a1", calls))),
+            asyncio.create_task(cache.get_or_load("b", gated_loader(gate, "b1", calls))),
+        ]
+        await asyncio.sleep(0)
+        cache.discard("a")
+        gate.set()
+        return await asyncio.gather(*loads)
+
+    assert asyncio.run(run()) == ["a1", "b1"]
+    # The load of "a" started before the discard is returned but not stored
+    assert cache.get("a") is None
+    assert cache.get("b") == "b1"
+
+
+def test_discard_starts_a_new_load_for_later_callers():
+    cache = TTLCache(max_entries=10, ttl_seconds=60)
+
+    async def run():
+        old_gate, new_gate = asyncio.Event(), asyncio.Event()
+        calls = []
+        old = asyncio.create_task(cache.get_or_load("a", gated_loader(old_gate, "before", calls)))
+        await asyncio.sleep(0)
+        cache.discard("a")
+        new = asyncio.create_task(cache.get_or_load("a", gated_loader(new_gate, "after", calls)))
+        await asyncio.sleep(0)
+        new_gate.set()
+        await asyncio.wait_for(new, 1)
+        old_gate.set()
+        return await old, await new, calls
+
+    assert asyncio.run(run()) == ("before", "after", ["before", "after"])
+    assert cache.get("a") == "after"
+
+
+def test_invalidate_drops_every_load_in_flight():
+    cache = TTLCache(max_entries=10, ttl_seconds=60)
+
+    async def run():
+        gate = asyncio.Event()
+        loads = [
+            asyncio.create_task(cache.get_or_load(key, gated_loader(gate, key, [])))
+            for key in ("a", "b")
+        ]
+        await asyncio.sleep(0)
+        cache.invalidate()
+        gate.set()
+        await asyncio.gather(*loads)
+
+    asyncio.run(run())
+    assert len(cache) == 0
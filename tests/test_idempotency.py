@@ -0,0 +1,240 @@
+import asyncio
+import hashlib
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from claude_code_demo.database import IdempotencyKey  # noqa: E402
+from claude_code_demo.idempotency import IdempotencyMiddleware, _store_key  # noqa: E402
+
+PATH = "/quickquote/generator/gap/v2/quote/create"
+COLUMNS = (
+    "request_hash", "response_status", "response_content_type", "response_body",
+    "created_at", "locked_until", "expires_at",
+)
+
+
+class FakeResult:
+    def __init__(self, row=None):
+        self.row = row
+
+    def first(self):
+        return self.row
+
+    def scalar_one_or_none(self):
+        return self.row
+
+
+class FakeStore:
+    """Session factory keeping idempotency_keys rows in a dict, by the statements the middleware sends"""
+
+    def __init__(self):
+        self.rows: dict[str, dict] = {}
+        self.down = False
+
+    def __call__(self):
+        return FakeSession(self)
+
+
+class FakeSession:
+    def __init__(self, store: FakeStore):
+        self.store = store
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def commit(self):
+        pass
+
+    async def execute(self, statement):
+        if self.store.down:
+            raise OperationalError("SELECT", {}, ConnectionRefusedError("connection refused"))
+        rows = self.store.rows
+        params = statement.compile().params
+        values = {column: params[column] for column in COLUMNS if column in params}
+        if statement.is_insert:
+            key = params["idempotency_key"]
+            if key in rows:
+                return FakeResult()
+            rows[key] = values
+            return FakeResult((key,))
+        key = params["idempotency_key_1"]
+        row = rows.get(key)
+        if statement.is_update:
+            if row is None:
+                return FakeResult()
+            if "request_hash" in values:
+                # Taking over a claim: only an expired key or an abandoned claim
+                now = datetime.utcnow()
+                if not (row["expires_at"] < now or (row["response_status"] is None and row["locked_until"] < now)):
+                    return FakeResult()
+            row.update(values)
+            return FakeResult((key,))
+        if statement.is_delete:
+            if row is not None and row["response_status"] is None:
+                del rows[key]
+            return FakeResult()
+        return FakeResult(IdempotencyKey(idempotency_key=key, **row) if row is not None else None)
+
+
+class CountingApp:
+    """Endpoint answering with a JSON body, held on a gate when one is set"""
+
+    def __init__(self, errors=()):
+        self.calls = 0
+        self.gate = None
+        self.errors = list(errors)
+
+    async def __call__(self, scope, receive, send):
+        self.calls += 1
+        body = (await receive())["body"]
+        if self.gate is not None:
+            await self.gate.wait()
+        response = json.dumps({"call": self.calls, "request": json.loads(body), "errors": self.errors}).encode()
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": response})
+
+
+def create_client(app, store: FakeStore, wait_seconds: float = 1.0) -> httpx.AsyncClient:
+    middleware = IdempotencyMiddleware(
+        app, paths=[PATH], ttl_seconds=60, wait_seconds=wait_seconds, lock_seconds=30, poll_seconds=0.01,
+        session_factory=store,
+    )
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=middleware), base_url="http://app")
+
+
+def post(client, body, key="key-1", agent="499"):
+    return client.post(PATH, json=body, headers={"Idempotency-Key": key, "X-Agent-Code": agent})
+
+
+def test_retry_gets_the_stored_response():
+    app, store = CountingApp(), FakeStore()
+
+    async def run():
+        async with create_client(app, store) as client:
+            return await post(client, {"rego": "MKD546"}), await post(client, {"rego": "MKD546"})
+
+    first, retry = asyncio.run(run())
+    assert app.calls == 1
+    assert retry.content == first.content
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert "idempotent-replayed" not in first.headers
+
+
+def test_key_reused_with_another_body_is_rejected():
+    app, store = CountingApp(), FakeStore()
+
+    async def run():
+        async with create_client(app, store) as client:
+            await post(client, {"rego": "MKD546"})
+            return await post(client, {"rego": "ABC123"})
+
+    response = asyncio.run(run())
+    assert response.status_code == 422
+    assert response.json()["errors"][0]["code"] == "ER010"
+    assert app.calls == 1
+
+
+def test_concurrent_duplicate_shares_the_first_execution():
+    app, store = CountingApp(), FakeStore()
+
+    async def run():
+        app.gate = asyncio.Event()
+        async with create_client(app, store) as client:
+            requests = [asyncio.create_task(post(client, {"rego": "MKD546"})) for _ in range(3)]
+            await asyncio.sleep(0.05)
+            app.gate.set()
+            return await asyncio.gather(*requests)
+
+    responses = asyncio.run(run())
+    assert app.calls == 1
+    assert {response.content for response in responses} == {responses[0].content}
+
+
+def test_duplicate_of_request_running_elsewhere_gets_409_after_wait():
+    app, store = CountingApp(), FakeStore()
+    body = json.dumps({"rego": "MKD546"}, separators=(",", ":")).encode()
+    now = datetime.utcnow()
+    # Claimed by a request still running in another worker
+    store.rows[_store_key("499", PATH, "key-1")] = {
+        "request_hash": hashlib.sha256(body).hexdigest(), "response_status": None,
+        "response_content_type": None, "response_body": None, "created_at": now,
+        "locked_until": now + timedelta(seconds=30), "expires_at": now + timedelta(seconds=60),
+    }
+
+    async def run():
+        async with create_client(app, store, wait_seconds=0.1) as client:
+            return await client.post(PATH, content=body, headers={
+                "Idempotency-Key": "key-1", "X-Agent-Code": "499", "Content-Type": "application/json"
+            })
+
+    response = asyncio.run(run())
+    assert response.status_code == 409
+    assert response.json()["errors"][0]["code"] == "ER011"
+    assert app.calls == 0
+
+
+def test_system_errors_are_not_stored():
+    app, store = CountingApp(errors=[{"category": "SYSTEM", "code": "ER999"}]), FakeStore()
+
+    async def run():
+        async with create_client(app, store) as client:
+            await post(client, {"rego": "MKD546"})
+            return await post(client, {"rego": "MKD546"})
+
+    retry = asyncio.run(run())
+    assert app.calls == 2
+    assert "idempotent-replayed" not in retry.headers
+    assert store.rows == {}
+
+
+def test_unavailable_database_answers_er999():
+    app, store = CountingApp(), FakeStore()
+    store.down = True
+
+    async def run():
+        async with create_client(app, store) as client:
+            return await post(client, {"rego": "MKD546"})
+
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    assert response.json()["errors"][0]["code"] == "ER999"
+    assert app.calls == 0
+
+
+def test_long_agent_code_does_not_lengthen_the_stored_key():
+    app, store = CountingApp(), FakeStore()
+
+    async def run():
+        async with create_client(app, store) as client:
+            return await post(client, {"rego": "MKD546"}, key="k" * 100, agent="A" * 1000)
+
+    assert asyncio.run(run()).status_code == 200
+    assert [len(key) for key in store.rows] == [64]
+
+
+def test_response_is_returned_when_it_cannot_be_stored():
+    store = FakeStore()
+
+    class FailingAfterRun(CountingApp):
+        async def __call__(self, scope, receive, send):
+            await super().__call__(scope, receive, send)
+            store.down = True
+
+    app = FailingAfterRun()
+
+    async def run():
+        async with create_client(app, store) as client:
+            return await post(client, {"rego": "MKD546"})
+
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    assert response.json()["call"] == 1
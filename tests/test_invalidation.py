@@ -0,0 +1,38 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from claude_code_demo.cache import TTLCache  # noqa: E402
+from claude_code_demo.invalidation import CacheInvalidation  # noqa: E402
+from claude_code_demo.rating import PremiumKey  # noqa: E402
+
+
+def premium_cache() -> TTLCache:
+    cache = TTLCache(max_entries=10, ttl_seconds=60)
+    cache.set(PremiumKey("499", "GAP", "GC1"), 1)
+    cache.set(PremiumKey("499", "GAP", "GC2"), 2)
+    cache.set(PremiumKey("500", "GAP", "GC1"), 3)
+    return cache
+
+
+def test_apply_drops_matching_keys():
+    cache = premium_cache()
+    invalidation = CacheInvalidation({"premium": cache}, dsn=None)
+    assert invalidation.apply({"cache": "premium", "match": {"agent_code": "499"}}) == 2
+    assert cache.get(PremiumKey("500", "GAP", "GC1")) == 3
+    assert invalidation.apply({"cache": "premium", "match": {"agent_code": "500", "category_code": "GC2"}}) == 0
+
+
+def test_apply_without_match_drops_everything():
+    cache = premium_cache()
+    assert CacheInvalidation({"premium": cache}, dsn=None).apply({"cache": "premium", "match": {}}) == 3
+    assert len(cache) == 0
+
+
+def test_apply_key_discards_one_entry():
+    cache = TTLCache(max_entries=10, ttl_seconds=60)
+    cache.set("100000018", "quote")
+    invalidation = CacheInvalidation({"quote": cache}, dsn=None)
+    assert invalidation.apply({"cache": "quote", "key": "100000018"}) == 1
+    assert invalidation.apply({"cache": "quote", "key": "100000018"}) == 0
+    assert invalidation.apply({"cache": "unknown", "key": "100000018"}) == 0
@@ -0,0 +1,94 @@
+import asyncio
+import gzip
+import json
+import os
+import sys
+from datetime import datetime
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from claude_code_demo.database import PolicyStatus  # noqa: E402
+from claude_code_demo.purge import (  # noqa: E402
+    ARCHIVE_SUFFIX, PENDING_SUFFIX, _archived_ids, _write_pending_archive, recover_pending_archives,
+)
+
+
+def archived_quote(quote_id: int) -> dict:
+    return {
+        "id": quote_id,
+        "quote_ref": f"1000{quote_id:04d}",
+        "policy_status": PolicyStatus.CREATED,
+        "created_at": datetime(2026, 8, 1, 9, 30),
+        "gap_premium": {"wholesale_amount": Decimal("200.00")},
+    }
+
+
+class FakeResult:
+    def __init__(self, row):
+        self.row = row
+
+    def first(self):
+        return self.row
+
+
+class FakeConnection:
+    """Connection answering the remaining-quote lookup from a set of ids still in the database"""
+
+    def __init__(self, remaining_ids=()):
+        self.remaining_ids = set(remaining_ids)
+        self.looked_up: list[list[int]] = []
+        self.rollbacks = 0
+
+    async def execute(self, statement):
+        ids = statement.compile().params["ids"]
+        self.looked_up.append(ids)
+        found = sorted(self.remaining_ids.intersection(ids))
+        return FakeResult((found[0],) if found else None)
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+
+def test_pending_archive_round_trips_its_ids(tmp_path):
+    path = _write_pending_archive(str(tmp_path), [archived_quote(quote_id) for quote_id in (7, 8, 12)])
+
+    assert os.path.basename(path) == f"quotes-000000000007-000000000012{ARCHIVE_SUFFIX}{PENDING_SUFFIX}"
+    assert _archived_ids(path) == [7, 8, 12]
+    with gzip.open(path, "rt") as f:
+        first = json.loads(f.readline())
+    assert first["policy_status"] == "CREATED"
+    assert first["created_at"] == "2026-08-01T09:30:00"
+    assert first["gap_premium"] == {"wholesale_amount": "200.00"}
+    # Written through a temporary file that does not survive
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+
+
+def test_committed_batch_archive_is_kept(tmp_path):
+    path = _write_pending_archive(str(tmp_path), [archived_quote(quote_id) for quote_id in (1, 2)])
+    conn = FakeConnection(remaining_ids=[3])
+
+    asyncio.run(recover_pending_archives(conn, str(tmp_path)))
+
+    assert conn.looked_up == [[1, 2]] and conn.rollbacks == 1
+    assert os.listdir(tmp_path) == [os.path.basename(path)[:-len(PENDING_SUFFIX)]]
+
+
+def test_rolled_back_batch_archive_is_discarded(tmp_path):
+    _write_pending_archive(str(tmp_path), [archived_quote(quote_id) for quote_id in (1, 2)])
+    conn = FakeConnection(remaining_ids=[2])
+
+    asyncio.run(recover_pending_archives(conn, str(tmp_path)))
+
+    assert conn.looked_up == [[1, 2]] and conn.rollbacks == 1
+    assert os.listdir(tmp_path) == []
+
+
+def test_only_pending_archives_are_recovered(tmp_path):
+    finished = tmp_path / f"quotes-000000000001-000000000002{ARCHIVE_SUFFIX}"
+    finished.write_bytes(gzip.compress(b""))
+    conn = FakeConnection()
+
+    asyncio.run(recover_pending_archives(conn, str(tmp_path)))
+
+    assert conn.looked_up == []
+    assert finished.exists()
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from claude_code_demo.quote_ref import SequenceQuoteRefGenerator, create_quote_ref_generator, luhn_check_digit  # noqa: E402
+
+
+def test_luhn_check_digit():
+    assert luhn_check_digit("7992739871") == "3"
+    assert luhn_check_digit("10000000") == "9"
+
+
+def test_sequence_generator_is_the_default(monkeypatch):
+    monkeypatch.delenv("QUOTE_REF_GENERATOR", raising=False)
+    assert isinstance(create_quote_ref_generator(), SequenceQuoteRefGenerator)
+
+
+@pytest.mark.parametrize("kind", ["random", "uuid"])
+def test_other_generators_are_refused(monkeypatch, kind):
+    monkeypatch.setenv("QUOTE_REF_GENERATOR", kind)
+    with pytest.raises(ValueError):
+        create_quote_ref_generator()
@@ -0,0 +1,77 @@
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from claude_code_demo import quotes  # noqa: E402
+from claude_code_demo.models import GapStoredQuoteResponse  # noqa: E402
+from claude_code_demo.quotes import QuoteCache, StoredQuote, load_current_quote  # noqa: E402
+
+CREATED_AFTER = datetime(2026, 9, 18)
+
+
+def stored(status: str) -> StoredQuote:
+    return StoredQuote("499", GapStoredQuoteResponse.model_construct(quoteRef="1", policyStatus=status))
+
+
+class FakeDatabases:
+    """Stand-in for load_quote and async_session, the replica lagging behind a bind on the primary"""
+
+    def __init__(self):
+        self.replica = object()
+        self.reads: list[str] = []
+
+    async def load_quote(self, db, quote_ref, created_after):
+        source = "replica" if db is self.replica else "primary"
+        self.reads.append(source)
+        return stored("CREATED" if source == "replica" else "CONVERTED")
+
+    def async_session(self):
+        databases = self
+
+        class Session:
+            async def __aenter__(self):
+                return databases
+
+            async def __aexit__(self, *exc):
+                pass
+
+        return Session()
+
+
+def load(cache: QuoteCache, databases: FakeDatabases, monkeypatch) -> StoredQuote:
+    monkeypatch.setattr(quotes, "load_quote", databases.load_quote)
+    monkeypatch.setattr(quotes, "async_session", databases.async_session)
+    return asyncio.run(cache.get_or_load(
+        "1", lambda: load_current_quote(databases.replica, "1", CREATED_AFTER, cache)
+    ))
+
+
+def test_lagging_replica_is_not_cached_after_bind(monkeypatch):
+    cache, databases = QuoteCache(max_entries=10, ttl_seconds=60, tombstone_seconds=300), FakeDatabases()
+    cache.discard("1")
+
+    assert load(cache, databases, monkeypatch).response.policyStatus == "CONVERTED"
+    assert databases.reads == ["replica", "primary"]
+    assert cache.get("1").response.policyStatus == "CONVERTED"
+
+
+def test_quote_not_bound_here_is_read_from_the_replica(monkeypatch):
+    cache, databases = QuoteCache(max_entries=10, ttl_seconds=60, tombstone_seconds=300), FakeDatabases()
+
+    assert load(cache, databases, monkeypatch).response.policyStatus == "CREATED"
+    assert databases.reads == ["replica"]
+
+
+def test_tombstones_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(quotes.time, "monotonic", lambda: now[0])
+    cache = QuoteCache(max_entries=10, ttl_seconds=60, tombstone_seconds=300)
+    cache.discard("1")
+    now[0] += 301
+    cache.discard("2")
+
+    assert not cache.recently_discarded("1") and cache.recently_discarded("2")
+    # Expired tombstones are pruned as new ones are added
+    assert cache.snapshot()["tombstones"] == 1
@@ -0,0 +1,215 @@
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from benchmarks.stubs import rating_app  # noqa: E402
+from claude_code_demo import resilience  # noqa: E402
+from claude_code_demo.cache import TTLCache  # noqa: E402
+from claude_code_demo.models import MaxShortfall  # noqa: E402
+from claude_code_demo.rating import PremiumKey, load_premium_table  # noqa: E402
+from claude_code_demo.resilience import CircuitBreaker, CircuitOpenError, ResilientTransport, RetryBudget  # noqa: E402
+
+KEY = PremiumKey(agent_code="499", rate_card_code="GAP", category_code="GC1")
+
+
+class Clock:
+    """Stand-in for time.monotonic in the resilience module, moved on by hand"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def stub_faults():
+    """Restore the stub rating engine faults changed by a test"""
+    saved = dict(rating_app.state.faults)
+    yield rating_app.state.faults
+    rating_app.state.faults.clear()
+    rating_app.state.faults.update(saved)
+
+
+def create_transport(handler, breaker=None, budget=None, **options) -> ResilientTransport:
+    return ResilientTransport(
+        httpx.MockTransport(handler),
+        breaker=breaker or CircuitBreaker(failure_threshold=0),
+        budget=budget or RetryBudget(),
+        **{"backoff_seconds": 0.0, **options},
+    )
+
+
+def create_client(handler, breaker=None, budget=None, **options) -> httpx.AsyncClient:
+    return httpx.AsyncClient(base_url="http://rating", transport=create_transport(handler, breaker, budget, **options))
+
+
+def failing(calls: list):
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(503)
+    return handler
+
+
+def test_breaker_opens_after_threshold_failures(clock):
+    calls = []
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30)
+
+    async def run():
+        async with create_client(failing(calls), breaker=breaker, max_attempts=1) as client:
+            for _ in range(3):
+                assert (await client.get("/premium")).status_code == 503
+            with pytest.raises(CircuitOpenError):
+                await client.get("/premium")
+
+    asyncio.run(run())
+    assert len(calls) == 3
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.rejected == 1
+
+
+def test_failed_half_open_trial_reopens_breaker(clock):
+    calls = []
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+
+    async def run():
+        async with create_client(failing(calls), breaker=breaker, max_attempts=1) as client:
+            await client.get("/premium")
+            assert breaker.state == CircuitBreaker.OPEN
+            clock.now += 30
+            # The trial call is sent and fails, so the circuit opens again
+            assert (await client.get("/premium")).status_code == 503
+            assert breaker.state == CircuitBreaker.OPEN
+            with pytest.raises(CircuitOpenError):
+                await client.get("/premium")
+
+    asyncio.run(run())
+    assert len(calls) == 2
+    assert breaker.opened == 2
+
+
+def test_successful_half_open_trial_closes_breaker(clock):
+    responses = [503, 200]
+
+    async def run():
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+        handler = lambda request: httpx.Response(responses.pop(0))  # noqa: E731
+        async with create_client(handler, breaker=breaker, max_attempts=1) as client:
+            await client.get("/premium")
+            clock.now += 30
+            assert (await client.get("/premium")).status_code == 200
+        return breaker
+
+    assert asyncio.run(run()).state == CircuitBreaker.CLOSED
+
+
+def test_retries_stop_when_budget_is_spent(clock):
+    calls = []
+    # One retry per 10 second window, whatever the request rate
+    budget = RetryBudget(ratio=0, min_per_second=0.1, window_seconds=10)
+
+    async def run():
+        async with create_client(failing(calls), budget=budget, max_attempts=3) as client:
+            assert (await client.get("/premium")).status_code == 503
+            first = len(calls)
+            assert (await client.get("/premium")).status_code == 503
+            return first, len(calls) - first
+
+    assert asyncio.run(run()) == (2, 1)
+    assert budget.exhausted == 2
+
+
+def test_retry_returns_later_success():
+    responses = [503, 200]
+
+    async def run():
+        handler = lambda request: httpx.Response(responses.pop(0))  # noqa: E731
+        async with create_client(handler, max_attempts=2) as client:
+            return (await client.get("/premium")).status_code
+
+    assert asyncio.run(run()) == 200
+
+
+def test_hedge_returns_first_good_response():
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        if len(calls) == 1:
+            await asyncio.sleep(5)
+            return httpx.Response(200, json={"attempt": 1})
+        return httpx.Response(200, json={"attempt": 2})
+
+    transport = create_transport(handler, hedge_percentile=50, hedge_min_seconds=0.01)
+
+    async def run():
+        for _ in range(20):
+            transport.latency.observe(0.01)
+        async with httpx.AsyncClient(base_url="http://rating", transport=transport) as client:
+            started = time.perf_counter()
+            response = await client.get("/premium")
+            return response.json(), time.perf_counter() - started
+
+    body, elapsed = asyncio.run(run())
+    assert body == {"attempt": 2}
+    assert elapsed < 1
+    assert len(calls) == 2
+    assert transport.in_flight == 0
+
+
+def test_post_is_not_retried():
+    calls = []
+
+    async def run():
+        async with create_client(failing(calls), max_attempts=3) as client:
+            return (await client.post("/premium")).status_code
+
+    assert asyncio.run(run()) == 503
+    assert len(calls) == 1
+
+
+def test_stale_if_error_serves_last_good_premiums(stub_faults):
+    stub_faults.update(latency_ms=0, error_rate=0, slow_rate=0)
+    cache = TTLCache(max_entries=10, ttl_seconds=0.05, stale_if_error_seconds=60)
+
+    async def run():
+        transport = httpx.ASGITransport(app=rating_app)
+        async with httpx.AsyncClient(base_url="http://rating", transport=transport) as client:
+            fresh = await cache.get_or_load(KEY, lambda: load_premium_table(client, KEY))
+            await asyncio.sleep(0.1)
+            stub_faults["error_rate"] = 1
+            stale = await cache.get_or_load(KEY, lambda: load_premium_table(client, KEY))
+            return fresh, stale
+
+    fresh, stale = asyncio.run(run())
+    assert stale is fresh
+    assert stale.premium_for(MaxShortfall.GAP_5000.value).retailAmount > 0
+    assert cache.stats.stale_if_error_hits == 1
+
+
+def test_stale_if_error_off_raises(stub_faults):
+    stub_faults.update(latency_ms=0, error_rate=0, slow_rate=0)
+    cache = TTLCache(max_entries=10, ttl_seconds=0.05)
+
+    async def run():
+        transport = httpx.ASGITransport(app=rating_app)
+        async with httpx.AsyncClient(base_url="http://rating", transport=transport) as client:
+            await cache.get_or_load(KEY, lambda: load_premium_table(client, KEY))
+            await asyncio.sleep(0.1)
+            stub_faults["error_rate"] = 1
+            await cache.get_or_load(KEY, lambda: load_premium_table(client, KEY))
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(run())
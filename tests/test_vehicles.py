@@ -0,0 +1,99 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from claude_code_demo.vehicles import StubVehicleProvider, VehicleLookupService, VehicleNotFound  # noqa: E402
+
+
+class FakeSessions:
+    """Session factory recording statements and how many sessions are open"""
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.open = 0
+        self.statements = []
+        self.commits = 0
+
+    def __call__(self):
+        return FakeSession(self)
+
+
+class FakeSession:
+    def __init__(self, sessions: FakeSessions):
+        self.sessions = sessions
+
+    async def __aenter__(self):
+        self.sessions.open += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.sessions.open -= 1
+
+    async def execute(self, statement):
+        self.sessions.statements.append(statement)
+        return self.sessions.rows if statement.is_select else None
+
+    async def commit(self):
+        self.sessions.commits += 1
+
+
+class CheckingProvider(StubVehicleProvider):
+    """Stub provider failing the test when called with a database session open"""
+
+    def __init__(self, sessions: FakeSessions, unknown=()):
+        super().__init__(unknown)
+        self.sessions = sessions
+        self.open_during_calls = []
+
+    async def lookup(self, rego_or_vin):
+        self.open_during_calls.append(self.sessions.open)
+        await asyncio.sleep(0)
+        return await super().lookup(rego_or_vin)
+
+
+def create_service(sessions: FakeSessions, provider) -> VehicleLookupService:
+    return VehicleLookupService(
+        provider, ttl_seconds=60, negative_ttl_seconds=10, memory_max_entries=100, memory_ttl_seconds=60,
+        session_factory=sessions,
+    )
+
+
+def test_provider_is_called_without_a_session_open():
+    sessions = FakeSessions()
+    provider = CheckingProvider(sessions, unknown=["ZZZ999"])
+    service = create_service(sessions, provider)
+
+    found = asyncio.run(service.lookup_many(["MKD546", "abc-123", "ZZZ999"]))
+
+    assert provider.open_during_calls == [0, 0, 0]
+    assert found["ZZZ999"] is None and found["MKD546"].make == "HONDA"
+    # One read, then one upsert of the three answers in its own transaction
+    assert [statement.is_select for statement in sessions.statements] == [True, False]
+    assert sessions.commits == 1
+    assert sessions.open == 0
+
+
+def test_table_hits_skip_the_provider_and_the_upsert():
+    details = asyncio.run(StubVehicleProvider().lookup("MKD546"))
+    sessions = FakeSessions(rows=[("MKD546", details.model_dump(mode="json"))])
+    provider = CheckingProvider(sessions)
+    service = create_service(sessions, provider)
+
+    assert asyncio.run(service.lookup("mkd 546")).registration == "MKD546"
+    assert provider.calls == 0
+    assert len(sessions.statements) == 1 and sessions.commits == 0
+
+
+def test_unknown_vehicle_raises():
+    sessions = FakeSessions()
+    service = create_service(sessions, CheckingProvider(sessions, unknown=["ZZZ999"]))
+
+    async def run():
+        try:
+            await service.lookup("ZZZ999")
+        except VehicleNotFound:
+            return True
+        return False
+
+    assert asyncio.run(run())
@@ -0,0 +1,243 @@
+import asyncio
+import glob
+import json
+import os
+import sys
+from datetime import datetime
+
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from claude_code_demo.models import GapPremium, GapQuoteResponse, VehicleDetails  # noqa: E402
+from claude_code_demo.write_behind import PendingQuote, QuoteWriteBehind, _lock  # noqa: E402
+
+
+def pending(ref: str) -> PendingQuote:
+    return PendingQuote(
+        created_at=datetime(2026, 10, 18, 12, 0, 0),
+        rego_or_vin="MKD546",
+        max_shortfall="GAP_10000",
+        agent_code="499",
+        brand_code="B",
+        user_code="U",
+        response=GapQuoteResponse(
+            quoteRef=ref,
+            quoteExpiryDate="2026-11-17",
+            gstRate="15",
+            vehicleDetails=VehicleDetails(
+                registration="MKD546", vin="MRHGK5860GP020199", make="HONDA", model="JAZZ", year="2015",
+                ccRating="1497", fuelType="Petrol", odometerReading="89655", bodyColour="RED", bodyStyle="Hatchback"
+            ),
+            gapPremium=GapPremium(wholesaleAmount=200.0, retailAmount=400.0),
+        ),
+    )
+
+
+class FakeDatabase:
+    """Stand-in for QuoteWriteBehind._write, rejecting some quotes or failing every write"""
+
+    def __init__(self):
+        self.written: list[str] = []
+        self.rejected: set[str] = set()
+        self.down = False
+        self.calls = 0
+
+    async def write(self, batch: list[PendingQuote]) -> None:
+        self.calls += 1
+        if self.down:
+            raise OperationalError("INSERT", {}, ConnectionRefusedError("connection refused"))
+        refs = [quote.response.quoteRef for quote in batch]
+        if self.rejected.intersection(refs):
+            raise IntegrityError("INSERT", {}, Exception("violates check constraint"))
+        self.written.extend(refs)
+
+
+def create_queue(directory, database: FakeDatabase, **options) -> QuoteWriteBehind:
+    queue = QuoteWriteBehind(
+        directory=str(directory),
+        batch_size=options.pop("batch_size", 100),
+        # Long enough for the background task to stay out of the way of the test
+        flush_interval_seconds=60.0,
+        segment_bytes=options.pop("segment_bytes", 1024 * 1024),
+        fsync=options.pop("fsync", False),
+        bind_wait_seconds=0.0,
+        **options,
+    )
+    queue._write = database.write
+    return queue
+
+
+def segments(directory) -> list[str]:
+    return sorted(glob.glob(os.path.join(str(directory), "quotes-*.jsonl")))
+
+
+def test_queued_quotes_are_written_and_segment_deleted(tmp_path):
+    database = FakeDatabase()
+
+    async def run():
+        queue = create_queue(tmp_path, database, fsync=True)
+        await queue.start()
+        for ref in ("1", "2", "3"):
+            assert await queue.put(pending(ref))
+        assert queue.lookup("2").agent_code == "499"
+        await queue.flush()
+        assert len(queue) == 0 and queue.lookup("2") is None
+        await queue.close()
+
+    asyncio.run(run())
+    assert database.written == ["1", "2", "3"]
+    assert segments(tmp_path) == []
+
+
+def test_flush_writes_only_up_to_the_quote(tmp_path):
+    database = FakeDatabase()
+
+    async def run():
+        queue = create_queue(tmp_path, database)
+        await queue.start()
+        for ref in ("1", "2", "3", "4"):
+            await queue.put(pending(ref))
+        await queue.flush("2")
+        written, left = list(database.written), list(queue._queued)
+        # A quote no longer queued needs no write
+        await queue.flush("1")
+        calls = database.calls
+        await queue.close()
+        return written, left, calls
+
+    assert asyncio.run(run()) == (["1", "2"], ["3", "4"], 1)
+
+
+def test_full_queue_returns_false(tmp_path):
+    database = FakeDatabase()
+
+    async def run():
+        queue = create_queue(tmp_path, database, max_pending=2)
+        await queue.start()
+        results = [await queue.put(pending(ref)) for ref in ("1", "2", "3")]
+        stats = queue.snapshot()
+        await queue.close()
+        return results, stats
+
+    results, stats = asyncio.run(run())
+    assert results == [True, True, False]
+    assert stats["full"] == 1 and stats["pending"] == 2
+    assert database.written == ["1", "2"]
+
+
+def test_unavailable_database_keeps_quotes_queued(tmp_path):
+    database = FakeDatabase()
+    database.down = True
+
+    async def run():
+        queue = create_queue(tmp_path, database)
+        await queue.start()
+        for ref in ("1", "2"):
+            await queue.put(pending(ref))
+        assert await queue._drain(raise_errors=False) is False
+        with pytest.raises(OperationalError):
+            await queue.flush("2")
+        left = list(queue._queued)
+        database.down = False
+        assert await queue._drain(raise_errors=False) is True
+        stats = queue.snapshot()
+        await queue.close()
+        return left, stats
+
+    left, stats = asyncio.run(run())
+    assert left == ["1", "2"]
+    assert database.written == ["1", "2"]
+    assert stats["write_failures"] == 2 and stats["dead_lettered"] == 0
+
+
+def test_rejected_quote_is_retried_then_dead_lettered(tmp_path):
+    database = FakeDatabase()
+    database.rejected.add("2")
+
+    async def run():
+        queue = create_queue(tmp_path, database, max_attempts=3)
+        await queue.start()
+        for ref in ("1", "2", "3"):
+            await queue.put(pending(ref))
+        # The good quotes are written one at a time around the rejected one
+        assert await queue._drain(raise_errors=False) is True
+        after_first = (list(database.written), list(queue._queued))
+        await queue._drain(raise_errors=False)
+        assert "2" in queue._queued
+        await queue._drain(raise_errors=False)
+        stats = queue.snapshot()
+        await queue.close()
+        return after_first, stats
+
+    after_first, stats = asyncio.run(run())
+    assert after_first == (["1", "3"], ["2"])
+    assert stats["dead_lettered"] == 1 and stats["pending"] == 0
+    with open(tmp_path / "dead-letter.jsonl") as f:
+        records = [json.loads(line) for line in f]
+    assert [record["quote"]["response"]["quoteRef"] for record in records] == ["2"]
+    assert "check constraint" in records[0]["error"]
+    assert segments(tmp_path) == []
+
+
+def test_unlocked_segment_is_recovered_and_truncated_line_skipped(tmp_path):
+    database = FakeDatabase()
+    # Segment left by a worker that died while appending its last line
+    path = tmp_path / "quotes-1-1.jsonl"
+    lines = [pending(ref).model_dump_json() for ref in ("1", "2")]
+    path.write_text(lines[0] + "\n" + lines[1] + "\n" + pending("3").model_dump_json()[:40])
+
+    async def run():
+        queue = create_queue(tmp_path, database)
+        await queue.start()
+        recovered = (queue.stats.recovered, list(queue._queued))
+        await queue.flush()
+        await queue.close()
+        return recovered
+
+    assert asyncio.run(run()) == (2, ["1", "2"])
+    assert database.written == ["1", "2"]
+    assert not path.exists()
+
+
+def test_locked_segment_is_left_to_its_worker(tmp_path):
+    database = FakeDatabase()
+    path = tmp_path / "quotes-1-1.jsonl"
+    path.write_text(pending("1").model_dump_json() + "\n")
+    # A live worker holds the lock on its segment
+    fd = _lock(str(path))
+
+    async def run():
+        queue = create_queue(tmp_path, database)
+        await queue.start()
+        queued = len(queue)
+        await queue.close()
+        return queued
+
+    try:
+        assert asyncio.run(run()) == 0
+    finally:
+        os.close(fd)
+    assert path.exists()
+    assert database.written == []
+
+
+def test_full_segments_are_rotated_and_deleted_once_written(tmp_path):
+    database = FakeDatabase()
+    size = len(pending("1").model_dump_json()) + 1
+
+    async def run():
+        queue = create_queue(tmp_path, database, segment_bytes=size * 2, fsync=True)
+        await queue.start()
+        for ref in ("1", "2", "3", "4", "5"):
+            await queue.put(pending(ref))
+        rotated = len(segments(tmp_path))
+        await queue.flush()
+        # Only the segment still being appended to is left
+        left = len(segments(tmp_path))
+        await queue.close()
+        return rotated, left
+
+    assert asyncio.run(run()) == (3, 1)
+    assert database.written == ["1", "2", "3", "4", "5"]
+    assert segments(tmp_path) == []